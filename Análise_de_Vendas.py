@@ -1,26 +1,81 @@
-import pandas as pd
-from sqlalchemy import create_engine
-import urllib
-import pyodbc
-import streamlit as st
-import plotly.express as px
-from datetime import datetime, timedelta
+from datetime import timedelta
 import locale
-
-# Configuração de conexão com o banco de dados
-DADOS_CONEXAO = (
-    "Driver={SQL Server};"
-    "Server=DUXPC;"
-    "Database=teste2;"
-    "Trusted_Connection=yes;"
-)
+import os
+import time
+import perfil_inicializacao as perfil
+
+PAGINA = "Análise_de_Vendas"
+perfil.iniciar(PAGINA)
+
+# Os imports pesados são cronometrados na primeira execução do processo.
+# O pyodbc não é importado aqui: o dialeto mssql+pyodbc do SQLAlchemy o carrega
+# apenas na primeira conexão.
+with perfil.medir_importacoes(PAGINA):
+    import pandas as pd
+    import streamlit as st
+    import plotly.express as px
+    # Consultas em paralelo nos bancos das lojas, com o cache das KPIs
+    # invalidado por marca d'água em cada conexão
+    import lojas
+
+# Lojas consultadas neste rerun (todas no consolidado ou apenas a escolhida)
+# e as que não responderam
+lojas_consulta = list(lojas.LOJAS)
+lojas_com_erro = {}
+
+# Espera depois de uma mudança no slider antes de consultar o banco (segundos).
+# Arrastando o slider, cada posição gera um rerun; as posições intermediárias são
+# substituídas dentro dessa espera e não chegam a consultar o banco.
+ESPERA_SLIDER = float(os.environ.get("KPIS_ESPERA_SLIDER", "0.4"))
+
+# Elemento vazio atualizado enquanto as consultas rodam. Cada atualização passa
+# pelo Streamlit, que interrompe este rerun (RerunException) quando outro já foi
+# pedido; as consultas em andamento são então canceladas no servidor.
+marcador_interrupcao = None
+
+def verificar_interrupcao():
+    if marcador_interrupcao is not None:
+        marcador_interrupcao.empty()
+
+# Função para esperar o período parar de mudar, interrompendo o rerun se chegar outro
+def aguardar_slider(segundos):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        time.sleep(0.05)
+        verificar_interrupcao()
+
+# Função para executar a consulta nas lojas selecionadas. Com mais de uma loja
+# as linhas de cada uma vêm empilhadas (coluna Loja) e são combinadas por quem chamou.
+def consultar_lojas(consulta_sql, tabelas, data_inicio=None, data_fim=None):
+    dados = lojas.consultar(consulta_sql, tabelas, data_inicio, data_fim, lojas=lojas_consulta,
+                            verificar=verificar_interrupcao)
+    lojas_com_erro.update(dados.attrs.get("lojas_com_erro", {}))
+    return dados
+
+# Texto com a origem dos números (réplica ou primário) e o atraso da réplica
+def descrever_replica(estado):
+    if estado.atraso_s is None:
+        atraso = "atraso desconhecido"
+    elif estado.atraso_s < 60:
+        atraso = f"atraso de ~{estado.atraso_s:.0f} s"
+    else:
+        atraso = f"atraso de ~{estado.atraso_s / 60:.0f} min"
+    if estado.em_uso:
+        if not estado.vendas_pendentes:
+            return "números da réplica de leitura, em dia com o primário"
+        return f"números da réplica de leitura, {estado.vendas_pendentes} vendas ainda não replicadas ({atraso})"
+    if estado.erro:
+        return "réplica indisponível, números lidos do primário"
+    return f"réplica atrasada ({atraso}), números lidos do primário"
+
+# TOP n direto no banco só com uma loja; com várias, cada loja devolve o
+# agrupamento completo para o ranking ser refeito sobre as somas
+def topo(n):
+    return f"TOP {n}" if len(lojas_consulta) == 1 else ""
 
 # Função para conectar ao banco de dados e executar a consulta
 def get_data():
     try:
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-        
         # Consulta SQL
         query = """
     WITH Top_Clientes AS (
@@ -79,6 +134,7 @@ def get_data():
     )
     SELECT 
         tc.Cliente, 
+        tc.Total_Compras,
         tp.Produto, 
         CAST(tp.Total_Produtos AS INT) AS Total_Produtos,
         CAST(tm.Ticket_Medio AS DECIMAL(10,2)) AS Ticket_Medio  -- Adiciona o ticket médio ao resultado
@@ -96,9 +152,18 @@ def get_data():
         """
 
         # Executar a consulta e armazenar os resultados em um DataFrame
-        df = pd.read_sql(query, engine )
+        df = consultar_lojas(query, ["Vendas", "Vendas_Itens"])
 
-        return df
+        if len(lojas_consulta) > 1:
+            # Os clientes de cada loja são distintos, então o top 5 geral está
+            # entre os top 5 de cada loja: basta reordenar a união
+            df['Cliente'] = df['Cliente'] + ' (' + df['Loja'] + ')'
+            clientes = df.drop_duplicates('Cliente').nlargest(5, 'Total_Compras')['Cliente']
+            df = df[df['Cliente'].isin(clientes)].sort_values(
+                ['Total_Compras', 'Cliente', 'Total_Produtos'], ascending=[False, True, False]
+            )
+
+        return df.drop(columns=['Total_Compras', 'Loja']).reset_index(drop=True)
 
     except Exception as e:
         st.error(f"Erro ao executar a consulta: {e}")
@@ -160,7 +225,14 @@ def display_metric(title, value, subtitle, subtitle2, target, change, is_positiv
     </div>
     """, unsafe_allow_html=True)
 
-def display_metric2(title, value):
+# Linha com a variação sobre o período de referência (ou espaço em branco sem variação)
+def linha_variacao(variacao, font_size):
+    if not variacao:
+        return f'<p style="color: #c8d6dd; font-size: {font_size}px; margin-top: -10px;">|</p>'
+    cor = "red" if variacao.startswith("-") else "green"
+    return f'<p style="color: {cor}; font-size: {font_size}px; font-weight: bold; margin-top: -10px;">{variacao} vs. referência</p>'
+
+def display_metric2(title, value, variacao=None):
     # Formatação do valor para exibir com porcentagem
     formatted_value = f"R$ {value:,.2f}".replace('.', ',').replace(',', '.', 1)
 
@@ -171,14 +243,14 @@ def display_metric2(title, value):
         <p style="color: #c8d6dd; font-size: 15px; margin-top: -10px;">|</p>
         <p style="color: #c8d6dd; font-size: 17px; margin-top: -10px;">|</p>
         <p style="font-size: 45px; color: black; font-weight: bold; margin: 0;">{formatted_value}</p>
-        <p style="color: #c8d6dd; font-size: 18px; margin-top: -10px;">|</p>
+        {linha_variacao(variacao, 18)}
         <p style="color: #c8d6dd; font-size: 18px; margin-top: -10px;">|</p>
         
         
     </div>
     """, unsafe_allow_html=True)    
 
-def display_metric3(title, subtitle, subtitle2):
+def display_metric3(title, subtitle, subtitle2, variacao=None):
 
     # Exibe a métrica no layout
     st.markdown(f"""
@@ -187,7 +259,7 @@ def display_metric3(title, subtitle, subtitle2):
         <p style="color: #c8d6dd; font-size: 15px; margin-top: -10px;">|</p>
         <p style="color: black; font-size: 20px; margin-top: -10px;">{subtitle}</p>
         <p style="font-size: 35px; color: black; font-weight: bold; margin: 0;">QTDE Vendida:{subtitle2}</p>
-        <p style="color: #c8d6dd; font-size: 18px; margin-top: -10px;">|</p>
+        {linha_variacao(variacao, 18)}
         <p style="color: #c8d6dd; font-size: 24px; margin-top: -10px;">|</p>
         
         
@@ -197,9 +269,6 @@ def display_metric3(title, subtitle, subtitle2):
 # Função para obter os limites de data no banco de dados
 def obter_limites_data():
     try:
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-
         consulta_limites = """
         SELECT 
             MIN(data_cx) AS menor_data,
@@ -209,228 +278,326 @@ def obter_limites_data():
         """
 
         # Executar a consulta e obter os resultados
-        limites = pd.read_sql(consulta_limites, engine)
+        limites = consultar_lojas(consulta_limites, ["Vendas"])
 
-        # Converter os resultados para o tipo datetime.date
-        menor_data = limites.iloc[0]['menor_data'].date() if pd.notna(limites.iloc[0]['menor_data']) else None
-        maior_data = limites.iloc[0]['maior_data'].date() if pd.notna(limites.iloc[0]['maior_data']) else None
+        # Converter os resultados para o tipo datetime.date (menor e maior data entre as lojas)
+        menor_data = limites['menor_data'].min()
+        maior_data = limites['maior_data'].max()
+        menor_data = menor_data.date() if pd.notna(menor_data) else None
+        maior_data = maior_data.date() if pd.notna(maior_data) else None
 
         return menor_data, maior_data
     except Exception as e:
         print(f"Erro ao obter os limites de data: {e}")
         return None, None
 
-# Função para obter os dados do primeiro gráfico
-def obter_dados_vendas(data_inicio, data_fim):
+# Condição SQL de um período, com as datas no formato aceito pelo SQL Server
+def condicao_periodo(coluna, inicio, fim):
+    return f"{coluna} BETWEEN '{inicio.strftime('%d-%m-%Y')}' AND '{fim.strftime('%d-%m-%Y')}'"
+
+# Período coberto pelas duas faixas (selecionada e de referência), usado na
+# invalidação do cache: uma alteração em qualquer uma delas afeta o resultado
+def abrangencia(data_inicio, data_fim, referencia_inicio, referencia_fim):
+    return min(data_inicio, referencia_inicio), max(data_fim, referencia_fim)
+
+# Mesma data no ano anterior (29/02 vira 28/02)
+def ano_anterior(data):
+    try:
+        return data.replace(year=data.year - 1)
+    except ValueError:
+        return data.replace(year=data.year - 1, day=28)
+
+# Tipos de comparação oferecidos na página
+COMPARACOES = ["Período anterior (mesma duração)", "Mesmo período do ano anterior", "Período personalizado"]
+
+# Função para calcular o período de referência da comparação
+def calcular_periodo_referencia(data_inicio, data_fim, tipo_comparacao, periodo_personalizado=None):
+    if tipo_comparacao == COMPARACOES[1]:
+        return ano_anterior(data_inicio), ano_anterior(data_fim)
+    if tipo_comparacao == COMPARACOES[2] and periodo_personalizado and len(periodo_personalizado) == 2:
+        return periodo_personalizado[0], periodo_personalizado[1]
+    dias = (data_fim - data_inicio).days + 1
+    return data_inicio - timedelta(days=dias), data_inicio - timedelta(days=1)
+
+# Variação percentual do período selecionado sobre o de referência (None sem base de comparação)
+def variacao_percentual(atual, referencia):
+    if referencia is None or pd.isna(referencia) or referencia == 0:
+        return None
+    atual = 0 if atual is None or pd.isna(atual) else atual
+    return (atual - referencia) / referencia * 100.0
+
+def texto_variacao(atual, referencia):
+    variacao = variacao_percentual(atual, referencia)
+    if variacao is None:
+        return "novo" if atual and pd.notna(atual) else ""
+    return f"{variacao:+.1f}%".replace('.', ',')
+
+def formatar_moeda(valor):
+    return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+# Rótulos "valor (variação)" para cada barra, ponto ou fatia
+def rotulos_com_variacao(atuais, referencias, formatar=str):
+    rotulos = []
+    for atual, referencia in zip(atuais, referencias):
+        variacao = texto_variacao(atual, referencia)
+        rotulos.append(f"{formatar(atual)} ({variacao})" if variacao else formatar(atual))
+    return rotulos
+
+# Função para obter os dados do primeiro gráfico.
+# Os dois períodos saem da mesma leitura da tabela, com agregação condicional.
+def obter_dados_vendas(data_inicio, data_fim, referencia_inicio, referencia_fim):
     try:
-        data_inicio_formatada = data_inicio.strftime('%d-%m-%Y')
-        data_fim_formatada = data_fim.strftime('%d-%m-%Y')
+        periodo_atual = condicao_periodo('data_cx', data_inicio, data_fim)
+        periodo_referencia = condicao_periodo('data_cx', referencia_inicio, referencia_fim)
         
         consulta_sql = f"""
         WITH Totalizaçao AS (
             SELECT 
                 DATEPART(HOUR, Vendas.Hora) AS hora,
-                COUNT(id_venda) AS valor
+                COUNT(CASE WHEN {periodo_atual} THEN id_venda END) AS valor,
+                COUNT(CASE WHEN {periodo_referencia} THEN id_venda END) AS valor_referencia
             FROM Vendas
-            WHERE TRY_CONVERT(datetime, data_cx) BETWEEN '{data_inicio_formatada}' AND '{data_fim_formatada}'
+            WHERE ({periodo_atual} OR {periodo_referencia})
               AND (CAST(Vendas.Hora AS TIME) BETWEEN '05:00:00' AND '23:00:00')
             GROUP BY DATEPART(HOUR, Vendas.Hora)
         )
         SELECT 
             FORMAT(GETDATE(), 'dd/MM/yyyy') AS Data,
             CONCAT(FORMAT(hora, '00'), ':00') AS Horas,
-            SUM(valor) AS QTDE
+            SUM(valor) AS QTDE,
+            SUM(valor_referencia) AS QTDE_Referencia
         FROM Totalizaçao
         WHERE hora BETWEEN 5 AND 22
         GROUP BY hora
         ORDER BY hora;
         """
         
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-
-        dados = pd.read_sql(consulta_sql, engine)
+        dados = consultar_lojas(consulta_sql, ["Vendas"], *abrangencia(data_inicio, data_fim, referencia_inicio, referencia_fim))
+        dados = lojas.somar(dados, ['Horas'], ['QTDE', 'QTDE_Referencia']).sort_values('Horas', ignore_index=True)
         return dados, consulta_sql
     except Exception as e:
         return f"Erro ao executar a consulta SQL: {e}", None
 
 # Função para obter os dados do segundo gráfico
-def obter_dados_meios_pagamento(data_inicio, data_fim):
+def obter_dados_meios_pagamento(data_inicio, data_fim, referencia_inicio, referencia_fim):
     try:
-        data_inicio_formatada = data_inicio.strftime('%d-%m-%Y')
-        data_fim_formatada = data_fim.strftime('%d-%m-%Y')
+        periodo_atual = condicao_periodo('Data_Turno', data_inicio, data_fim)
+        periodo_referencia = condicao_periodo('Data_Turno', referencia_inicio, referencia_fim)
         
         consulta_sql = f"""
         SELECT 
             Meio AS Meios_de_Pagamentos, 
-            SUM(Valor) AS Valor
+            SUM(CASE WHEN {periodo_atual} THEN Valor END) AS Valor,
+            SUM(CASE WHEN {periodo_referencia} THEN Valor END) AS Valor_Referencia
         FROM 
             Vendas_Receber
         WHERE 
             Exclusao IS NULL 
             AND Meio IS NOT NULL 
-            AND Data_Turno BETWEEN '{data_inicio_formatada}' AND '{data_fim_formatada}'
+            AND ({periodo_atual} OR {periodo_referencia})
         GROUP BY 
             Meio
         ORDER BY 
             Valor DESC;
         """
         
-        conexao_string = DADOS_CONEXAO
-        
-        # Criar a string de conexão com o SQLAlchemy
-        try:
-            params = urllib.parse.quote_plus(conexao_string)
-            engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-        except Exception as e:
-            return f"Erro ao criar engine: {e}", None
-
         # Executando a consulta SQL
         try:
-            dados = pd.read_sql(consulta_sql, engine)
+            dados = consultar_lojas(consulta_sql, ["Vendas_Receber"], *abrangencia(data_inicio, data_fim, referencia_inicio, referencia_fim))
+            dados = dados.fillna({'Valor': 0, 'Valor_Referencia': 0})
+            dados = lojas.somar(dados, ['Meios_de_Pagamentos'], ['Valor', 'Valor_Referencia'])
             return dados, consulta_sql
         except Exception as e:
             return f"Erro ao executar a consulta SQL Meios: {e}", None
     except Exception as e:
         return f"Erro inesperado: {e}", None
     
-# Função para obter dados para o gráfico dos 10 principais produtos
-def obter_dados_produtos(data_inicio, data_fim):
-    try:
-        data_inicio_formatada = data_inicio.strftime('%d-%m-%Y')
-        data_fim_formatada = data_fim.strftime('%d-%m-%Y')
-
-        consulta_sql = f"""
-        SELECT TOP 10 
-            Descricao AS Produto, 
-            ROUND(SUM(Valor_liquido), 2) AS Valor
+# Conjuntos do GROUPING SETS de Vendas_Itens (valor de GROUPING_ID(categoria, produto))
+CONJUNTO_PRODUTO = 2
+CONJUNTO_CATEGORIA = 1
+CONJUNTO_PRODUTO_NA_CATEGORIA = 0
+
+# Função para obter, em uma única leitura de Vendas_Itens (GROUPING SETS), os
+# valores por produto, por categoria e, com o detalhamento ligado, por produto
+# dentro de cada categoria. O resultado é dividido aqui nos DataFrames de cada
+# gráfico; a segunda chamada no mesmo rerun sai do cache (mesma consulta).
+def obter_dados_itens(data_inicio, data_fim, referencia_inicio, referencia_fim):
+    periodo_atual = condicao_periodo('Vendas_Itens.Data_cx', data_inicio, data_fim)
+    periodo_referencia = condicao_periodo('Vendas_Itens.Data_cx', referencia_inicio, referencia_fim)
+    detalhar = st.session_state.get('detalhar_categorias', False)
+
+    conjuntos = "(Vendas_Itens.Descricao), (ItensGrupos.Descricao)"
+    if detalhar:
+        conjuntos += ", (ItensGrupos.Descricao, Vendas_Itens.Descricao)"
+    # Top 10 produtos, top 6 categorias e top 10 produtos de cada categoria direto
+    # no banco só com uma loja; com várias, o ranking é refeito sobre as somas
+    limite = "" if len(lojas_consulta) > 1 else f"""
+        WHERE Posicao <= CASE Conjunto WHEN {CONJUNTO_CATEGORIA} THEN 6 ELSE 10 END"""
+
+    consulta_sql = f"""
+    WITH Agrupado AS (
+        SELECT
+            GROUPING_ID(ItensGrupos.Descricao, Vendas_Itens.Descricao) AS Conjunto,
+            ItensGrupos.Descricao AS Categoria,
+            Vendas_Itens.Descricao AS Produto,
+            -- Produtos sem os itens cancelados
+            ROUND(SUM(CASE WHEN Vendas_Itens.Cancelamento IS NULL AND {periodo_atual} THEN Vendas_Itens.Valor_liquido END), 2) AS Valor,
+            ROUND(SUM(CASE WHEN Vendas_Itens.Cancelamento IS NULL AND {periodo_referencia} THEN Vendas_Itens.Valor_liquido END), 2) AS Valor_Referencia,
+            -- Categorias com todos os itens não excluídos
+            ROUND(SUM(CASE WHEN {periodo_atual} THEN Vendas_Itens.Valor_liquido END), 2) AS Valor_Todos,
+            ROUND(SUM(CASE WHEN {periodo_referencia} THEN Vendas_Itens.Valor_liquido END), 2) AS Valor_Todos_Referencia
         FROM 
             Vendas_Itens
+        LEFT JOIN 
+            ItensGrupos ON Vendas_Itens.ID_Grupo = ItensGrupos.ID_Grupo
         WHERE 
-            Exclusao IS NULL 
-            AND Cancelamento IS NULL 
-            AND Data_cx BETWEEN '{data_inicio_formatada}' AND '{data_fim_formatada}'
-        GROUP BY 
-            Descricao
-        ORDER BY 
-            Valor DESC;
-        """
-        
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
+            Vendas_Itens.Exclusao IS NULL 
+            AND ({periodo_atual} OR {periodo_referencia})
+        GROUP BY GROUPING SETS ({conjuntos})
+    ),
+    Ordenado AS (
+        SELECT 
+            *,
+            ROW_NUMBER() OVER (
+                PARTITION BY Conjunto, CASE WHEN Conjunto = {CONJUNTO_PRODUTO_NA_CATEGORIA} THEN Categoria END
+                ORDER BY CASE WHEN Conjunto = {CONJUNTO_CATEGORIA} THEN Valor_Todos ELSE Valor END DESC
+            ) AS Posicao
+        FROM Agrupado
+    )
+    SELECT Conjunto, Categoria, Produto, Valor, Valor_Referencia, Valor_Todos, Valor_Todos_Referencia
+    FROM Ordenado{limite};
+    """
 
-        dados = pd.read_sql(consulta_sql, engine)
-        
-        return dados, consulta_sql
-    except Exception as e:
-        return f"Erro ao executar a consulta SQL Produtos: {e}"   
+    dados = consultar_lojas(consulta_sql, ["Vendas_Itens"], *abrangencia(data_inicio, data_fim, referencia_inicio, referencia_fim))
+
+    # Produtos só com itens cancelados não entram (como no filtro de Cancelamento)
+    produtos = dados[dados['Conjunto'] == CONJUNTO_PRODUTO].dropna(subset=['Valor', 'Valor_Referencia'], how='all')
+    produtos = produtos.fillna({'Valor': 0, 'Valor_Referencia': 0})
+    produtos = lojas.somar(produtos[['Produto', 'Valor', 'Valor_Referencia', 'Loja']], ['Produto'], ['Valor', 'Valor_Referencia'], limite=10)
+
+    categorias = dados[dados['Conjunto'] == CONJUNTO_CATEGORIA]
+    categorias = categorias[['Categoria', 'Valor_Todos', 'Valor_Todos_Referencia', 'Loja']].rename(
+        columns={'Valor_Todos': 'Valor', 'Valor_Todos_Referencia': 'Valor_Referencia'})
+    categorias = categorias.fillna({'Valor': 0, 'Valor_Referencia': 0})
+    categorias = lojas.somar(categorias, ['Categoria'], ['Valor', 'Valor_Referencia'], limite=6)
+
+    detalhe = dados[dados['Conjunto'] == CONJUNTO_PRODUTO_NA_CATEGORIA].dropna(subset=['Valor', 'Valor_Referencia'], how='all')
+    detalhe = detalhe.fillna({'Valor': 0, 'Valor_Referencia': 0})
+    detalhe = lojas.somar(detalhe[['Categoria', 'Produto', 'Valor', 'Valor_Referencia', 'Loja']], ['Categoria', 'Produto'], ['Valor', 'Valor_Referencia'])
+    detalhe = detalhe.groupby('Categoria', sort=False, dropna=False).head(10).reset_index(drop=True)
 
-# Função para obter os dados das categorias
-def obter_dados_categorias(data_inicio, data_fim):
+    return {'produtos': produtos, 'categorias': categorias, 'detalhe': detalhe}, consulta_sql
+
+# Função para obter dados para o gráfico dos 10 principais produtos
+def obter_dados_produtos(data_inicio, data_fim, referencia_inicio, referencia_fim):
     try:
-        data_inicio_formatada = data_inicio.strftime('%d-%m-%Y')
-        data_fim_formatada = data_fim.strftime('%d-%m-%Y')
+        dados, consulta_sql = obter_dados_itens(data_inicio, data_fim, referencia_inicio, referencia_fim)
+        return dados['produtos'], consulta_sql
+    except Exception as e:
+        return f"Erro ao executar a consulta SQL Produtos: {e}", None
 
-        consulta_sql = f"""
-        SELECT TOP 6 
-            ItensGrupos.Descricao AS Categoria, 
-            ROUND(SUM(Vendas_Itens.Valor_liquido), 2) AS Valor
-        FROM 
-            Vendas_Itens
-        LEFT JOIN 
-            Itens ON Itens.ID_Item = Vendas_Itens.ID_Item
-        LEFT JOIN 
-            ItensGrupos ON Vendas_Itens.ID_Grupo = ItensGrupos.ID_Grupo
-        WHERE 
-            Vendas_Itens.Exclusao IS NULL 
-            AND Data_cx BETWEEN '{data_inicio_formatada}' AND '{data_fim_formatada}'
-        GROUP BY 
-            ItensGrupos.Descricao
-        ORDER BY 
-            Valor DESC;
-        """
+# Função para obter os dados das categorias (e dos produtos de cada categoria)
+def obter_dados_categorias(data_inicio, data_fim, referencia_inicio, referencia_fim):
+    try:
+        dados, consulta_sql = obter_dados_itens(data_inicio, data_fim, referencia_inicio, referencia_fim)
+        return dados['categorias'], dados['detalhe'], consulta_sql
+    except Exception as e:
+        return f"Erro ao executar a consulta SQL Categorias: {e}", None, None
 
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
+# Função para obter a matriz venda × produto do período em cada loja selecionada
+# (montada uma vez por período e loja e guardada no cache das KPIs)
+def obter_matrizes_cestas(data_inicio, data_fim):
+    import cesta_compras
+    try:
+        partes, erros = lojas.executar(
+            lambda dados_conexao: cesta_compras.obter_matriz(data_inicio, data_fim, dados_conexao),
+            lojas=lojas_consulta, verificar=verificar_interrupcao,
+            montagem=True,
+        )
+        lojas_com_erro.update(erros)
+        return [matriz for _, matriz in partes]
+    except Exception as e:
+        return f"Erro ao ler as cestas de compras: {e}"
 
-        dados = pd.read_sql(consulta_sql, engine)
-        return dados, consulta_sql
+# Função para obter o cubo de vendas do período (dia × hora × vendedor × categoria
+# × meio) das lojas selecionadas, montado uma vez por período e loja
+def obter_cubo_vendas(data_inicio, data_fim):
+    import cubo_vendas
+    try:
+        partes, erros = lojas.executar(
+            lambda dados_conexao: cubo_vendas.obter_cubo(data_inicio, data_fim, dados_conexao),
+            lojas=lojas_consulta, verificar=verificar_interrupcao,
+            montagem=True,
+        )
+        lojas_com_erro.update(erros)
+        return cubo_vendas.juntar_cubos([cubo for _, cubo in partes])
     except Exception as e:
-        return f"Erro ao executar a consulta SQL Categorias: {e}", None     
-    
-# Configurar o locale para português do Brasil
-locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
+        return f"Erro ao montar o cubo de vendas: {e}"
+
+# Função chamada quando barras de um gráfico cruzado são selecionadas: guarda os
+# membros escolhidos como filtro da dimensão (seleção vazia remove o filtro)
+def selecionar_filtro_cruzado(dimensao, chave):
+    pontos = st.session_state[chave]['selection']['points']
+    membros = {str(ponto['x']) for ponto in pontos if 'x' in ponto}
+    if membros:
+        st.session_state['filtros_cruzados'][dimensao] = membros
+    else:
+        st.session_state['filtros_cruzados'].pop(dimensao, None)
+
+# Função para exibir o gráfico de barras de uma dimensão do cubo, com os membros
+# filtrados em destaque; clicar (ou selecionar com shift) filtra os outros gráficos
+def grafico_cruzado(dados, dimensao, medida, limite=None):
+    selecionados = st.session_state['filtros_cruzados'].get(dimensao, set())
+    if limite is not None:
+        dados = dados.head(limite)
+    cores = ['#00539C' if not selecionados or membro in selecionados else '#c8d6dd' for membro in dados[dimensao]]
+    fig = px.bar(dados, x=dimensao, y=medida, title=f"{medida} por {dimensao.lower()}")
+    fig.update_traces(marker_color=cores)
+    fig.update_layout(xaxis_type='category', clickmode='event+select', height=320)
+    chave = f"cruzado_{dimensao}"
+    st.plotly_chart(fig, on_select=lambda: selecionar_filtro_cruzado(dimensao, chave),
+                    selection_mode="points", key=chave)
+
+# Configurar o locale para português do Brasil uma única vez por processo,
+# e não a cada rerun do script (nem derrubar a página se o locale não existir)
+@st.cache_resource
+def configurar_locale():
+    try:
+        locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
+    except locale.Error as e:
+        print(f"Locale pt_BR.UTF-8 indisponível: {e}")
 
-# Função para calcular o total de vendas com base no intervalo de datas
-def calcular_total_vendas(data_inicio, data_fim):
+# Função para calcular o total de vendas do período selecionado e do período de referência
+def calcular_total_vendas(data_inicio, data_fim, referencia_inicio, referencia_fim):
     try:
-        data_inicio_str = data_inicio.strftime('%d-%m-%Y')
-        data_fim_str = data_fim.strftime('%d-%m-%Y')
+        periodo_atual = condicao_periodo('Data_cx', data_inicio, data_fim)
+        periodo_referencia = condicao_periodo('Data_cx', referencia_inicio, referencia_fim)
 
         consulta_sql = f"""
-        SELECT SUM(Valor_itens) AS valor
+        SELECT
+            SUM(CASE WHEN {periodo_atual} THEN Valor_itens END) AS valor,
+            SUM(CASE WHEN {periodo_referencia} THEN Valor_itens END) AS valor_referencia
         FROM Vendas
         WHERE Exclusao IS NULL 
         AND Cancelamento IS NULL
-        AND Data_cx BETWEEN '{data_inicio_str}' AND '{data_fim_str}';
+        AND ({periodo_atual} OR {periodo_referencia});
         """
 
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
+        total_vendas = consultar_lojas(consulta_sql, ["Vendas"], *abrangencia(data_inicio, data_fim, referencia_inicio, referencia_fim))
 
-        total_vendas = pd.read_sql(consulta_sql, engine)
-
-        return total_vendas.iloc[0]['valor'] if not total_vendas.empty and total_vendas.iloc[0]['valor'] is not None else 0
+        # Soma das lojas (0 se nenhuma teve vendas no período)
+        valor = total_vendas['valor'].sum(min_count=1)
+        valor_referencia = total_vendas['valor_referencia'].sum(min_count=1)
+        return (valor if pd.notna(valor) else 0), (valor_referencia if pd.notna(valor_referencia) else 0)
     except Exception as e:
         st.error(f"Erro ao calcular o total de vendas: {e}")
-        return 0  # Retornar 0 em caso de erro
+        return 0, 0  # Retornar 0 em caso de erro
     
-# Função para calcular o crescimento percentual de vendas
-def calcular_crescimento_percentual_vendas():
+# Função para calcular o crescimento percentual de vendas do período selecionado
+# sobre o período de referência (usa o mesmo resultado, em cache, do total de vendas)
+def calcular_crescimento_percentual_vendas(data_inicio, data_fim, referencia_inicio, referencia_fim):
     try:
-        # Calcular as datas para o mês atual
-        hoje = datetime.today()
-        primeiro_dia_mes_atual = hoje.replace(day=1)
-        ultimo_dia_mes_atual = (primeiro_dia_mes_atual + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-
-        # Calcular as datas para o mês anterior
-        ultimo_dia_mes_anterior = primeiro_dia_mes_atual - timedelta(days=1)
-        primeiro_dia_mes_anterior = ultimo_dia_mes_anterior.replace(day=1)
-
-        # Formatar as datas para o formato 'dd-mm-yyyy'
-        data_inicial_atual_formatada = primeiro_dia_mes_atual.strftime('%d-%m-%Y')
-        data_final_atual_formatada = ultimo_dia_mes_atual.strftime('%d-%m-%Y')
-        data_inicial_anterior_formatada = primeiro_dia_mes_anterior.strftime('%d-%m-%Y')
-        data_final_anterior_formatada = ultimo_dia_mes_anterior.strftime('%d-%m-%Y')
-
-        # Consulta SQL para o período atual
-        consulta_sql_atual = f"""
-        SELECT SUM(Valor_itens) AS valor
-        FROM Vendas
-        WHERE Data_cx BETWEEN '{data_inicial_atual_formatada}' AND '{data_final_atual_formatada}'
-          AND Exclusao IS NULL AND Cancelamento IS NULL;
-        """
-
-        # Consulta SQL para o período anterior
-        consulta_sql_anterior = f"""
-        SELECT SUM(Valor_itens) AS valor
-        FROM Vendas
-        WHERE Data_cx BETWEEN '{data_inicial_anterior_formatada}' AND '{data_final_anterior_formatada}'
-          AND Exclusao IS NULL AND Cancelamento IS NULL;
-        """
-
-        # Criar a string de conexão com o SQLAlchemy
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-
-        # Obter os resultados para os dois períodos
-        vendas_atual = pd.read_sql(consulta_sql_atual, engine)
-        vendas_anterior = pd.read_sql(consulta_sql_anterior, engine)
-        
-
-        # Extrair os valores, considerando 0 se o resultado for vazio
-        valor_atual = vendas_atual.iloc[0]['valor'] if not vendas_atual.empty and vendas_atual.iloc[0]['valor'] is not None else 0
-        valor_anterior = vendas_anterior.iloc[0]['valor'] if not vendas_anterior.empty and vendas_anterior.iloc[0]['valor'] is not None else 0
+        valor_atual, valor_anterior = calcular_total_vendas(data_inicio, data_fim, referencia_inicio, referencia_fim)
         
         # Calcular o crescimento percentual, evitando divisão por zero
         if valor_anterior == 0:
@@ -440,77 +607,82 @@ def calcular_crescimento_percentual_vendas():
 
         # Retornar os valores formatados e o crescimento percentual
         resultado = {
-            "Total vendas mês anterior": f"R$ {valor_anterior:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."),
-            "Total vendas mês atual": f"R$ {valor_atual:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."),
-            "Crescimento percentual": f"{crescimento_percentual:.2f}%"
+            "Total vendas período de referência": formatar_moeda(valor_anterior).replace("R$ ", ""),
+            "Total vendas período selecionado": formatar_moeda(valor_atual).replace("R$ ", ""),
+            "Crescimento percentual": f"{crescimento_percentual:.2f}"
         }
         
         return resultado
 
     except Exception as e:
-        return f"Erro ao calcular o crescimento percentual de vendas: {e}"
+        return {"erro": f"Erro ao calcular o crescimento percentual de vendas: {e}"}
     
-def calcular_ticket_medio(data_inicio, data_fim):
+# Função para calcular o ticket médio do período selecionado e do período de referência
+def calcular_ticket_medio(data_inicio, data_fim, referencia_inicio, referencia_fim):
     try:
-        # Formatar as datas no formato aceito pelo SQL Server
-        data_inicio_str = data_inicio.strftime('%d-%m-%Y')
-        data_fim_str = data_fim.strftime('%d-%m-%Y')
+        periodo_atual = condicao_periodo('Data_cx', data_inicio, data_fim)
+        periodo_referencia = condicao_periodo('Data_cx', referencia_inicio, referencia_fim)
 
-        # Consulta SQL para calcular o ticket médio no intervalo de datas
+        # Consulta SQL para calcular o ticket médio no intervalo de datas.
+        # Soma e quantidade vêm separadas para o ticket de várias lojas ser
+        # a soma total dividida pela quantidade total (e não a média dos tickets)
         consulta_sql = f"""
-        SELECT SUM(valor_liquido) / COUNT(id_venda) AS ticket_medio
+        SELECT
+            SUM(CASE WHEN {periodo_atual} THEN valor_liquido END) AS soma,
+            COUNT(CASE WHEN {periodo_atual} THEN id_venda END) AS quantidade,
+            SUM(CASE WHEN {periodo_referencia} THEN valor_liquido END) AS soma_referencia,
+            COUNT(CASE WHEN {periodo_referencia} THEN id_venda END) AS quantidade_referencia
         FROM vendas
         WHERE valor_liquido > 0.00
           AND cancelamento IS NULL
           AND exclusao IS NULL
-          AND Data_cx BETWEEN '{data_inicio_str}' AND '{data_fim_str}';
+          AND ({periodo_atual} OR {periodo_referencia});
         """
 
-        # Criar a string de conexão com o SQLAlchemy
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-
         # Executar a consulta e obter o resultado
-        resultado = pd.read_sql(consulta_sql, engine)
-
-        # Verificar se o resultado é válido e retornar o valor do ticket médio
-        return resultado.iloc[0]['ticket_medio'] if not resultado.empty and resultado.iloc[0]['ticket_medio'] is not None else 0
+        resultado = consultar_lojas(consulta_sql, ["Vendas"], *abrangencia(data_inicio, data_fim, referencia_inicio, referencia_fim))
+
+        # Verificar se há vendas em cada período e retornar os dois tickets médios
+        quantidade = resultado['quantidade'].sum()
+        quantidade_referencia = resultado['quantidade_referencia'].sum()
+        ticket = resultado['soma'].sum() / quantidade if quantidade else 0
+        ticket_referencia = resultado['soma_referencia'].sum() / quantidade_referencia if quantidade_referencia else 0
+        return ticket, ticket_referencia
     except Exception as e:
         # Exibir a mensagem de erro no Streamlit
         st.error(f"Erro ao calcular o ticket médio: {e}")
-        return 0  # Retornar 0 em caso de erro   
+        return 0, 0  # Retornar 0 em caso de erro   
 
-def vendedor_com_mais_vendas(data_inicio, data_fim):
+def vendedor_com_mais_vendas(data_inicio, data_fim, referencia_inicio, referencia_fim):
     try:
-        # Formatar as datas no formato aceito pelo SQL Server
-        data_inicio_str = data_inicio.strftime('%d-%m-%Y')
-        data_fim_str = data_fim.strftime('%d-%m-%Y')
+        periodo_atual = condicao_periodo('Data_cx', data_inicio, data_fim)
+        periodo_referencia = condicao_periodo('Data_cx', referencia_inicio, referencia_fim)
 
-        # Consulta SQL para encontrar o vendedor com mais vendas no intervalo de datas
+        # Consulta SQL para encontrar o vendedor com mais vendas no intervalo de datas,
+        # com a quantidade do mesmo vendedor no período de referência
         consulta_sql = f"""
-        SELECT TOP 1 
+        SELECT {topo(1)}
             Vendedor, 
-            COUNT(ID_Venda) AS QTDE_Total_vendas
+            COUNT(CASE WHEN {periodo_atual} THEN ID_Venda END) AS QTDE_Total_vendas,
+            COUNT(CASE WHEN {periodo_referencia} THEN ID_Venda END) AS QTDE_Referencia
         FROM Vendas
         WHERE Exclusao IS NULL 
           AND Cancelamento IS NULL
-          AND Data_cx BETWEEN '{data_inicio_str}' AND '{data_fim_str}'
+          AND ({periodo_atual} OR {periodo_referencia})
         GROUP BY Vendedor
         ORDER BY QTDE_Total_vendas DESC;
         """
 
-        # Criar a string de conexão com o SQLAlchemy
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-
         # Executar a consulta e obter o resultado
-        resultado = pd.read_sql(consulta_sql, engine)
+        resultado = consultar_lojas(consulta_sql, ["Vendas"], *abrangencia(data_inicio, data_fim, referencia_inicio, referencia_fim))
+        resultado = lojas.somar(resultado, ['Vendedor'], ['QTDE_Total_vendas', 'QTDE_Referencia'], limite=1)
 
         # Verificar se o resultado é válido e retornar o nome do vendedor e o total de vendas
-        if not resultado.empty:
+        if not resultado.empty and resultado.iloc[0]['QTDE_Total_vendas'] > 0:
             vendedor = resultado.iloc[0]['Vendedor']
             total_vendas = str(int(resultado.iloc[0]['QTDE_Total_vendas']))
-            return {"Vendedor": vendedor, "Total Vendas": total_vendas}
+            variacao = texto_variacao(resultado.iloc[0]['QTDE_Total_vendas'], resultado.iloc[0]['QTDE_Referencia'])
+            return {"Vendedor": vendedor, "Total Vendas": total_vendas, "Variação": variacao}
         else:
             return {"Mensagem": "Nenhum dado encontrado para o período especificado."}
     except Exception as e:
@@ -530,6 +702,21 @@ st.markdown(
         """, unsafe_allow_html=True
     )
 
+configurar_locale()
+
+marcador_interrupcao = st.empty()
+
+# Visão consolidada de todas as lojas ou de uma loja específica
+if lojas.multiplas():
+    CONSOLIDADO = "Todas as lojas (consolidado)"
+    loja_selecionada = st.selectbox('Loja', [CONSOLIDADO] + list(lojas.LOJAS))
+    if loja_selecionada != CONSOLIDADO:
+        lojas_consulta = [loja_selecionada]
+
+# Aviso das lojas que ficaram de fora, preenchido no fim da página
+aviso_lojas = st.empty()
+aviso_replicas = st.empty()
+
 # Obter os limites de data para configurar o slider
 menor_data, maior_data = obter_limites_data()
 
@@ -545,18 +732,47 @@ data_intervalo = st.slider(
 # Obter as datas de início e fim
 data_inicio, data_fim = data_intervalo
 
+# Período alterado desde o último rerun: espera o slider parar antes das consultas
+if st.session_state.get('periodo_consultado') not in (None, data_intervalo):
+    aguardar_slider(ESPERA_SLIDER)
+st.session_state['periodo_consultado'] = data_intervalo
+
+# Período de referência usado na comparação de todos os cards e gráficos
+col_comparacao, col_referencia = st.columns([1, 1])
+with col_comparacao:
+    tipo_comparacao = st.selectbox('Comparar com', COMPARACOES)
+
+periodo_personalizado = None
+if tipo_comparacao == COMPARACOES[2]:
+    with col_referencia:
+        periodo_personalizado = st.date_input(
+            'Período de referência',
+            value=calcular_periodo_referencia(data_inicio, data_fim, COMPARACOES[0]),
+            format="DD/MM/YYYY"
+        )
+
+referencia_inicio, referencia_fim = calcular_periodo_referencia(data_inicio, data_fim, tipo_comparacao, periodo_personalizado)
+st.caption(
+    f"Período selecionado: {data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')} · "
+    f"Referência: {referencia_inicio.strftime('%d/%m/%Y')} a {referencia_fim.strftime('%d/%m/%Y')}"
+)
+periodo = (data_inicio, data_fim, referencia_inicio, referencia_fim)
+
+perfil.marcar(PAGINA, "cabecalho_e_periodo")
+
 # Criar as colunas para o layout
 col11, col12, col13, col14 = st.columns([1, 1, 1 ,1])
 
 with col11:
  # Uso da função no Streamlit para calcular o crescimento percentual de vendas
- resultado = calcular_crescimento_percentual_vendas()
+ # do período selecionado sobre o período de referência
+ resultado = calcular_crescimento_percentual_vendas(*periodo)
 
  # Verifica se não houve erro no cálculo
  if resultado and "erro" not in resultado:
     # Configura os parâmetros para exibição
-    valor_anterior = resultado.get("Total vendas mês anterior")
-    valor_atual = resultado.get("Total vendas mês atual")
+    valor_anterior = resultado.get("Total vendas período de referência")
+    valor_atual = resultado.get("Total vendas período selecionado")
     crescimento_percentual = resultado.get("Crescimento percentual")
 
     # Inicializa is_positive como False por padrão
@@ -580,8 +796,8 @@ with col11:
     display_metric(
         title="Crescimento de Vendas",
         value=crescimento_percentual,
-        subtitle=f"Vendas Mês Anterior: R$ {valor_anterior}",
-        subtitle2=f"Vendas Mês Atual: R$ {valor_atual}",
+        subtitle=f"Vendas Referência: R$ {valor_anterior}",
+        subtitle2=f"Vendas Período: R$ {valor_atual}",
         target=f"Vendas Atuais: R$ {valor_atual}",
         change=f"{(crescimento_percentual)}",
         is_positive=is_positive
@@ -592,27 +808,29 @@ with col11:
 
 with col12:
     # Calcular o total de vendas com base no período selecionado
-    total_vendas = calcular_total_vendas(data_inicio, data_fim)
+    total_vendas, total_referencia = calcular_total_vendas(*periodo)
 
     # Exibe a métrica usando a função display_metric
     display_metric2(
         title="Total de Vendas Geral",
         value=total_vendas,
+        variacao=texto_variacao(total_vendas, total_referencia),
     )
 
 with col13:
     # Calcular o total de vendas com base no período selecionado
-    ticket_medio = calcular_ticket_medio(data_inicio, data_fim)
+    ticket_medio, ticket_referencia = calcular_ticket_medio(*periodo)
 
     # Exibe a métrica usando a função display_metric
     display_metric2(
         title="Ticket Médio Geral",
         value=ticket_medio,
+        variacao=texto_variacao(ticket_medio, ticket_referencia),
     )    
 
 with col14:
     # Calcular o total de vendas com base no período selecionado
-    resultado = vendedor_com_mais_vendas(data_inicio, data_fim)
+    resultado = vendedor_com_mais_vendas(*periodo)
 
     vendedor = resultado.get("Vendedor")
     total_vendas = resultado.get("Total Vendas")
@@ -621,9 +839,11 @@ with col14:
     display_metric3(
         title="Vendedor TOP 1",
         subtitle=vendedor,
-        subtitle2=total_vendas
+        subtitle2=total_vendas,
+        variacao=resultado.get("Variação")
     )
        
+perfil.marcar(PAGINA, "cards_kpis")
 st.markdown("""---""")
 
 st.markdown(
@@ -650,6 +870,7 @@ if data is not None:
     # Exibe o DataFrame estilizado no Streamlit
     st.dataframe(styled_df)        
 
+perfil.marcar(PAGINA, "top5_clientes")
 st.markdown("""---""")
 st.markdown(
         """
@@ -670,12 +891,15 @@ with col1:
         st.error('A data de início não pode ser maior que a data de fim.')
     else:
         # Obter os dados para o primeiro gráfico
-        dados_vendas, consulta_sql_vendas = obter_dados_vendas(data_inicio, data_fim)
+        dados_vendas, consulta_sql_vendas = obter_dados_vendas(*periodo)
         
         # Verificar se 'dados_vendas' é um DataFrame e se há dados para exibir
         if isinstance(dados_vendas, pd.DataFrame) and not dados_vendas.empty:
-            # Criar o gráfico de linha para quantidade de vendas por hora
-            fig_vendas = px.line(dados_vendas, x='Horas', y='QTDE', text='QTDE', markers=True)
+            # Criar o gráfico de linha para quantidade de vendas por hora, com a
+            # variação sobre a referência em cada ponto e a linha da referência tracejada
+            dados_vendas['Rótulo'] = rotulos_com_variacao(dados_vendas['QTDE'], dados_vendas['QTDE_Referencia'], lambda q: f"{int(q)}")
+            fig_vendas = px.line(dados_vendas, x='Horas', y='QTDE', text='Rótulo', markers=True)
+            fig_vendas.add_scatter(x=dados_vendas['Horas'], y=dados_vendas['QTDE_Referencia'], mode='lines', name='Referência', line=dict(dash='dash'))
             # Exibir o gráfico
             st.plotly_chart(fig_vendas)
         elif isinstance(dados_vendas, pd.DataFrame) and dados_vendas.empty:
@@ -683,12 +907,13 @@ with col1:
         else:
             st.error(dados_vendas)
 
-        st.text_area('Criação do gráfico de linha acima(plotly)', "px.line(dados_vendas, x='Horas', y='QTDE', title='Quantidade de Vendas por Hora', text='QTDE', markers=True)", height=30)    
+        st.text_area('Criação do gráfico de linha acima(plotly)', "px.line(dados_vendas, x='Horas', y='QTDE', text='Rótulo', markers=True)                                                                  fig_vendas.add_scatter(x=dados_vendas['Horas'], y=dados_vendas['QTDE_Referencia'], mode='lines', name='Referência', line=dict(dash='dash'))", height=30)    
 
 with col2:
     if consulta_sql_vendas:
         st.text_area('Código SQL para o Gráfico de Vendas por Hora', consulta_sql_vendas, height=560)    
 
+perfil.marcar(PAGINA, "vendas_por_hora")
 st.markdown("""---""")
 st.markdown(
         """
@@ -702,14 +927,16 @@ st.markdown(
 col3, col4 = st.columns([2, 1])
 with col3:
         # Obter os dados para o segundo gráfico
-        dados_meios, consulta_sql_meios = obter_dados_meios_pagamento(data_inicio, data_fim)
+        dados_meios, consulta_sql_meios = obter_dados_meios_pagamento(*periodo)
 
         # Verificar se 'dados_meios' é um DataFrame e se há dados para exibir
         if isinstance(dados_meios, pd.DataFrame) and not dados_meios.empty:
-            # Criar o gráfico de barras para os meios de pagamento
-            fig_meios = px.bar(dados_meios, x='Meios_de_Pagamentos', y='Valor', text='Valor')
-            # Formatação do texto para o formato R$ 3.091.840,48
-            fig_meios.update_traces(texttemplate='R$ %{text:,.2f}', textposition='outside')
+            # Criar o gráfico de barras para os meios de pagamento, com o texto no
+            # formato R$ 3.091.840,48 seguido da variação e um marcador com a referência
+            dados_meios['Rótulo'] = rotulos_com_variacao(dados_meios['Valor'], dados_meios['Valor_Referencia'], formatar_moeda)
+            fig_meios = px.bar(dados_meios, x='Meios_de_Pagamentos', y='Valor', text='Rótulo')
+            fig_meios.update_traces(textposition='outside')
+            fig_meios.add_scatter(x=dados_meios['Meios_de_Pagamentos'], y=dados_meios['Valor_Referencia'], mode='markers', name='Referência', marker=dict(symbol='line-ew-open', size=30, line=dict(width=3)))
             #fig_meios.update_traces(texttemplate='R$ %{text:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.'))
             # Exibir o gráfico
             st.plotly_chart(fig_meios)
@@ -718,7 +945,7 @@ with col3:
         else:
             st.error(dados_meios)
 
-        st.text_area('Criação do gráfico de barras acima(plotly)', "px.bar(dados_meios, x='Meios_de_Pagamentos', y='Valor', title='Meios de Pagamento mais utilizados', text='Valor')", height=30)
+        st.text_area('Criação do gráfico de barras acima(plotly)', "px.bar(dados_meios, x='Meios_de_Pagamentos', y='Valor', text='Rótulo')                                                                  fig_meios.add_scatter(x=dados_meios['Meios_de_Pagamentos'], y=dados_meios['Valor_Referencia'], mode='markers', name='Referência')", height=30)
 
 
 with col4:
@@ -726,6 +953,7 @@ with col4:
        st.text_area('Código SQL para o Gráfico de Meios de Pagamento', consulta_sql_meios, height=560)
 
 
+perfil.marcar(PAGINA, "meios_pagamento")
 st.markdown("""---""")
 st.markdown(
         """
@@ -739,13 +967,15 @@ st.markdown(
 col5, col6 = st.columns([2, 1])
 with col5:
         # Obter os dados com base no intervalo selecionado no slider
-        dados_produtos,consulta_sql_produtos = obter_dados_produtos(data_inicio, data_fim)
+        dados_produtos,consulta_sql_produtos = obter_dados_produtos(*periodo)
 
         # Verificar se 'dados_produtos' é um DataFrame e se há dados para exibir
         if isinstance(dados_produtos, pd.DataFrame) and not dados_produtos.empty:
-            # Criar o gráfico de barras
-            fig_produtos = px.bar(dados_produtos, x='Produto', y='Valor', text='Valor')
-            fig_produtos.update_traces(texttemplate='R$ %{text:,.2f}', textposition='outside')
+            # Criar o gráfico de barras com a variação de cada produto e o marcador da referência
+            dados_produtos['Rótulo'] = rotulos_com_variacao(dados_produtos['Valor'], dados_produtos['Valor_Referencia'], formatar_moeda)
+            fig_produtos = px.bar(dados_produtos, x='Produto', y='Valor', text='Rótulo')
+            fig_produtos.update_traces(textposition='outside')
+            fig_produtos.add_scatter(x=dados_produtos['Produto'], y=dados_produtos['Valor_Referencia'], mode='markers', name='Referência', marker=dict(symbol='line-ew-open', size=30, line=dict(width=3)))
             
 
             # Exibir o gráfico
@@ -755,13 +985,14 @@ with col5:
         else:
             st.error(dados_produtos)  
   
-        st.text_area('Criação do gráfico de barras acima(plotly)', "fig_produtos = px.bar(dados_produtos, x='Produto', y='Valor', title='Top 10 Produtos mais vendidos', text='Valor')                                                                  fig_produtos.update_traces(texttemplate='%{text:.2f}', textposition='outside') ", height=30) 
+        st.text_area('Criação do gráfico de barras acima(plotly)', "fig_produtos = px.bar(dados_produtos, x='Produto', y='Valor', text='Rótulo')                                                                  fig_produtos.add_scatter(x=dados_produtos['Produto'], y=dados_produtos['Valor_Referencia'], mode='markers', name='Referência') ", height=30) 
 
 
 with col6:
   if consulta_sql_produtos:         
      st.text_area('Código SQL para o Gráfico Top 10 Produtos', consulta_sql_produtos, height=562)  
 
+perfil.marcar(PAGINA, "top10_produtos")
 st.markdown("""---""")
 st.markdown(
         """
@@ -775,12 +1006,16 @@ st.markdown(
 col7, col8 = st.columns([2, 1])
 with col7:
         # Obter os dados das categorias
-        dados_categorias, consulta_sql_categorias = obter_dados_categorias(data_inicio, data_fim)
+        dados_categorias, detalhe_categorias, consulta_sql_categorias = obter_dados_categorias(*periodo)
 
         # Verificar se 'dados_categorias' é um DataFrame e se há dados para exibir
         if isinstance(dados_categorias, pd.DataFrame) and not dados_categorias.empty:
-            # Criar o gráfico de pizza para as categorias
+            # Criar o gráfico de pizza para as categorias, com a variação de cada fatia
             fig_categorias = px.pie(dados_categorias, names='Categoria', values='Valor', title='Top 6 Categorias mais rentabelizadas', hole=0.3)
+            fig_categorias.update_traces(
+                text=[texto_variacao(v, r) for v, r in zip(dados_categorias['Valor'], dados_categorias['Valor_Referencia'])],
+                textinfo='percent+text'
+            )
             # Exibir o gráfico
             st.plotly_chart(fig_categorias)
         elif isinstance(dados_categorias, pd.DataFrame) and dados_categorias.empty:
@@ -789,6 +1024,24 @@ with col7:
             st.error(dados_categorias)
 
         st.text_area('Criação do gráfico de pizza acima(plotly)', "px.pie(dados_categorias, names='Categoria', values='Valor', title='Top 6 Categorias mais rentabelizadas', hole=0.3)", height=30)     
+
+        # Produtos de uma categoria, vindos da mesma leitura (conjunto categoria + produto do GROUPING SETS)
+        if st.toggle('Detalhar os produtos de cada categoria', key='detalhar_categorias') \
+                and isinstance(dados_categorias, pd.DataFrame) and not dados_categorias.empty:
+            categoria_detalhe = st.selectbox('Categoria', dados_categorias['Categoria'].tolist(),
+                                             format_func=lambda categoria: categoria if categoria is not None else 'Sem categoria')
+            produtos_categoria = detalhe_categorias[
+                detalhe_categorias['Categoria'].isna() if categoria_detalhe is None
+                else detalhe_categorias['Categoria'] == categoria_detalhe
+            ].copy()
+            if produtos_categoria.empty:
+                st.warning('Nenhum produto encontrado para a categoria no período selecionado.')
+            else:
+                produtos_categoria['Rótulo'] = rotulos_com_variacao(produtos_categoria['Valor'], produtos_categoria['Valor_Referencia'], formatar_moeda)
+                fig_detalhe = px.bar(produtos_categoria, x='Produto', y='Valor', text='Rótulo', title=f'Top 10 Produtos de {categoria_detalhe or "Sem categoria"}')
+                fig_detalhe.update_traces(textposition='outside')
+                fig_detalhe.add_scatter(x=produtos_categoria['Produto'], y=produtos_categoria['Valor_Referencia'], mode='markers', name='Referência', marker=dict(symbol='line-ew-open', size=30, line=dict(width=3)))
+                st.plotly_chart(fig_detalhe)
   
 
 with col8:
@@ -799,4 +1052,138 @@ with col8:
 
   
 
-st.markdown("""---""")        
+st.markdown("""---""")
+
+perfil.marcar(PAGINA, "top6_categorias")
+st.markdown(
+        """
+        <div style="background-color:#262730; padding: 5px; border-radius: 10px;">
+            <h2 style='text-align: center;'>🧺 Produtos comprados juntos 🛍️</h2>
+            <p></p>
+        </div>
+        """, unsafe_allow_html=True
+    )
+
+# A primeira análise de um período lê todos os itens vendidos, por isso só roda quando pedida
+if st.toggle('Analisar as cestas de compras do período selecionado', key='cestas_ligadas'):
+    import cesta_compras
+
+    matrizes = obter_matrizes_cestas(data_inicio, data_fim)
+    if isinstance(matrizes, str):
+        st.error(matrizes)
+    else:
+        categorias_cesta = sorted({categoria for m in matrizes for categoria in m['categorias']})
+        col_nivel, col_categoria, col_suporte, col_confianca = st.columns([1, 1, 1, 1])
+        with col_nivel:
+            nivel_cesta = st.radio('Analisar', ['produto', 'categoria'], horizontal=True,
+                                   format_func=lambda nivel: 'Produtos' if nivel == 'produto' else 'Categorias')
+        with col_categoria:
+            categoria_cesta = st.selectbox('Categoria', ['Todas'] + categorias_cesta, disabled=nivel_cesta == 'categoria')
+        with col_suporte:
+            suporte_cesta = st.number_input('Suporte mínimo (% das vendas)', min_value=0.01, max_value=100.0,
+                                            value=cesta_compras.SUPORTE_MINIMO * 100, step=0.1, format="%.2f")
+        with col_confianca:
+            confianca_cesta = st.slider('Confiança mínima (%)', 0, 100, int(cesta_compras.CONFIANCA_MINIMA * 100))
+
+        resultado_cesta = cesta_compras.analisar(
+            matrizes, nivel_cesta,
+            None if nivel_cesta == 'categoria' or categoria_cesta == 'Todas' else categoria_cesta,
+            suporte_cesta / 100, confianca_cesta / 100,
+        )
+        st.caption(
+            f"{resultado_cesta['vendas']:,} vendas e {resultado_cesta['itens']:,} itens analisados "
+            f"em {resultado_cesta['segundos']:.1f}s".replace(',', '.')
+        )
+
+        # Suporte e confiança em % das vendas; lift > 1 indica itens comprados juntos
+        # mais do que o esperado se fossem independentes
+        col_conjuntos, col_regras = st.columns([1, 1])
+        with col_conjuntos:
+            st.write("Conjuntos frequentes:")
+            conjuntos = resultado_cesta['conjuntos'].head(100).assign(
+                Suporte=lambda d: (d['Suporte'] * 100).round(2), Lift=lambda d: d['Lift'].round(2))
+            st.dataframe(conjuntos.rename(columns={'Suporte': 'Suporte (%)'}), hide_index=True)
+        with col_regras:
+            st.write("Regras (quem compra o antecedente também compra o consequente):")
+            regras = resultado_cesta['regras'].head(100).assign(
+                Suporte=lambda d: (d['Suporte'] * 100).round(2), Confiança=lambda d: (d['Confiança'] * 100).round(1),
+                Lift=lambda d: d['Lift'].round(2))
+            st.dataframe(regras.rename(columns={'Suporte': 'Suporte (%)', 'Confiança': 'Confiança (%)'}), hide_index=True)
+
+st.markdown("""---""")
+
+perfil.marcar(PAGINA, "cestas_compras")
+st.markdown(
+        """
+        <div style="background-color:#262730; padding: 5px; border-radius: 10px;">
+            <h2 style='text-align: center;'>🔀 Filtros cruzados por dia, hora, vendedor, categoria e meio 🔍</h2>
+            <p></p>
+        </div>
+        """, unsafe_allow_html=True
+    )
+
+# O cubo lê as vendas do período uma vez; depois cada clique só recalcula em memória
+if st.toggle('Explorar o período com filtros cruzados', key='cubo_ligado'):
+    # Filtros por dimensão ({dimensão: membros}); mudar o período recomeça sem filtros
+    if st.session_state.get('filtros_cruzados_periodo') != data_intervalo:
+        st.session_state['filtros_cruzados'] = {}
+        st.session_state['filtros_cruzados_periodo'] = data_intervalo
+
+    cubo = obter_cubo_vendas(data_inicio, data_fim)
+    if isinstance(cubo, str):
+        st.error(cubo)
+    else:
+        import cubo_vendas
+
+        filtros_cruzados = st.session_state['filtros_cruzados']
+        agregado = cubo_vendas.agregar(cubo, filtros_cruzados)
+        totais = agregado['totais']
+
+        col_medida, col_limpar = st.columns([3, 1])
+        with col_medida:
+            medida_cruzada = st.radio('Medida', ['Valor', 'Vendas'], horizontal=True, key='cubo_medida')
+        with col_limpar:
+            if st.button('Limpar filtros', disabled=not filtros_cruzados):
+                st.session_state['filtros_cruzados'] = {}
+                st.rerun()
+
+        descricao_filtros = "; ".join(
+            f"{dimensao}: {', '.join(sorted(membros))}" for dimensao, membros in filtros_cruzados.items()
+        ) or "nenhum"
+        st.caption(
+            f"{totais['Vendas']:,}".replace(',', '.') + f" vendas · {formatar_moeda(totais['Valor'])} · ticket médio "
+            f"{formatar_moeda(totais['Ticket médio'])} · filtros: {descricao_filtros} · "
+            f"recalculado em {agregado['milissegundos']:.0f} ms"
+        )
+
+        grafico_cruzado(agregado['Dia'], 'Dia', medida_cruzada)
+        col_hora, col_vendedor = st.columns([1, 1])
+        with col_hora:
+            grafico_cruzado(agregado['Hora'], 'Hora', medida_cruzada)
+        with col_vendedor:
+            grafico_cruzado(agregado['Vendedor'], 'Vendedor', medida_cruzada, limite=15)
+        col_categoria_cruzada, col_meio = st.columns([1, 1])
+        with col_categoria_cruzada:
+            grafico_cruzado(agregado['Categoria'], 'Categoria', medida_cruzada)
+        with col_meio:
+            grafico_cruzado(agregado['Meio'], 'Meio', medida_cruzada)
+
+st.markdown("""---""")
+
+perfil.marcar(PAGINA, "filtros_cruzados")
+
+# Origem dos números de cada loja com réplica de leitura e o atraso dela
+situacao_replicas = [(nome, lojas.estado_replica(nome)) for nome in lojas_consulta]
+situacao_replicas = [(nome, estado) for nome, estado in situacao_replicas if estado is not None]
+if situacao_replicas:
+    aviso_replicas.caption(" · ".join(
+        (f"{nome}: " if lojas.multiplas() else "") + descrever_replica(estado) for nome, estado in situacao_replicas
+    ))
+
+if lojas_com_erro:
+    aviso_lojas.warning(
+        "Lojas fora dos números exibidos: "
+        + "; ".join(f"{nome} ({erro})" for nome, erro in lojas_com_erro.items())
+    )
+
+perfil.finalizar(PAGINA)
@@ -1,47 +1,235 @@
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import streamlit as st
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
-from sqlalchemy import create_engine
-import urllib
+import os
 from datetime import datetime
+import perfil_inicializacao as perfil
+
+PAGINA = "Segmentação_e_Marketing"
+perfil.iniciar(PAGINA)
+
+# matplotlib e seaborn não eram usados e saíram dos imports; o scikit-learn só é
+# carregado dentro de aplicar_kmeans e projetar_pca, quando são calculados.
+with perfil.medir_importacoes(PAGINA):
+    import pandas as pd
+    import numpy as np
+    import streamlit as st
+    import plotly.express as px
+    # Base de features por cliente, atualizada de forma incremental
+    import features_clientes
+    import exportacao_campanhas
+    import busca_clientes
 
 # Configuração da página em modo wide
 st.set_page_config(layout="wide")
 
-# Configuração de conexão com o banco de dados
-DADOS_CONEXAO = (
-    "Driver={SQL Server};"
-    "Server=DUXPC;"
-    "Database=teste2;"
-    "Trusted_Connection=yes;"
-)
+# Características usadas no K-Means (segmentação RFM: recência, frequência e valor)
+COLUNAS_SEGMENTACAO = ['FREQUENCIA_COMPRA', 'VALOR_GASTO', 'RECENCIA_DIAS']
 
-# Função para obter os dados do primeiro gráfico
-@st.cache_data
+# Colunas exibidas nas tabelas de clientes
+COLUNAS_EXIBICAO = ['Nome', 'FREQUENCIA_COMPRA', 'VALOR_GASTO', 'TICKET_MEDIO', 'ULTIMA_COMPRA',
+                    'RECENCIA_DIAS', 'TEMPO_CLIENTE_DIAS']
+
+# Função para obter as características por cliente
+# (a cada atualização só a janela de vendas recentes é reagregada)
 def CARREGAR_DADOS():
     try:
-        consulta_sql = """
-        SELECT * 
-        FROM Vendas WHERE nome IS NOT NULL AND nome <> '' ORDER BY Nome
-        """
-        params = urllib.parse.quote_plus(DADOS_CONEXAO)
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-
-        dados = pd.read_sql(consulta_sql, engine)
-        return dados
+        return features_clientes.obter_features()
     except Exception as e:
         st.error(f"Erro ao executar a consulta SQL: {e}")
         return None
 
-df = CARREGAR_DADOS()
+# Função para aplicar o K-Means sobre as características normalizadas
+@st.cache_data
+def aplicar_kmeans(frequencia_gasto, n_clusters):
+    # Importação tardia: o scikit-learn é pesado e só é necessário aqui
+    with perfil.medir_importacoes(PAGINA):
+        from sklearn.cluster import KMeans
+        from sklearn.preprocessing import StandardScaler
+
+    # Normalização dos Dados
+    scaler = StandardScaler()
+    X = frequencia_gasto[COLUNAS_SEGMENTACAO]
+    X_scaled = scaler.fit_transform(X)
+
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+    return kmeans.fit_predict(X_scaled)
+
+# Quantidade máxima de pontos desenhados no gráfico dos clusters
+PONTOS_GRAFICO = int(os.environ.get("KPIS_PONTOS_GRAFICO_PCA", "20000"))
+
+# Função para projetar os clientes em 2 dimensões (PCA) sobre as mesmas
+# características normalizadas do K-Means. Calculada uma vez por versão da base
+# de features (features_clientes.versao()) e compartilhada entre as sessões,
+# sem cópia a cada rerun; o resultado não é alterado pela página. A recência muda
+# com a data, mas só por um deslocamento que a normalização elimina.
+@st.cache_resource(max_entries=2)
+def projetar_pca(versao, _caracteristicas):
+    with perfil.medir_importacoes(PAGINA):
+        from sklearn.decomposition import PCA
+        from sklearn.preprocessing import StandardScaler
+
+    X_scaled = StandardScaler().fit_transform(_caracteristicas[COLUNAS_SEGMENTACAO])
+    pca = PCA(n_components=2, random_state=42)
+    componentes = pca.fit_transform(X_scaled).astype(np.float32)
+    projecao = pd.DataFrame(componentes, index=_caracteristicas.index, columns=['PC1', 'PC2'])
+    return projecao, pca.explained_variance_ratio_
+
+# Amostra estratificada por cluster: cada cluster recebe pontos proporcionais ao
+# seu tamanho, com um mínimo para os clusters pequenos continuarem visíveis.
+# A semente fixa mantém os mesmos pontos entre reruns.
+def amostrar_por_cluster(pontos, orcamento, semente=42):
+    if len(pontos) <= orcamento:
+        return pontos
+    gerador = np.random.default_rng(semente)
+    clusters = pontos['Cluster'].to_numpy()
+    rotulos, contagens = np.unique(clusters, return_counts=True)
+    minimo = orcamento // (4 * len(rotulos))
+    escolhidos = []
+    for rotulo, contagem in zip(rotulos, contagens):
+        cota = min(contagem, max(round(orcamento * contagem / len(pontos)), minimo))
+        escolhidos.append(gerador.choice(np.flatnonzero(clusters == rotulo), cota, replace=False))
+    return pontos.iloc[np.sort(np.concatenate(escolhidos))]
+
+# Gráfico de dispersão (WebGL) dos clientes na projeção PCA, colorido por cluster.
+# Selecionar uma área com a caixa aproxima a visão e sorteia de novo os pontos só
+# dentro dela, revelando mais clientes a cada aproximação.
+def exibir_mapa_clusters(frequencia_gasto):
+    projecao, variancia = projetar_pca(features_clientes.versao(), frequencia_gasto)
+    pontos = projecao.join(frequencia_gasto[['Nome', 'FREQUENCIA_COMPRA', 'VALOR_GASTO', 'RECENCIA_DIAS', 'Cluster']])
+
+    st.session_state.setdefault('pca_zoom', 0)
+    visao = st.session_state.get('pca_visao')
+    if visao is not None:
+        x0, x1, y0, y1 = visao
+        pc1, pc2 = pontos['PC1'].to_numpy(), pontos['PC2'].to_numpy()
+        pontos = pontos[(pc1 >= x0) & (pc1 <= x1) & (pc2 >= y0) & (pc2 <= y1)]
+
+    amostra = amostrar_por_cluster(pontos, PONTOS_GRAFICO)
+    amostra = amostra.assign(Cluster=amostra['Cluster'].astype(str))
+
+    fig = px.scatter(
+        amostra, x='PC1', y='PC2', color='Cluster', render_mode='webgl',
+        hover_name='Nome', hover_data=['FREQUENCIA_COMPRA', 'VALOR_GASTO', 'RECENCIA_DIAS'],
+        labels={'PC1': f"PC1 ({variancia[0]:.0%} da variância)", 'PC2': f"PC2 ({variancia[1]:.0%} da variância)"},
+        category_orders={'Cluster': sorted(amostra['Cluster'].unique(), key=int)},
+    )
+    fig.update_traces(marker=dict(size=4, opacity=0.6))
+    fig.update_layout(dragmode='select')
+    if visao is not None:
+        fig.update_xaxes(range=[visao[0], visao[1]])
+        fig.update_yaxes(range=[visao[2], visao[3]])
+
+    # A chave muda a cada aproximação para a seleção anterior não ser reaplicada
+    evento = st.plotly_chart(fig, on_select="rerun", selection_mode="box", key=f"pca_{st.session_state['pca_zoom']}")
+    caixas = evento.selection.get("box", []) if evento else []
+    if caixas:
+        caixa = caixas[0]
+        st.session_state['pca_visao'] = (min(caixa['x']), max(caixa['x']), min(caixa['y']), max(caixa['y']))
+        st.session_state['pca_zoom'] += 1
+        st.rerun()
+
+    st.caption(f"{len(amostra):,} de {len(pontos):,} clientes nesta área. "
+               "Selecione uma área com a caixa para aproximar.".replace(",", "."))
+    if visao is not None and st.button("🔎 Ver todos os clientes"):
+        st.session_state['pca_visao'] = None
+        st.session_state['pca_zoom'] += 1
+        st.rerun()
+
+# Índice de busca por nome, montado uma vez por versão da base de features e
+# compartilhado entre as sessões (como a projeção PCA)
+@st.cache_resource(max_entries=2)
+def indice_clientes(versao, _clientes):
+    return busca_clientes.IndiceNomes(_clientes)
+
+# Detalhamento de um cliente: características e cluster lidos pelo índice do
+# DataFrame (ID_Cliente), histórico e produtos consultados no banco pelo ID
+def exibir_cliente(frequencia_gasto, id_cliente):
+    cliente = frequencia_gasto.loc[id_cliente]
+    col_cluster, col_compras, col_valor, col_ticket = st.columns(4)
+    col_cluster.metric("Cluster", int(cliente['Cluster']))
+    col_compras.metric("Compras", f"{int(cliente['FREQUENCIA_COMPRA']):,}".replace(",", "."))
+    col_valor.metric("Valor gasto", "R$ {:,.2f}".format(cliente['VALOR_GASTO']))
+    col_ticket.metric("Ticket médio", "R$ {:,.2f}".format(cliente['TICKET_MEDIO']))
+    st.caption(f"Última compra em {pd.Timestamp(cliente['ULTIMA_COMPRA']):%d/%m/%Y} "
+               f"(há {int(cliente['RECENCIA_DIAS'])} dias) · cliente há {int(cliente['TEMPO_CLIENTE_DIAS'])} dias")
+
+    try:
+        historico = busca_clientes.historico_vendas(id_cliente)
+        produtos = busca_clientes.produtos_cliente(id_cliente)
+    except Exception as e:
+        st.error(f"Erro ao consultar as vendas do cliente: {e}")
+        return
+    st.markdown(f"*Últimas {len(historico)} vendas:*")
+    st.dataframe(historico, hide_index=True)
+    st.markdown("*Produtos em que mais gastou:*")
+    st.dataframe(produtos, hide_index=True)
+
+# Tamanho máximo (MB) de arquivo exportado oferecido para download pelo navegador
+LIMITE_DOWNLOAD_MB = 200
+
+# Acompanha a exportação em andamento sem bloquear a página: só este fragmento
+# é reexecutado a cada segundo até o arquivo ficar pronto
+@st.fragment(run_every=1)
+def acompanhar_exportacao(id_trabalho):
+    trabalho = exportacao_campanhas.estado(id_trabalho)
+    if trabalho is None:
+        return
+    if trabalho["status"] == "executando":
+        st.progress(
+            exportacao_campanhas.progresso(trabalho),
+            text=f"Exportando... {trabalho['linhas']:,} clientes gravados".replace(",", "."),
+        )
+        if st.button("Cancelar exportação", key=f"cancelar_{id_trabalho}"):
+            exportacao_campanhas.cancelar(id_trabalho)
+    else:
+        # Terminou: uma execução completa da página troca o fragmento pelo resultado
+        st.rerun()
+
+# Função chamada depois do download: o trabalho terminado sai da memória do servidor
+def concluir_download(chave, id_trabalho):
+    exportacao_campanhas.descartar(id_trabalho)
+    st.session_state.pop(chave, None)
+
+# Função para exportar a lista de um segmento para as ferramentas de campanha
+def exibir_exportacao(segmento, limite, total_clientes):
+    chave = f"exportacao_{segmento}"
+    col_formato, col_botao = st.columns([1, 1])
+    with col_formato:
+        formato = st.radio("Formato do arquivo:", ["CSV", "Parquet"], horizontal=True, key=f"formato_{segmento}")
+    with col_botao:
+        if st.button("📤 Exportar lista com contatos", key=f"exportar_{segmento}"):
+            st.session_state[chave] = exportacao_campanhas.iniciar_exportacao(
+                segmento, limite, formato, total_estimado=total_clientes
+            )
+
+    if chave not in st.session_state:
+        return
+    trabalho = exportacao_campanhas.estado(st.session_state[chave])
+    if trabalho is None:
+        st.session_state.pop(chave)
+        return
+    if trabalho["status"] == "executando":
+        acompanhar_exportacao(trabalho["id"])
+    elif trabalho["status"] == "concluido":
+        tamanho_mb = os.path.getsize(trabalho["arquivo"]) / (1024 * 1024)
+        st.success(f"✅ {trabalho['linhas']:,} clientes exportados ({tamanho_mb:.1f} MB).".replace(",", "."))
+        if tamanho_mb <= LIMITE_DOWNLOAD_MB:
+            # O arquivo só é carregado na sessão no rerun em que o download é pedido
+            if st.button("📦 Preparar download", key=f"preparar_{trabalho['id']}"):
+                with open(trabalho["arquivo"], "rb") as arquivo:
+                    st.download_button("⬇️ Baixar arquivo", arquivo, file_name=os.path.basename(trabalho["arquivo"]),
+                                       key=f"baixar_{trabalho['id']}", on_click=concluir_download,
+                                       args=(chave, trabalho["id"]))
+        else:
+            st.info(f"Arquivo disponível no servidor: {trabalho['arquivo']}")
+    elif trabalho["status"] == "cancelado":
+        st.warning("Exportação cancelada.")
+    else:
+        st.error(f"Erro na exportação: {trabalho['erro']}")
+
+frequencia_gasto = CARREGAR_DADOS()
+perfil.marcar(PAGINA, "carregar_dados")
 
 # Verifica se os dados foram carregados corretamente
-if df is None or df.empty:
+if frequencia_gasto is None or frequencia_gasto.empty:
     st.warning("Nenhum dado foi carregado. Verifique a consulta SQL.")
     st.stop()
 
@@ -61,37 +249,19 @@ with col1:
 
     st.markdown("""---""")
 
-    # Converter a coluna de data para o formato datetime
-    df['Data_cx'] = pd.to_datetime(df['Data_cx'], errors='coerce')
-
-    # Remover entradas inválidas
-    linhas_antes = len(df)
-    df.dropna(subset=['Data_cx', 'Nome', 'Valor_Liquido'], inplace=True)
-    linhas_depois = len(df)
-    if linhas_depois < linhas_antes:
-        st.info(f"🔄 {linhas_antes - linhas_depois} registros foram removidos devido a dados ausentes.")
-
-    # Cálculo da Frequência de Compras e Valor Gasto
-    frequencia_gasto = df.groupby('Nome').agg({
-    'Data_cx': 'count',  # Conta quantas compras por cliente
-    'Valor_Liquido': 'sum'  # Soma total de gastos por cliente
-    }).rename(columns={'Data_cx': 'FREQUENCIA_COMPRA', 'Valor_Liquido': 'VALOR_GASTO'})
-
-    # Normalização dos Dados
-    scaler = StandardScaler()
-    X = frequencia_gasto[['FREQUENCIA_COMPRA', 'VALOR_GASTO']]
-    X_scaled = scaler.fit_transform(X)
+    # Frequência de compras, valor gasto e recência já vêm calculados por cliente
+    # da base de features (uma linha por ID_Cliente)
+    frequencia_gasto = frequencia_gasto[COLUNAS_EXIBICAO].copy()
 
     # Seção de K-Means com cor e slider
     st.markdown("<h3 style='color:#FAFAFA;'>📊 Aplicação do K-Means</h3>", unsafe_allow_html=True)
     n_clusters = st.slider("Escolha o número de clusters:", min_value=2, max_value=10, value=3)
 
     # Aplicação do K-Means
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    frequencia_gasto['Cluster'] = kmeans.fit_predict(X_scaled)
+    frequencia_gasto['Cluster'] = aplicar_kmeans(frequencia_gasto[COLUNAS_SEGMENTACAO], n_clusters)
 
     # Calcular a média das características por cluster
-    cluster_summary = frequencia_gasto.groupby('Cluster').mean().reset_index()
+    cluster_summary = frequencia_gasto.groupby('Cluster')[COLUNAS_SEGMENTACAO].mean().reset_index()
 
     # Renomear colunas, verificando os nomes existentes
     if 'FREQUENCIA_COMPRA' in cluster_summary.columns:
@@ -111,11 +281,12 @@ with col1:
     cluster_summary = cluster_summary.sort_values(by=[freq_col, valor_col], ascending=False)
 
     # Renomear as colunas para uma melhor visualização
-    cluster_summary.columns = ['Cluster', 'FREQUÊNCIA_COMPRA (média)', 'VALOR_GASTO (média)']
+    cluster_summary.columns = ['Cluster', 'FREQUÊNCIA_COMPRA (média)', 'VALOR_GASTO (média)', 'RECÊNCIA_DIAS (média)']
 
     # Formatar os valores para uma exibição amigável
     cluster_summary['FREQUÊNCIA_COMPRA (média)'] = cluster_summary['FREQUÊNCIA_COMPRA (média)'].map("{:.1f}".format)
     cluster_summary['VALOR_GASTO (média)'] = cluster_summary['VALOR_GASTO (média)'].map("R$ {:,.2f}".format) 
+    cluster_summary['RECÊNCIA_DIAS (média)'] = cluster_summary['RECÊNCIA_DIAS (média)'].map("{:.0f}".format)
 
     # Exibir o DataFrame formatado
     st.markdown("<h4>📋 Média das características por Cluster:</h4>", unsafe_allow_html=True)
@@ -155,6 +326,10 @@ with col1:
     for interpretacao in interpretacoes:
         st.write(interpretacao)
 
+    # Mapa dos clusters em 2 dimensões
+    st.markdown("<h4>🗺️ Mapa dos Clusters (PCA):</h4>", unsafe_allow_html=True)
+    exibir_mapa_clusters(frequencia_gasto)
+
     # Seção de filtros interativos
     st.markdown("<h4>🔍 Filtrar clientes por Cluster:</h4>", unsafe_allow_html=True)
     clusters_selecionados = st.multiselect(
@@ -168,6 +343,23 @@ with col1:
     clientes_ordenados = clientes_filtrados.sort_values(by=['FREQUENCIA_COMPRA', 'VALOR_GASTO'], ascending=[False, False])
     st.write(clientes_ordenados)
 
+    # Busca de um cliente pelo nome (índice por trigramas) e detalhamento pelo ID
+    st.markdown("<h4>🔎 Buscar cliente:</h4>", unsafe_allow_html=True)
+    texto_busca = st.text_input("Nome (ou parte dele) ou ID do cliente:", key="busca_cliente")
+    if texto_busca:
+        encontrados = indice_clientes(features_clientes.versao(), frequencia_gasto).buscar(texto_busca)
+        if encontrados.empty:
+            st.info("Nenhum cliente encontrado.")
+        else:
+            nomes_encontrados = dict(zip(encontrados['ID_Cliente'], encontrados['Nome']))
+            id_cliente = st.selectbox(
+                f"{len(encontrados)} clientes encontrados:", list(nomes_encontrados),
+                format_func=lambda id_cliente: f"{nomes_encontrados[id_cliente]} (ID {id_cliente})",
+            )
+            exibir_cliente(frequencia_gasto, id_cliente)
+
+perfil.marcar(PAGINA, "segmentacao_clientes")
+
 with col2:
     #st.markdown("<h2 style='text-align: center; '>📊 Criação de Campanhas de Marketing</h2>", unsafe_allow_html=True)
     st.markdown(
@@ -190,6 +382,7 @@ with col2:
     clientes_alto_valor = frequencia_gasto[frequencia_gasto['VALOR_GASTO'] >= threshold_valor]
     clientes_alto_valor = clientes_alto_valor.sort_values(by='FREQUENCIA_COMPRA', ascending=False)
     clientes_inativos = frequencia_gasto[frequencia_gasto['FREQUENCIA_COMPRA'] <= threshold_frequencia]
+    clientes_inativos = clientes_inativos.sort_values(by='RECENCIA_DIAS', ascending=False)
 
     with abas[0]:
         st.markdown("<h3 style='text-align: center; color:#2196F3;'>Clientes de Alto Valor - com maior VALOR_GASTO</h3>", unsafe_allow_html=True)
@@ -242,6 +435,8 @@ with col2:
         
         st.write(clientes_alto_valor)
 
+        exibir_exportacao("alto_valor", threshold_valor, len(clientes_alto_valor))
+
     with abas[1]:
         st.markdown("<h3 style='text-align: center; color:#FF5722;'>Clientes Inativos - com baixa FREQUENCIA_COMPRA</h3>", unsafe_allow_html=True)
 
@@ -285,4 +480,9 @@ with col2:
         
         st.write(clientes_inativos)
 
-st.markdown("""---""")   
+        exibir_exportacao("inativos", threshold_frequencia, len(clientes_inativos))
+
+st.markdown("""---""")
+
+perfil.marcar(PAGINA, "campanhas_marketing")
+perfil.finalizar(PAGINA)
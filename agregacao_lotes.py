@@ -0,0 +1,207 @@
+# Agregação por cliente fora da memória (out-of-core), em lotes de tamanho fixo.
+#
+# As vendas são lidas em lotes, do banco ou de um snapshot Parquet local, sempre na
+# ordem do ID_Venda. Cada lote vira parciais por cliente (quantidade, soma, primeira
+# e última data, último ID_Venda e nome da venda mais recente) que são combinadas
+# aos poucos com as já acumuladas. A memória usada fica limitada ao lote mais as
+# parciais, que têm uma linha por cliente: não depende da quantidade de vendas.
+#
+# Exemplos:
+#     python agregacao_lotes.py --memoria-mb 64 --verificar
+#     python agregacao_lotes.py --gravar-snapshot dados/vendas.parquet
+#     python agregacao_lotes.py --snapshot dados/vendas.parquet --memoria-mb 32
+import os
+import time
+
+import pandas as pd
+
+import banco_dados
+from features_clientes import COLUNAS_PARCIAIS, reduzir_parciais
+
+# Memória aproximada para cada lote de vendas (MB) e o tamanho estimado de uma
+# linha em pandas (ID_Venda, ID_Cliente, valor, data e o nome como objeto Python)
+MEMORIA_LOTE_MB = float(os.environ.get("KPIS_MEMORIA_LOTE_MB", "64"))
+BYTES_POR_LINHA = 160
+
+# Vendas individuais com os mesmos filtros da base de features, na ordem do
+# índice clusterizado (o ORDER BY não custa uma ordenação no servidor)
+CONSULTA_VENDAS_LINHAS = """
+SELECT ID_Venda, ID_Cliente, Nome, Valor_Liquido, Data_cx
+FROM Vendas
+WHERE ID_Venda > ?
+  AND ID_Cliente IS NOT NULL
+  AND Nome IS NOT NULL AND Nome <> ''
+  AND Data_cx IS NOT NULL
+  AND Valor_Liquido IS NOT NULL
+ORDER BY ID_Venda
+"""
+
+COLUNAS_VENDAS = ["ID_Venda", "ID_Cliente", "Nome", "Valor_Liquido", "Data_cx"]
+
+
+def linhas_por_lote(memoria_mb=MEMORIA_LOTE_MB):
+    return max(int(memoria_mb * 1024 * 1024 / BYTES_POR_LINHA), 1000)
+
+
+# Lotes de vendas lidos do banco (com ID_Venda maior que ultimo_id)
+def lotes_banco(ultimo_id=0, tamanho_lote=None, dados_conexao=banco_dados.DADOS_CONEXAO):
+    return banco_dados.executar_em_lotes(
+        CONSULTA_VENDAS_LINHAS, (int(ultimo_id),), tamanho_lote or linhas_por_lote(), dados_conexao
+    )
+
+
+# Lotes de vendas lidos de um snapshot Parquet local (arquivo ou pasta de arquivos)
+def lotes_snapshot(caminho, ultimo_id=0, tamanho_lote=None):
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(caminho, format="parquet")
+    for lote in dataset.to_batches(columns=COLUNAS_VENDAS, filter=ds.field("ID_Venda") > int(ultimo_id),
+                                   batch_size=tamanho_lote or linhas_por_lote()):
+        yield lote.to_pandas()
+
+
+# Grava as vendas do banco em um snapshot Parquet local, lote a lote, para
+# repetir agregações sem consultar o banco do PDV
+def gravar_snapshot(caminho, tamanho_lote=None, dados_conexao=banco_dados.DADOS_CONEXAO):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    temporario = caminho + ".parcial"
+    escritor = None
+    linhas = 0
+    try:
+        for lote in lotes_banco(0, tamanho_lote, dados_conexao):
+            tabela = pa.Table.from_pandas(_normalizar(lote), preserve_index=False)
+            if escritor is None:
+                escritor = pq.ParquetWriter(temporario, tabela.schema)
+            escritor.write_table(tabela.cast(escritor.schema))
+            linhas += len(lote)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    if escritor is not None:
+        os.replace(temporario, caminho)
+    return linhas
+
+
+# Tipos fixos e os mesmos filtros da consulta (um snapshot pode ter vendas sem cliente)
+def _normalizar(vendas):
+    vendas = vendas.loc[vendas["ID_Cliente"].notna(), COLUNAS_VENDAS].copy()
+    vendas["ID_Venda"] = vendas["ID_Venda"].astype("int64")
+    vendas["ID_Cliente"] = vendas["ID_Cliente"].astype("int64")
+    vendas["Valor_Liquido"] = pd.to_numeric(vendas["Valor_Liquido"], errors="coerce").astype("float64")
+    vendas["Data_cx"] = pd.to_datetime(vendas["Data_cx"], errors="coerce").astype("datetime64[ns]")
+    return vendas
+
+
+# Parciais por cliente de um conjunto de vendas (um lote ou a tabela inteira)
+def agregar_vendas(vendas):
+    vendas = _normalizar(vendas)
+    if not vendas["ID_Venda"].is_monotonic_increasing:
+        vendas = vendas.sort_values("ID_Venda", kind="stable")
+    parciais = vendas.groupby("ID_Cliente", sort=False).agg(
+        Nome=("Nome", "last"),
+        FREQUENCIA_COMPRA=("ID_Venda", "size"),
+        VALOR_GASTO=("Valor_Liquido", "sum"),
+        PRIMEIRA_COMPRA=("Data_cx", "min"),
+        ULTIMA_COMPRA=("Data_cx", "max"),
+        ULTIMO_ID_VENDA=("ID_Venda", "max"),
+    )
+    return parciais[COLUNAS_PARCIAIS]
+
+
+# Agrega os lotes (em ordem de ID_Venda) em uma linha por cliente.
+# As parciais dos lotes ficam pendentes até somarem tantas linhas quanto as já
+# acumuladas; só então são combinadas. Assim cada cliente é recombinado poucas
+# vezes (como em um merge geométrico) em vez de a cada lote.
+def agregar(lotes, ao_progredir=None):
+    acumulado = None
+    pendentes = []
+    linhas_pendentes = 0
+    vendas = 0
+    for lote in lotes:
+        if lote.empty:
+            continue
+        parciais = agregar_vendas(lote)
+        pendentes.append(parciais)
+        linhas_pendentes += len(parciais)
+        vendas += len(lote)
+        if linhas_pendentes >= max(len(acumulado) if acumulado is not None else 0, len(lote)):
+            acumulado = reduzir_parciais(([acumulado] if acumulado is not None else []) + pendentes)
+            pendentes, linhas_pendentes = [], 0
+        if ao_progredir:
+            ao_progredir(vendas, len(acumulado) if acumulado is not None else 0)
+
+    if pendentes:
+        acumulado = reduzir_parciais(([acumulado] if acumulado is not None else []) + pendentes)
+    if acumulado is None:
+        acumulado = pd.DataFrame(columns=COLUNAS_PARCIAIS)
+        acumulado.index.name = "ID_Cliente"
+    return acumulado
+
+
+# Compara o resultado em lotes com o groupby da tabela inteira em memória.
+# Devolve a lista de diferenças (vazia quando os resultados batem).
+def verificar(resultado, vendas):
+    esperado = agregar_vendas(vendas).sort_index()
+    resultado = resultado.sort_index()
+    if not esperado.index.equals(resultado.index):
+        return [f"clientes diferentes: {len(esperado)} esperados, {len(resultado)} em lotes"]
+
+    diferencas = []
+    for coluna in COLUNAS_PARCIAIS:
+        if coluna == "VALOR_GASTO":
+            # A soma em outra ordem pode diferir nas últimas casas do float
+            iguais = (esperado[coluna] - resultado[coluna]).abs() <= 1e-6 * esperado[coluna].abs().clip(lower=1)
+        else:
+            iguais = esperado[coluna].eq(resultado[coluna])
+        if not iguais.all():
+            diferencas.append(f"{coluna}: {int((~iguais).sum())} clientes diferentes")
+    return diferencas
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import psutil
+
+    parser = argparse.ArgumentParser(description="Agregação por cliente em lotes, com memória limitada")
+    parser.add_argument("--conexao", default=banco_dados.DADOS_CONEXAO, help="string de conexão ODBC")
+    parser.add_argument("--snapshot", default=None, help="lê as vendas deste snapshot Parquet em vez do banco")
+    parser.add_argument("--gravar-snapshot", default=None, help="grava as vendas do banco neste arquivo Parquet")
+    parser.add_argument("--memoria-mb", type=float, default=MEMORIA_LOTE_MB, help="memória aproximada por lote")
+    parser.add_argument("--verificar", action="store_true",
+                        help="compara com o groupby da tabela inteira em memória (precisa caber na RAM)")
+    args = parser.parse_args()
+
+    tamanho_lote = linhas_por_lote(args.memoria_mb)
+    processo = psutil.Process()
+    memoria_inicial = processo.memory_info().rss
+
+    if args.gravar_snapshot:
+        inicio = time.perf_counter()
+        linhas = gravar_snapshot(args.gravar_snapshot, tamanho_lote, args.conexao)
+        print(f"{linhas} vendas gravadas em {args.gravar_snapshot} em {time.perf_counter() - inicio:.1f}s")
+
+    memoria_maxima = [memoria_inicial]
+
+    def ao_progredir(vendas, clientes):
+        memoria_maxima[0] = max(memoria_maxima[0], processo.memory_info().rss)
+        print(f"\r{vendas:,} vendas, {clientes:,} clientes".replace(",", "."), end="", flush=True)
+
+    lotes = lotes_snapshot(args.snapshot, 0, tamanho_lote) if args.snapshot \
+        else lotes_banco(0, tamanho_lote, args.conexao)
+    inicio = time.perf_counter()
+    resultado = agregar(lotes, ao_progredir)
+    print(f"\n{len(resultado)} clientes em {time.perf_counter() - inicio:.1f}s, lotes de {tamanho_lote} linhas; "
+          f"memória do processo +{(memoria_maxima[0] - memoria_inicial) / 2 ** 20:.0f} MB no pico")
+
+    if args.verificar:
+        if args.snapshot:
+            vendas = pd.read_parquet(args.snapshot, columns=COLUNAS_VENDAS)
+        else:
+            vendas = banco_dados.executar_consulta(CONSULTA_VENDAS_LINHAS, (0,), args.conexao)
+        diferencas = verificar(resultado, vendas)
+        print("Resultado igual ao groupby em memória." if not diferencas
+              else "Diferenças encontradas:\n  " + "\n  ".join(diferencas))
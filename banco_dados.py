@@ -0,0 +1,480 @@
+# Conexão com o banco de dados compartilhada pelas páginas do dashboard
+import contextvars
+import json
+import os
+import threading
+import time
+import urllib
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+# Leitura colunar opcional: com o arrow-odbc os resultados chegam do driver ODBC
+# direto em lotes Arrow (buffers por coluna), sem passar por tuplas do pyodbc
+try:
+    import arrow_odbc
+    import pyarrow as pa
+except ImportError:
+    arrow_odbc = None
+else:
+    # Reaproveita as conexões ODBC entre leituras (o arrow-odbc não usa o pool do SQLAlchemy)
+    arrow_odbc.enable_odbc_connection_pooling()
+
+# Configuração de conexão com o banco de dados
+# (pode ser substituída pela variável de ambiente KPIS_DADOS_CONEXAO)
+DADOS_CONEXAO = os.environ.get(
+    "KPIS_DADOS_CONEXAO",
+    (
+        "Driver={SQL Server};"
+        "Server=DUXPC;"
+        "Database=teste2;"
+        "Trusted_Connection=yes;"
+    ),
+)
+
+# Leitura via Arrow ligada por padrão quando o arrow-odbc está instalado ("0" desliga)
+LEITURA_ARROW = os.environ.get("KPIS_LEITURA_ARROW", "1") != "0"
+
+# Linhas por lote Arrow e limite de tamanho para colunas de texto sem tamanho
+# definido (NVARCHAR(MAX)), que de outra forma impediriam a leitura em bloco
+TAMANHO_LOTE_ARROW = int(os.environ.get("KPIS_TAMANHO_LOTE_ARROW", "65536"))
+TAMANHO_MAXIMO_TEXTO = int(os.environ.get("KPIS_TAMANHO_MAXIMO_TEXTO", "4096"))
+
+# Falhas seguidas do driver na leitura Arrow (com o pd.read_sql funcionando) antes
+# de ela deixar de ser tentada na conexão; uma falha isolada pode ser passageira
+FALHAS_ARROW = int(os.environ.get("KPIS_FALHAS_ARROW", "3"))
+
+# Arquivo (JSON Lines) onde as consultas executadas são registradas, para montar a
+# carga de trabalho usada por recomendar_indices.py. Vazio: nada é registrado.
+ARQUIVO_LOG_CONSULTAS = os.environ.get("KPIS_LOG_CONSULTAS") or None
+
+# Consultas feitas dentro de cancelavel() usam um cursor do pyodbc que pode ser
+# cancelado no servidor por outra thread: o arrow-odbc não interrompe a execução
+# antes do primeiro lote, e as KPIs (poucas linhas) fazem todo o trabalho nela.
+# A leitura Arrow fica para as leituras sem cancelamento (base de features) e
+# para as leituras em lotes, que conferem o cancelamento a cada lote.
+# "0" desliga e todas as consultas voltam ao caminho normal.
+CANCELAR_CONSULTAS = os.environ.get("KPIS_CANCELAR_CONSULTAS", "1") != "0"
+
+# Réplica de leitura da conexão padrão (por exemplo, uma secundária legível do
+# Always On ou uma base restaurada/replicada). As lojas informam a sua em lojas.json.
+# Todas as consultas do dashboard são leituras e vão para a réplica enquanto ela
+# responde e está em dia; caso contrário voltam para o primário.
+DADOS_CONEXAO_REPLICA = os.environ.get("KPIS_DADOS_CONEXAO_REPLICA") or None
+
+# Atraso máximo aceito na réplica (segundos) antes de as leituras voltarem ao
+# primário e intervalo entre duas verificações do atraso
+ATRASO_MAXIMO_REPLICA = float(os.environ.get("KPIS_ATRASO_MAXIMO_REPLICA", "300"))
+INTERVALO_VERIFICACAO_REPLICA = float(os.environ.get("KPIS_INTERVALO_VERIFICACAO_REPLICA", "10"))
+
+# Leituras com isolamento SNAPSHOT ("1" liga): leem a última versão confirmada das
+# linhas sem pedir bloqueios compartilhados, então não esperam nem seguram as
+# gravações do PDV. Só é usado nos bancos com ALLOW_SNAPSHOT_ISOLATION ON.
+ISOLAMENTO_SNAPSHOT = os.environ.get("KPIS_ISOLAMENTO_SNAPSHOT", "0") == "1"
+
+# Marca d'água comparada entre primário e réplica (o mesmo ID crescente do cache_kpis)
+CONSULTA_MARCA_REPLICA = "SELECT MAX(ID_Venda) AS max_id FROM Vendas"
+CONSULTA_SNAPSHOT_PERMITIDO = "SELECT snapshot_isolation_state FROM sys.databases WHERE name = DB_NAME()"
+PREFIXO_SNAPSHOT = "SET TRANSACTION ISOLATION LEVEL SNAPSHOT;\n"
+
+_engines = {}
+_lock_engines = threading.Lock()
+_conexoes_sem_arrow = set()
+_falhas_arrow = {}          # conexão -> falhas seguidas da leitura Arrow
+_lock_arrow = threading.Lock()
+_lock_log = threading.Lock()
+_snapshot_permitido = {}    # conexão -> o banco aceita o isolamento SNAPSHOT
+_replicas = {}              # conexão do primário -> EstadoReplica
+_lock_replicas = threading.Lock()
+
+
+# Função para obter a engine do SQLAlchemy. Uma engine por string de conexão e
+# por processo, reaproveitando o pool de conexões entre reruns e sessões.
+def obter_engine(dados_conexao=DADOS_CONEXAO):
+    with _lock_engines:
+        engine = _engines.get(dados_conexao)
+        if engine is None:
+            params = urllib.parse.quote_plus(dados_conexao)
+            engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
+            _engines[dados_conexao] = engine
+        return engine
+
+
+# O arrow-odbc envia os parâmetros como texto; datas vão em formatos que o SQL
+# Server interpreta igual com qualquer configuração de idioma (DATEFORMAT)
+def _parametro_texto(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%dT%H:%M:%S')
+    if isinstance(valor, date):
+        return valor.strftime('%Y%m%d')
+    return str(valor)
+
+
+# Colunas DECIMAL são convertidas para float64 já no driver, como o pd.read_sql
+# faz com coerce_float, evitando objetos Decimal do Python
+def _mapear_esquema(esquema):
+    return pa.schema([
+        pa.field(campo.name, pa.float64(), campo.nullable) if pa.types.is_decimal(campo.type) else campo
+        for campo in esquema
+    ])
+
+
+class ConsultaCancelada(Exception):
+    pass
+
+
+# Conjunto de consultas que podem ser canceladas juntas (por exemplo, as de um
+# rerun do Streamlit). cancelar() interrompe no servidor os cursores em execução
+# e faz as consultas seguintes falharem com ConsultaCancelada antes de começar.
+class Cancelamento:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cursores = set()
+        self.cancelado = False
+
+    def registrar(self, cursor):
+        with self._lock:
+            if self.cancelado:
+                raise ConsultaCancelada("consulta cancelada antes de começar")
+            self._cursores.add(cursor)
+
+    def remover(self, cursor):
+        with self._lock:
+            self._cursores.discard(cursor)
+
+    def cancelar(self):
+        with self._lock:
+            self.cancelado = True
+            cursores = list(self._cursores)
+        for cursor in cursores:
+            try:
+                cursor.cancel()
+            except Exception:
+                pass
+
+
+_cancelamento_atual = contextvars.ContextVar("cancelamento_atual", default=None)
+
+
+def _conferir(cancelamento):
+    if cancelamento is not None and cancelamento.cancelado:
+        raise ConsultaCancelada("consulta cancelada")
+
+
+# As consultas executadas dentro do bloco (nesta thread) ficam ligadas ao cancelamento
+@contextmanager
+def cancelavel(cancelamento):
+    token = _cancelamento_atual.set(cancelamento)
+    try:
+        yield cancelamento
+    finally:
+        _cancelamento_atual.reset(token)
+
+
+# Cancelamento ligado às consultas desta thread (None fora de cancelavel)
+def cancelamento_atual():
+    return _cancelamento_atual.get()
+
+
+# Registra a consulta no log da carga de trabalho (sem a string de conexão)
+def _registrar_consulta(consulta_sql, params, duracao):
+    registro = {
+        "instante": datetime.now().isoformat(timespec="seconds"),
+        "sql": consulta_sql,
+        "params": [_parametro_texto(valor) for valor in params] if params else [],
+        "duracao_s": round(duracao, 4),
+    }
+    with _lock_log:
+        pasta = os.path.dirname(os.path.abspath(ARQUIVO_LOG_CONSULTAS))
+        os.makedirs(pasta, exist_ok=True)
+        with open(ARQUIVO_LOG_CONSULTAS, "a", encoding="utf-8") as arquivo:
+            arquivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+
+# Leitura em lotes Arrow e conversão para pandas com o mínimo de cópias
+def ler_arrow(consulta_sql, params=None, dados_conexao=DADOS_CONEXAO):
+    leitor = arrow_odbc.read_arrow_batches_from_odbc(
+        query=consulta_sql,
+        connection_string=dados_conexao,
+        batch_size=TAMANHO_LOTE_ARROW,
+        parameters=[_parametro_texto(valor) for valor in params] if params else None,
+        max_text_size=TAMANHO_MAXIMO_TEXTO,
+        map_schema=_mapear_esquema,
+    )
+    tabela = leitor.into_pyarrow_record_batch_reader().read_all()
+    return tabela.to_pandas(split_blocks=True, self_destruct=True)
+
+
+# Leitura tradicional: pyodbc devolve tuplas e o pandas monta o DataFrame
+def ler_pandas(consulta_sql, params=None, dados_conexao=DADOS_CONEXAO):
+    engine = obter_engine(dados_conexao)
+    return pd.read_sql(consulta_sql, engine, params=tuple(params) if params else None)
+
+
+# Leitura por um cursor do pyodbc registrado no cancelamento. Uma consulta
+# cancelada levanta ConsultaCancelada e a conexão é descartada do pool.
+def ler_cancelavel(consulta_sql, params, dados_conexao, cancelamento):
+    conexao = obter_engine(dados_conexao).raw_connection()
+    try:
+        cursor = conexao.cursor()
+        cancelamento.registrar(cursor)
+        try:
+            cursor.execute(consulta_sql, tuple(params) if params else ())
+            colunas = [coluna[0] for coluna in cursor.description]
+            linhas = [tuple(linha) for linha in cursor.fetchall()]
+        except Exception as erro:
+            if cancelamento.cancelado:
+                conexao.invalidate()
+                raise ConsultaCancelada("consulta cancelada no servidor") from erro
+            raise
+        finally:
+            cancelamento.remover(cursor)
+        cursor.close()
+    finally:
+        conexao.close()
+    return pd.DataFrame.from_records(linhas, columns=colunas, coerce_float=True)
+
+
+# Estado da réplica de leitura de uma conexão (primário). O atraso é medido pela
+# marca d'água: cada verificação anota o maior ID_Venda do primário, e o atraso é
+# o tempo desde a primeira anotação que a réplica ainda não alcançou.
+class EstadoReplica:
+    def __init__(self, replica):
+        self.replica = replica
+        self.em_uso = False
+        self.atraso_s = None
+        self.vendas_pendentes = None
+        self.erro = None
+        self.verificado_em = None
+        self._proxima_verificacao = 0.0
+        self._observacoes = []   # (instante, maior ID_Venda do primário) ainda não replicados
+        self._lock = threading.Lock()
+
+
+def registrar_replica(dados_conexao, replica):
+    with _lock_replicas:
+        if replica:
+            _replicas[dados_conexao] = EstadoReplica(replica)
+        else:
+            _replicas.pop(dados_conexao, None)
+
+
+if DADOS_CONEXAO_REPLICA:
+    registrar_replica(DADOS_CONEXAO, DADOS_CONEXAO_REPLICA)
+
+
+# Estado da réplica da conexão (None quando ela não tem réplica configurada)
+def estado_replica(dados_conexao=DADOS_CONEXAO):
+    estado = _replicas.get(dados_conexao)
+    if estado is not None:
+        _verificar_replica(dados_conexao, estado)
+    return estado
+
+
+def _maior_id(dados_conexao):
+    valor = _executar_consulta(CONSULTA_MARCA_REPLICA, None, dados_conexao).iloc[0]["max_id"]
+    return None if pd.isna(valor) else int(valor)
+
+
+# Compara as marcas d'água do primário e da réplica (no máximo uma vez por
+# intervalo, para todas as sessões) e decide se as leituras vão para a réplica.
+# Trocar de lado não deixa resultados velhos no cache: as marcas d'água lidas
+# pelo cache_kpis mudam junto e invalidam os períodos afetados.
+def _verificar_replica(dados_conexao, estado):
+    if time.monotonic() < estado._proxima_verificacao:
+        return
+    # Se outra sessão já está verificando, segue com o estado atual
+    if not estado._lock.acquire(blocking=False):
+        return
+    try:
+        if time.monotonic() < estado._proxima_verificacao:
+            return
+        estado._proxima_verificacao = time.monotonic() + INTERVALO_VERIFICACAO_REPLICA
+        # A verificação serve a todas as sessões e não entra no cancelamento de um rerun
+        with cancelavel(None):
+            try:
+                maior_replica = _maior_id(estado.replica)
+            except Exception as erro:
+                estado.em_uso = False
+                estado.erro = str(erro)
+                estado.verificado_em = datetime.now()
+                print(f"Réplica indisponível, leituras no primário: {erro}")
+                return
+            try:
+                maior_primario = _maior_id(dados_conexao)
+            except Exception as erro:
+                # Sem o primário o atraso não pode ser medido; a réplica segue atendendo
+                estado.em_uso = True
+                estado.erro = None
+                estado.verificado_em = datetime.now()
+                print(f"Primário sem resposta, atraso da réplica desconhecido: {erro}")
+                return
+
+        agora = time.monotonic()
+        if maior_primario is not None and (maior_replica is None or maior_primario > maior_replica):
+            estado._observacoes.append((agora, maior_primario))
+        estado._observacoes = [
+            (instante, maior) for instante, maior in estado._observacoes
+            if maior_replica is None or maior > maior_replica
+        ]
+        estado.atraso_s = agora - estado._observacoes[0][0] if estado._observacoes else 0.0
+        estado.vendas_pendentes = max((maior_primario or 0) - (maior_replica or 0), 0)
+        estado.erro = None
+        estado.em_uso = estado.atraso_s <= ATRASO_MAXIMO_REPLICA
+        estado.verificado_em = datetime.now()
+    finally:
+        estado._lock.release()
+
+
+# Uma consulta que falhou na réplica volta para o primário até a próxima verificação
+def _replica_falhou(estado, erro):
+    estado.em_uso = False
+    estado.erro = str(erro)
+    estado._proxima_verificacao = time.monotonic() + INTERVALO_VERIFICACAO_REPLICA
+    print(f"Consulta na réplica falhou, repetindo no primário: {erro}")
+
+
+# Conexão que atende as leituras: a réplica quando está em uso, senão o próprio primário
+def conexao_leitura(dados_conexao=DADOS_CONEXAO):
+    estado = _replicas.get(dados_conexao)
+    if estado is None:
+        return dados_conexao
+    _verificar_replica(dados_conexao, estado)
+    return estado.replica if estado.em_uso else dados_conexao
+
+
+# Acrescenta o SET TRANSACTION ISOLATION LEVEL SNAPSHOT quando ligado e permitido
+# no banco (consultado uma vez por conexão em sys.databases)
+def _com_isolamento(consulta_sql, dados_conexao):
+    if not ISOLAMENTO_SNAPSHOT:
+        return consulta_sql
+    permitido = _snapshot_permitido.get(dados_conexao)
+    if permitido is None:
+        try:
+            with cancelavel(None):
+                estado = _executar_consulta(CONSULTA_SNAPSHOT_PERMITIDO, None, dados_conexao)
+        except Exception as erro:
+            print(f"Não foi possível verificar o isolamento SNAPSHOT: {erro}")
+            return consulta_sql
+        permitido = not estado.empty and estado.iloc[0, 0] == 1
+        if not permitido:
+            print("Banco sem ALLOW_SNAPSHOT_ISOLATION: consultas com o isolamento padrão nesta conexão")
+        _snapshot_permitido[dados_conexao] = permitido
+    return PREFIXO_SNAPSHOT + consulta_sql if permitido else consulta_sql
+
+
+# Função para executar uma consulta e devolver o resultado em um DataFrame.
+# Os parâmetros usam o estilo do pyodbc ("?") e são passados como tupla.
+# Usa a leitura Arrow quando disponível e volta para o pd.read_sql em caso de falha.
+# A consulta vai para a réplica de leitura da conexão, quando houver, e é repetida
+# no primário se a réplica falhar.
+def executar_consulta(consulta_sql, params=None, dados_conexao=DADOS_CONEXAO):
+    if ARQUIVO_LOG_CONSULTAS:
+        inicio = time.perf_counter()
+        dados = _executar_roteada(consulta_sql, params, dados_conexao)
+        _registrar_consulta(consulta_sql, params, time.perf_counter() - inicio)
+        return dados
+    return _executar_roteada(consulta_sql, params, dados_conexao)
+
+
+def _executar_roteada(consulta_sql, params, dados_conexao):
+    leitura = conexao_leitura(dados_conexao)
+    if leitura != dados_conexao:
+        try:
+            return _executar_consulta(_com_isolamento(consulta_sql, leitura), params, leitura)
+        except ConsultaCancelada:
+            raise
+        except Exception as erro:
+            _replica_falhou(_replicas[dados_conexao], erro)
+    return _executar_consulta(_com_isolamento(consulta_sql, dados_conexao), params, dados_conexao)
+
+
+def _executar_consulta(consulta_sql, params, dados_conexao):
+    cancelamento = _cancelamento_atual.get()
+    if cancelamento is not None and CANCELAR_CONSULTAS:
+        return ler_cancelavel(consulta_sql, params, dados_conexao, cancelamento)
+    if arrow_odbc is not None and LEITURA_ARROW and dados_conexao not in _conexoes_sem_arrow:
+        try:
+            dados = ler_arrow(consulta_sql, params, dados_conexao)
+        except Exception as erro_arrow:
+            dados = ler_pandas(consulta_sql, params, dados_conexao)
+            _arrow_falhou(dados_conexao, erro_arrow)
+            return dados
+        if dados_conexao in _falhas_arrow:
+            with _lock_arrow:
+                _falhas_arrow.pop(dados_conexao, None)
+        return dados
+    return ler_pandas(consulta_sql, params, dados_conexao)
+
+
+# A consulta funcionou pelo caminho tradicional depois de falhar na leitura Arrow.
+# Um erro fora do driver (tipo ou conversão do pyarrow) é da própria leitura Arrow,
+# que deixa de ser tentada na conexão. Um erro do driver pode ser passageiro
+# (deadlock, conexão do pool derrubada, réplica instável): a leitura Arrow só é
+# desligada depois de FALHAS_ARROW falhas seguidas.
+def _arrow_falhou(dados_conexao, erro):
+    with _lock_arrow:
+        falhas = _falhas_arrow.get(dados_conexao, 0) + 1
+        if isinstance(erro, arrow_odbc.Error) and falhas < FALHAS_ARROW:
+            _falhas_arrow[dados_conexao] = falhas
+            print(f"Leitura Arrow falhou ({falhas}/{FALHAS_ARROW}), consulta repetida pelo pd.read_sql: {erro}")
+            return
+        _falhas_arrow.pop(dados_conexao, None)
+        _conexoes_sem_arrow.add(dados_conexao)
+    print(f"Leitura Arrow desativada para esta conexão: {erro}")
+
+
+# Executa a consulta e devolve o resultado aos poucos, em DataFrames de até
+# tamanho_lote linhas, sem carregar o resultado inteiro na memória.
+# Com réplica, volta para o primário só se a réplica falhar antes do primeiro lote.
+def executar_em_lotes(consulta_sql, params=None, tamanho_lote=TAMANHO_LOTE_ARROW, dados_conexao=DADOS_CONEXAO):
+    if ARQUIVO_LOG_CONSULTAS:
+        _registrar_consulta(consulta_sql, params, 0.0)
+    leitura = conexao_leitura(dados_conexao)
+    if leitura != dados_conexao:
+        lotes = _ler_em_lotes(_com_isolamento(consulta_sql, leitura), params, tamanho_lote, leitura)
+        try:
+            primeiro = next(lotes, None)
+        except ConsultaCancelada:
+            raise
+        except Exception as erro:
+            _replica_falhou(_replicas[dados_conexao], erro)
+        else:
+            if primeiro is not None:
+                yield primeiro
+                yield from lotes
+            return
+    yield from _ler_em_lotes(_com_isolamento(consulta_sql, dados_conexao), params, tamanho_lote, dados_conexao)
+
+
+# O cancelamento da thread (quando houver) é conferido a cada lote
+def _ler_em_lotes(consulta_sql, params, tamanho_lote, dados_conexao):
+    cancelamento = _cancelamento_atual.get() if CANCELAR_CONSULTAS else None
+    _conferir(cancelamento)
+    if arrow_odbc is not None and LEITURA_ARROW and dados_conexao not in _conexoes_sem_arrow:
+        leitor = arrow_odbc.read_arrow_batches_from_odbc(
+            query=consulta_sql,
+            connection_string=dados_conexao,
+            batch_size=tamanho_lote,
+            parameters=[_parametro_texto(valor) for valor in params] if params else None,
+            max_text_size=TAMANHO_MAXIMO_TEXTO,
+            map_schema=_mapear_esquema,
+            # Um buffer de transferência só: a memória fica limitada a um lote
+            fetch_concurrently=False,
+        )
+        for lote in leitor:
+            _conferir(cancelamento)
+            yield lote.to_pandas(split_blocks=True, self_destruct=True)
+        return
+
+    # stream_results faz o pyodbc buscar as linhas sob demanda (fetchmany)
+    engine = obter_engine(dados_conexao)
+    with engine.connect().execution_options(stream_results=True) as conexao:
+        for lote in pd.read_sql(consulta_sql, conexao, params=tuple(params) if params else None,
+                                chunksize=tamanho_lote):
+            _conferir(cancelamento)
+            yield lote
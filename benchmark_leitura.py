@@ -0,0 +1,71 @@
+# Compara a leitura em lotes Arrow (arrow-odbc) com o pd.read_sql tradicional.
+#
+# Executa cada consulta algumas vezes pelos dois caminhos de banco_dados e mostra
+# linhas por segundo. Por padrão roda contra a base local de teste criada por
+# gerar_base_teste.py.
+#
+# Exemplo:
+#     python gerar_base_teste.py --vendas 500000 --recriar
+#     python benchmark_leitura.py --repeticoes 5
+import time
+
+import banco_dados
+from gerar_base_teste import CONEXAO_TESTE
+
+# Consultas representativas: a carga completa da segmentação e agregações das KPIs
+CONSULTAS = {
+    "vendas_completas": "SELECT * FROM Vendas WHERE Nome IS NOT NULL AND Nome <> ''",
+    "itens_completos": "SELECT * FROM Vendas_Itens",
+    "produtos_por_valor": """
+        SELECT Descricao AS Produto, ROUND(SUM(Valor_liquido), 2) AS Valor
+        FROM Vendas_Itens
+        WHERE Exclusao IS NULL AND Cancelamento IS NULL
+        GROUP BY Descricao
+    """,
+}
+
+
+def medir(funcao, consulta_sql, dados_conexao, repeticoes):
+    tempos = []
+    linhas = 0
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        dados = funcao(consulta_sql, None, dados_conexao)
+        tempos.append(time.perf_counter() - inicio)
+        linhas = len(dados)
+        del dados
+    melhor = min(tempos)
+    return linhas, melhor, linhas / melhor if melhor > 0 else float("inf")
+
+
+def executar(dados_conexao=CONEXAO_TESTE, repeticoes=3, consultas=None):
+    caminhos = [("pd.read_sql", banco_dados.ler_pandas)]
+    if banco_dados.arrow_odbc is not None:
+        caminhos.insert(0, ("arrow-odbc", banco_dados.ler_arrow))
+    else:
+        print("arrow-odbc não instalado: apenas o caminho pd.read_sql será medido.")
+
+    resultados = []
+    for nome_consulta in consultas or CONSULTAS:
+        consulta_sql = CONSULTAS[nome_consulta]
+        for nome_caminho, funcao in caminhos:
+            # Uma leitura de aquecimento para tirar conexão e cache do servidor da medição
+            funcao(consulta_sql, None, dados_conexao)
+            linhas, melhor, por_segundo = medir(funcao, consulta_sql, dados_conexao, repeticoes)
+            resultados.append((nome_consulta, nome_caminho, linhas, melhor, por_segundo))
+            print(f"{nome_consulta:<20} {nome_caminho:<12} {linhas:>10} linhas  "
+                  f"{melhor:>8.3f}s  {por_segundo:>12,.0f} linhas/s")
+    return resultados
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark de leitura Arrow x pd.read_sql")
+    parser.add_argument("--conexao", default=CONEXAO_TESTE, help="string de conexão ODBC da base de teste")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--consulta", action="append", choices=sorted(CONSULTAS),
+                        help="consulta a medir (pode repetir); padrão: todas")
+    args = parser.parse_args()
+
+    executar(args.conexao, args.repeticoes, args.consulta)
@@ -0,0 +1,205 @@
+# Busca de clientes por nome e detalhamento de um cliente pelo ID_Cliente.
+#
+# O índice é montado uma vez por versão da base de features (features_clientes.versao())
+# sobre os nomes normalizados (minúsculas, sem acentos):
+#   - nomes ordenados, para buscar pelo começo do nome com busca binária;
+#   - listas de clientes por trigrama (três caracteres seguidos do nome, contando o
+#     espaço entre as palavras), para achar o texto em qualquer parte do nome: as
+#     listas dos trigramas da busca são intersectadas e só os poucos candidatos
+#     restantes são conferidos.
+# A montagem é vetorizada em numpy (sem laço por cliente) e a busca não percorre a base.
+#
+# O histórico de vendas e os produtos do cliente são lidos do banco filtrando por
+# ID_Cliente, pelo cache das KPIs.
+import os
+
+import numpy as np
+import pandas as pd
+
+import banco_dados
+import cache_kpis
+
+# Quantidade de vendas mais recentes no histórico do cliente
+LIMITE_HISTORICO = int(os.environ.get("KPIS_HISTORICO_CLIENTE", "200"))
+
+# Alfabeto dos trigramas: letras, dígitos e o espaço (busca como "da s" atravessa
+# palavras); os demais caracteres e a quebra de linha entre os nomes separam trigramas
+_ALFABETO = "abcdefghijklmnopqrstuvwxyz0123456789 "
+_BASE = len(_ALFABETO) + 1
+_CODIGOS = np.zeros(256, dtype=np.int32)
+for _posicao, _caractere in enumerate(_ALFABETO, start=1):
+    _CODIGOS[ord(_caractere)] = _posicao
+
+# Vendas do cliente com os mesmos filtros da base de features (as que entram na
+# frequência e no valor gasto), da mais recente para a mais antiga
+CONSULTA_HISTORICO = """
+SELECT TOP (?)
+    ID_Venda,
+    Data_cx AS Data,
+    CONVERT(VARCHAR(5), Hora, 108) AS Hora,
+    Vendedor,
+    Valor_Liquido AS Valor,
+    CASE WHEN Cancelamento IS NOT NULL THEN 'Sim' ELSE '' END AS Cancelada
+FROM Vendas
+WHERE ID_Cliente = ?
+  AND Nome IS NOT NULL AND Nome <> ''
+  AND Data_cx IS NOT NULL
+  AND Valor_Liquido IS NOT NULL
+ORDER BY ID_Venda DESC
+"""
+
+CONSULTA_PRODUTOS = """
+SELECT TOP 10
+    Descricao AS Produto,
+    SUM(QUANTIDADE) AS Quantidade,
+    ROUND(SUM(Valor_liquido), 2) AS Valor
+FROM Vendas_Itens
+WHERE ID_Cliente = ?
+  AND Exclusao IS NULL AND Cancelamento IS NULL
+GROUP BY Descricao
+ORDER BY Valor DESC
+"""
+
+
+# Minúsculas, sem acentos e com espaços simples (texto ASCII)
+def normalizar(nomes):
+    return (
+        pd.Series(nomes, dtype=object).fillna("").astype(str)
+        .str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+        .str.lower().str.split().str.join(" ")
+    )
+
+
+def _trigramas(codigos):
+    validos = (codigos[:-2] > 0) & (codigos[1:-1] > 0) & (codigos[2:] > 0)
+    trigramas = (codigos[:-2] * _BASE + codigos[1:-1]) * _BASE + codigos[2:]
+    return trigramas, validos
+
+
+class IndiceNomes:
+    def __init__(self, clientes):
+        self.ids = clientes.index.to_numpy()
+        self.nomes = clientes["Nome"].to_numpy()
+        self.valores = clientes["VALOR_GASTO"].to_numpy(dtype=np.float64)
+        self._posicao_id = pd.Index(self.ids)
+        self._por_valor = np.argsort(-self.valores, kind="stable")
+        normalizados = normalizar(self.nomes)
+        self.normalizados = normalizados.to_numpy(dtype=object)
+
+        # Começo do nome: nomes normalizados em ordem e a posição de cada um
+        self._ordem = np.argsort(self.normalizados, kind="stable")
+        self._ordenados = self.normalizados[self._ordem]
+
+        # Trigramas: todos os nomes em um texto só, separados por "\n" (código 0)
+        quantidade = len(self.normalizados)
+        texto = "\n".join(self.normalizados).encode("ascii")
+        codigos = _CODIGOS[np.frombuffer(texto, dtype=np.uint8)]
+        dono = np.repeat(np.arange(quantidade, dtype=np.int64),
+                         normalizados.str.len().to_numpy() + 1)[:len(codigos)]
+        trigramas, validos = _trigramas(codigos)
+        chaves = np.unique(trigramas[validos].astype(np.int64) * max(quantidade, 1) + dono[:-2][validos])
+        # Lista de clientes de cada trigrama: clientes[inicio[t]:inicio[t + 1]]
+        self._clientes = (chaves % max(quantidade, 1)).astype(np.int32)
+        self._inicio = np.searchsorted(chaves // max(quantidade, 1), np.arange(_BASE ** 3 + 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _por_prefixo(self, busca):
+        inicio = np.searchsorted(self._ordenados, busca, side="left")
+        fim = np.searchsorted(self._ordenados, busca + "\x7f", side="left")
+        return self._ordem[inicio:fim]
+
+    # Candidatos que têm todos os trigramas da busca (ainda sem conferir o texto).
+    # Uma busca sem nenhum trigrama (só pontuação entre letras, como "d'a") é
+    # procurada direto nos nomes.
+    def _por_trigramas(self, busca):
+        codigos = _CODIGOS[np.frombuffer(busca.encode("ascii"), dtype=np.uint8)]
+        trigramas, validos = _trigramas(codigos)
+        trigramas = np.unique(trigramas[validos])
+        if len(trigramas) == 0:
+            return np.flatnonzero(pd.Series(self.normalizados).str.contains(busca, regex=False).to_numpy())
+        listas = sorted((self._clientes[self._inicio[t]:self._inicio[t + 1]] for t in trigramas), key=len)
+        # Interseção por marcação (linear no tamanho das listas, sem ordenar)
+        candidatos = listas[0]
+        marcados = np.zeros(len(self.ids), dtype=bool)
+        for lista in listas[1:]:
+            if len(candidatos) == 0:
+                break
+            marcados[lista] = True
+            candidatos = candidatos[marcados[candidatos]]
+            marcados[lista] = False
+        return candidatos
+
+    # Posições do grupo do maior para o menor valor gasto, pela ordem calculada na
+    # montagem (uma passada pela base em vez de ordenar grupos grandes a cada busca)
+    def _ordenar_por_valor(self, grupo):
+        if len(grupo) < 1000:
+            return grupo[np.argsort(-self.valores[grupo], kind="stable")]
+        marcados = np.zeros(len(self.ids), dtype=bool)
+        marcados[grupo] = True
+        return self._por_valor[marcados[self._por_valor]]
+
+    # Clientes cujo nome começa com o texto (primeiro) ou o contém (com 3 letras
+    # ou mais), cada grupo do maior para o menor valor gasto. Um número também
+    # procura o ID_Cliente.
+    def buscar(self, texto, limite=20):
+        busca = normalizar([texto]).iloc[0]
+        if not busca:
+            return pd.DataFrame(columns=["ID_Cliente", "Nome"])
+
+        grupos = []
+        if busca.isdigit() and int(busca) in self._posicao_id:
+            grupos.append((np.atleast_1d(self._posicao_id.get_loc(int(busca))), False))
+        grupos.append((self._por_prefixo(busca), False))
+        if len(busca) >= 3:
+            grupos.append((self._por_trigramas(busca), True))
+
+        escolhidos = []
+        vistos = set()
+        for grupo, conferir in grupos:
+            grupo = self._ordenar_por_valor(grupo)
+            for posicao in grupo:
+                if len(escolhidos) == limite:
+                    break
+                # Os trigramas podem estar em outra ordem no nome: o texto é
+                # conferido só até completar o limite
+                if posicao in vistos or (conferir and busca not in self.normalizados[posicao]):
+                    continue
+                vistos.add(posicao)
+                escolhidos.append(posicao)
+        return pd.DataFrame({"ID_Cliente": self.ids[escolhidos], "Nome": self.nomes[escolhidos]})
+
+
+# Últimas vendas do cliente (as mesmas que entram na base de features)
+def historico_vendas(id_cliente, limite=LIMITE_HISTORICO, dados_conexao=banco_dados.DADOS_CONEXAO):
+    return cache_kpis.consultar(CONSULTA_HISTORICO, ["Vendas"], params=(int(limite), int(id_cliente)),
+                                dados_conexao=dados_conexao)
+
+
+# Produtos em que o cliente mais gastou
+def produtos_cliente(id_cliente, dados_conexao=banco_dados.DADOS_CONEXAO):
+    return cache_kpis.consultar(CONSULTA_PRODUTOS, ["Vendas_Itens"], params=(int(id_cliente),),
+                                dados_conexao=dados_conexao)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import features_clientes
+
+    parser = argparse.ArgumentParser(description="Busca clientes pelo nome na base de features")
+    parser.add_argument("texto", help="começo ou parte do nome (ou o ID_Cliente)")
+    parser.add_argument("--limite", type=int, default=20)
+    args = parser.parse_args()
+
+    clientes = features_clientes.obter_features()
+    inicio = time.perf_counter()
+    indice = IndiceNomes(clientes)
+    montagem = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    resultado = indice.buscar(args.texto, args.limite)
+    busca = time.perf_counter() - inicio
+    print(resultado.to_string(index=False))
+    print(f"{len(indice)} clientes; índice montado em {montagem:.2f}s, busca em {busca * 1000:.1f} ms")
@@ -0,0 +1,363 @@
+# Cache dos resultados das KPIs invalidado por marca d'água (watermark) das tabelas.
+#
+# Em vez de expirar os resultados por tempo, o cache consulta periodicamente uma
+# marca d'água barata de cada tabela de origem (maior ID de venda, quantidade de
+# linhas pelos metadados, rowversion quando existir e um checksum da janela de
+# dias recentes) e invalida apenas os resultados cujo período se sobrepõe às
+# linhas novas ou alteradas. Períodos históricos ficam em cache indefinidamente e
+# os números do dia são atualizados poucos segundos após uma venda. Sessões que
+# pedem ao mesmo tempo o mesmo resultado compartilham uma única execução.
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+import banco_dados
+
+# Tabelas monitoradas: coluna de ID crescente, coluna de data usada nos filtros
+# das KPIs e colunas que podem ser alteradas depois da venda (cancelamentos etc.)
+TABELAS_MONITORADAS = {
+    "Vendas": {
+        "coluna_id": "ID_Venda",
+        "coluna_data": "Data_cx",
+        "colunas_alteraveis": ["Exclusao", "Cancelamento", "Valor_Liquido", "Valor_itens"],
+    },
+    "Vendas_Itens": {
+        "coluna_id": "ID_Venda",
+        "coluna_data": "Data_cx",
+        "colunas_alteraveis": ["Exclusao", "Cancelamento", "Valor_liquido", "QUANTIDADE"],
+    },
+    "Vendas_Receber": {
+        "coluna_id": "ID_Venda",
+        "coluna_data": "Data_Turno",
+        "colunas_alteraveis": ["Exclusao", "Meio", "Valor"],
+    },
+}
+
+# Coluna rowversion presente nas tabelas (opcional). Com ela qualquer alteração é
+# detectada com precisão; sem ela as alterações são procuradas apenas na janela
+# de dias recentes definida abaixo.
+COLUNA_ROWVERSION = os.environ.get("KPIS_COLUNA_ROWVERSION") or None
+
+# Intervalo mínimo entre duas verificações das marcas d'água (segundos)
+INTERVALO_VERIFICACAO = float(os.environ.get("KPIS_INTERVALO_VERIFICACAO", "5"))
+
+# Quantidade de dias recentes cobertos pelo checksum de alterações
+JANELA_DIAS_ALTERACAO = int(os.environ.get("KPIS_JANELA_DIAS_ALTERACAO", "7"))
+
+# Quantidade máxima de resultados mantidos em memória (os menos usados saem primeiro)
+MAXIMO_ENTRADAS = int(os.environ.get("KPIS_CACHE_MAXIMO_ENTRADAS", "512"))
+
+# Coalescência ("single-flight"): quem pede um valor que outra sessão já está
+# calculando espera por esse cálculo em vez de repetir a consulta. "0" desliga.
+COALESCER = os.environ.get("KPIS_COALESCER", "1") != "0"
+
+_lock = threading.RLock()
+_entradas = OrderedDict()   # chave -> {"valor", "tabelas", "inicio", "fim"}
+_geracao = 0                # incrementada a cada invalidação
+_invalidacoes = []          # (geração, conexão, tabela, início, fim) enquanto há cálculos em andamento
+_calculos = set()           # _Calculo ainda não concluídos (coalescidos ou não)
+_em_andamento = {}          # chave -> _Calculo ainda não concluído
+_metricas = {"execucoes": 0, "coalescidas": 0, "acertos_cache": 0, "espera_s": 0.0}
+_marcas = {}                # (conexão, tabela) -> última marca d'água lida
+_ultima_verificacao = {}    # conexão -> instante da última verificação
+_locks_verificacao = {}     # conexão -> lock da verificação (lojas verificadas em paralelo)
+
+
+def _como_data(valor):
+    if valor is None or pd.isna(valor):
+        return None
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return pd.Timestamp(valor).date()
+
+
+# Consulta que lê a marca d'água de todas as tabelas monitoradas em uma única ida ao banco.
+# A quantidade de linhas vem de sys.partitions (metadados), sem varrer as tabelas.
+def _consulta_marcas():
+    limite = date.today() - timedelta(days=JANELA_DIAS_ALTERACAO)
+    partes = []
+    params = []
+    for tabela, config in TABELAS_MONITORADAS.items():
+        versao = (
+            f"(SELECT CAST(MAX({COLUNA_ROWVERSION}) AS BIGINT) FROM {tabela})"
+            if COLUNA_ROWVERSION else "CAST(NULL AS BIGINT)"
+        )
+        colunas = ", ".join(config["colunas_alteraveis"])
+        partes.append(f"""
+        SELECT
+            '{tabela}' AS tabela,
+            (SELECT MAX({config['coluna_id']}) FROM {tabela}) AS max_id,
+            (SELECT SUM(p.rows) FROM sys.partitions p
+              WHERE p.object_id = OBJECT_ID('{tabela}') AND p.index_id IN (0, 1)) AS linhas,
+            {versao} AS max_versao,
+            (SELECT CHECKSUM_AGG(BINARY_CHECKSUM({config['coluna_id']}, {colunas}))
+               FROM {tabela} WHERE {config['coluna_data']} >= ?) AS checksum_recente
+        """)
+        params.append(limite)
+    return " UNION ALL ".join(partes), params, limite
+
+
+# Intervalo de datas das linhas com ID (ou rowversion) maior que a marca anterior
+def _intervalo_alterado(tabela, condicao, valor_anterior, dados_conexao):
+    coluna_data = TABELAS_MONITORADAS[tabela]["coluna_data"]
+    consulta_sql = f"""
+    SELECT MIN({coluna_data}) AS menor_data, MAX({coluna_data}) AS maior_data
+    FROM {tabela}
+    WHERE {condicao}
+    """
+    resultado = banco_dados.executar_consulta(consulta_sql, (valor_anterior,), dados_conexao)
+    return _como_data(resultado.iloc[0]["menor_data"]), _como_data(resultado.iloc[0]["maior_data"])
+
+
+# Compara a marca d'água atual com a anterior e devolve os períodos a invalidar.
+# Cada item é (tabela, data_inicio, data_fim); datas None significam "tudo".
+def _detectar_alteracoes(tabela, anterior, atual, limite_recente, dados_conexao):
+    alteracoes = []
+
+    if COLUNA_ROWVERSION and anterior["max_versao"] is not None and atual["max_versao"] != anterior["max_versao"]:
+        # Com rowversion, inserções e alterações são localizadas pela própria versão
+        inicio, fim = _intervalo_alterado(
+            tabela, f"{COLUNA_ROWVERSION} > CAST(CAST(? AS BIGINT) AS BINARY(8))", anterior["max_versao"], dados_conexao
+        )
+        if inicio is not None:
+            alteracoes.append((tabela, inicio, fim))
+    elif anterior["max_id"] is not None and atual["max_id"] != anterior["max_id"]:
+        # Linhas novas: apenas os períodos das vendas com ID maior que o anterior
+        inicio, fim = _intervalo_alterado(
+            tabela, f"{TABELAS_MONITORADAS[tabela]['coluna_id']} > ?", anterior["max_id"], dados_conexao
+        )
+        if inicio is not None:
+            alteracoes.append((tabela, inicio, fim))
+
+    # Alterações em linhas existentes (cancelamento, exclusão) dentro da janela recente
+    if not COLUNA_ROWVERSION and atual["checksum_recente"] != anterior["checksum_recente"]:
+        alteracoes.append((tabela, limite_recente, None))
+
+    # Linhas removidas ou quantidade que não bate com os IDs novos: invalida a tabela toda
+    if atual["linhas"] is not None and anterior["linhas"] is not None and atual["linhas"] < anterior["linhas"]:
+        alteracoes.append((tabela, None, None))
+    if anterior["max_id"] is not None and atual["max_id"] is not None and atual["max_id"] < anterior["max_id"]:
+        alteracoes.append((tabela, None, None))
+
+    return alteracoes
+
+
+# Verifica as marcas d'água (no máximo uma vez por INTERVALO_VERIFICACAO, para
+# todas as sessões) e invalida os resultados afetados
+def verificar_alteracoes(dados_conexao=banco_dados.DADOS_CONEXAO, forcar=False):
+    if not forcar and time.monotonic() - _ultima_verificacao.get(dados_conexao, 0.0) < INTERVALO_VERIFICACAO:
+        return []
+    with _lock:
+        lock_verificacao = _locks_verificacao.setdefault(dados_conexao, threading.Lock())
+    # Se outra sessão já está verificando esta conexão, segue com o cache atual
+    if not lock_verificacao.acquire(blocking=forcar):
+        return []
+    try:
+        if not forcar and time.monotonic() - _ultima_verificacao.get(dados_conexao, 0.0) < INTERVALO_VERIFICACAO:
+            return []
+        _ultima_verificacao[dados_conexao] = time.monotonic()
+
+        consulta_sql, params, limite_recente = _consulta_marcas()
+        try:
+            resultado = banco_dados.executar_consulta(consulta_sql, params, dados_conexao)
+        except Exception as e:
+            print(f"Erro ao verificar as marcas d'água: {e}")
+            return []
+
+        alteracoes = []
+        for _, linha in resultado.iterrows():
+            tabela = linha["tabela"]
+            atual = {
+                "max_id": None if pd.isna(linha["max_id"]) else int(linha["max_id"]),
+                "linhas": None if pd.isna(linha["linhas"]) else int(linha["linhas"]),
+                "max_versao": None if pd.isna(linha["max_versao"]) else int(linha["max_versao"]),
+                "checksum_recente": None if pd.isna(linha["checksum_recente"]) else int(linha["checksum_recente"]),
+            }
+            anterior = _marcas.get((dados_conexao, tabela))
+            _marcas[(dados_conexao, tabela)] = atual
+            if anterior is None or anterior == atual:
+                continue
+            try:
+                alteracoes.extend(_detectar_alteracoes(tabela, anterior, atual, limite_recente, dados_conexao))
+            except Exception as e:
+                print(f"Erro ao localizar as alterações em {tabela}: {e}")
+                alteracoes.append((tabela, None, None))
+
+        for tabela, inicio, fim in alteracoes:
+            invalidar(tabela, inicio, fim, dados_conexao)
+        return alteracoes
+    finally:
+        lock_verificacao.release()
+
+
+def _sobrepoe(entrada, inicio, fim):
+    # Resultados sem período (histórico completo) sempre se sobrepõem
+    if entrada["inicio"] is None and entrada["fim"] is None:
+        return True
+    if inicio is None and fim is None:
+        return True
+    entrada_inicio = entrada["inicio"] or date.min
+    entrada_fim = entrada["fim"] or date.max
+    return entrada_inicio <= (fim or date.max) and (inicio or date.min) <= entrada_fim
+
+
+# Remove do cache os resultados que dependem da tabela e cujo período se sobrepõe ao informado.
+# A invalidação fica anotada enquanto houver cálculos iniciados antes dela.
+def invalidar(tabela, inicio=None, fim=None, dados_conexao=banco_dados.DADOS_CONEXAO):
+    global _geracao
+    with _lock:
+        _geracao += 1
+        if _calculos:
+            _invalidacoes.append((_geracao, dados_conexao, tabela, _como_data(inicio), _como_data(fim)))
+        chaves = [
+            chave for chave, entrada in _entradas.items()
+            if chave[0] == dados_conexao and tabela in entrada["tabelas"] and _sobrepoe(entrada, inicio, fim)
+        ]
+        for chave in chaves:
+            del _entradas[chave]
+    return len(chaves)
+
+
+def limpar():
+    with _lock:
+        _entradas.clear()
+
+
+# Cálculo em andamento de uma chave, compartilhado com quem chegar durante ele.
+# Guarda a conexão, as tabelas e o período do valor, como uma entrada do cache.
+class _Calculo:
+    def __init__(self, geracao, dados_conexao, tabelas, inicio, fim):
+        self.geracao = geracao
+        self.dados_conexao = dados_conexao
+        self.tabelas = tuple(tabelas)
+        self.inicio = inicio
+        self.fim = fim
+        self.pronto = threading.Event()
+        self.valor = None
+        self.falhou = False
+
+
+# Alguma invalidação feita depois do início do cálculo atinge o valor dele (com _lock)
+def _desatualizado(calculo):
+    alcance = {"inicio": calculo.inicio, "fim": calculo.fim}
+    return any(
+        geracao > calculo.geracao and conexao == calculo.dados_conexao and tabela in calculo.tabelas
+        and _sobrepoe(alcance, inicio, fim)
+        for geracao, conexao, tabela, inicio, fim in _invalidacoes
+    )
+
+
+# Tira o cálculo dos em andamento e esquece as invalidações que nenhum outro
+# cálculo precisa conferir (com _lock)
+def _encerrar(chave, calculo):
+    if _em_andamento.get(chave) is calculo:
+        del _em_andamento[chave]
+    _calculos.discard(calculo)
+    menor = min((outro.geracao for outro in _calculos), default=_geracao)
+    _invalidacoes[:] = [invalidacao for invalidacao in _invalidacoes if invalidacao[0] > menor]
+
+
+# Espera o cálculo de outra sessão; a espera é interrompida se o rerun de quem
+# espera for cancelado (como uma consulta própria seria)
+def _aguardar(calculo):
+    cancelamento = banco_dados.cancelamento_atual()
+    while not calculo.pronto.wait(0.1):
+        if cancelamento is not None and cancelamento.cancelado:
+            raise banco_dados.ConsultaCancelada("espera por consulta em andamento cancelada")
+
+
+# Contadores desde o início do processo (ou de zerar_metricas): valores calculados,
+# pedidos atendidos por um cálculo já em andamento (execuções economizadas),
+# acertos do cache e o tempo total de espera desses pedidos
+def metricas():
+    with _lock:
+        return dict(_metricas, em_andamento=len(_em_andamento))
+
+
+def zerar_metricas():
+    with _lock:
+        _metricas.update(execucoes=0, coalescidas=0, acertos_cache=0, espera_s=0.0)
+
+
+# Função para guardar no cache um valor calculado a partir das tabelas (não só o
+# resultado de uma consulta), com a mesma invalidação por período.
+# chave: tupla que identifica o valor na conexão; calcular: função sem argumentos.
+# O valor devolvido é o próprio objeto guardado e não deve ser alterado.
+# Pedidos simultâneos da mesma chave fazem um único cálculo: os demais esperam
+# por ele. Se ele falhar (ou for cancelado), quem esperava calcula por conta própria.
+def obter(chave, tabelas, calcular, data_inicio=None, data_fim=None,
+          dados_conexao=banco_dados.DADOS_CONEXAO):
+    verificar_alteracoes(dados_conexao)
+
+    chave = (dados_conexao,) + tuple(chave)
+    while True:
+        with _lock:
+            entrada = _entradas.get(chave)
+            if entrada is not None:
+                _entradas.move_to_end(chave)
+                _metricas["acertos_cache"] += 1
+                return entrada["valor"]
+            calculo = _em_andamento.get(chave)
+            # Um cálculo atingido por uma invalidação feita depois do seu início
+            # não serve a quem chega depois
+            if calculo is None or _desatualizado(calculo) or not COALESCER:
+                calculo = _Calculo(_geracao, dados_conexao, tabelas, _como_data(data_inicio), _como_data(data_fim))
+                _calculos.add(calculo)
+                if COALESCER:
+                    _em_andamento[chave] = calculo
+                _metricas["execucoes"] += 1
+                break
+
+        inicio = time.perf_counter()
+        _aguardar(calculo)
+        with _lock:
+            _metricas["espera_s"] += time.perf_counter() - inicio
+            if not calculo.falhou:
+                _metricas["coalescidas"] += 1
+                return calculo.valor
+
+    try:
+        valor = calcular()
+    except BaseException:
+        with _lock:
+            _encerrar(chave, calculo)
+        calculo.falhou = True
+        calculo.pronto.set()
+        raise
+
+    with _lock:
+        calculo.valor = valor
+        # Se uma invalidação da mesma conexão, de uma das tabelas e do período do
+        # valor chegou enquanto ele era calculado, ele pode estar desatualizado e
+        # não é guardado (quem já esperava recebe o mesmo valor)
+        if not _desatualizado(calculo):
+            _entradas[chave] = {
+                "valor": valor,
+                "tabelas": calculo.tabelas,
+                "inicio": calculo.inicio,
+                "fim": calculo.fim,
+            }
+            while len(_entradas) > MAXIMO_ENTRADAS:
+                _entradas.popitem(last=False)
+        _encerrar(chave, calculo)
+    calculo.pronto.set()
+    return valor
+
+
+# Função para executar uma consulta usando o cache.
+# tabelas: tabelas lidas pela consulta; data_inicio/data_fim: período filtrado
+# (None quando a consulta lê todo o histórico).
+def consultar(consulta_sql, tabelas, data_inicio=None, data_fim=None, params=None,
+              dados_conexao=banco_dados.DADOS_CONEXAO):
+    valor = obter(
+        (consulta_sql, tuple(params) if params else ()), tabelas,
+        lambda: banco_dados.executar_consulta(consulta_sql, params, dados_conexao),
+        data_inicio, data_fim, dados_conexao,
+    )
+    return valor.copy()
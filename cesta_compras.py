@@ -0,0 +1,327 @@
+# Análise de cesta de compras: produtos (ou categorias) comprados juntos.
+#
+# Os itens vendidos no período viram uma matriz esparsa binária venda × produto
+# (scipy.sparse, uma linha por venda). Os pares frequentes saem de um único
+# produto de matrizes XᵀX restrito aos produtos frequentes; conjuntos maiores
+# seguem o Apriori, contando cada candidato pela interseção das vendas do seu
+# prefixo (contagem vertical), sem percorrer as cestas de novo. Para cada
+# conjunto frequente são calculadas regras com suporte, confiança e lift.
+#
+# A matriz de cada loja e período fica no cache_kpis, invalidada junto com as
+# KPIs quando Vendas_Itens muda no período; a mineração reaproveita a matriz.
+#
+# Exemplo:
+#     python cesta_compras.py --inicio 2024-01-01 --fim 2024-03-31 --suporte 0.005
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import banco_dados
+import cache_kpis
+
+# Suporte mínimo (fração das vendas) e confiança mínima padrão das regras
+SUPORTE_MINIMO = float(os.environ.get("KPIS_CESTA_SUPORTE_MINIMO", "0.005"))
+CONFIANCA_MINIMA = float(os.environ.get("KPIS_CESTA_CONFIANCA_MINIMA", "0.1"))
+
+# Tamanho máximo dos conjuntos minerados (2 = só pares)
+TAMANHO_MAXIMO = int(os.environ.get("KPIS_CESTA_TAMANHO_MAXIMO", "3"))
+
+# Linhas por lote na leitura dos itens vendidos
+TAMANHO_LOTE = int(os.environ.get("KPIS_CESTA_TAMANHO_LOTE", "500000"))
+
+# Itens vendidos no período (só os IDs; nomes e categorias vêm do cadastro)
+CONSULTA_ITENS_VENDIDOS = """
+SELECT ID_Venda, ID_Item
+FROM Vendas_Itens
+WHERE Exclusao IS NULL
+  AND Cancelamento IS NULL
+  AND Data_cx BETWEEN ? AND ?
+"""
+
+CONSULTA_CADASTRO = """
+SELECT
+    Itens.ID_Item,
+    Itens.Descricao AS Produto,
+    ItensGrupos.Descricao AS Categoria
+FROM Itens
+LEFT JOIN ItensGrupos ON ItensGrupos.ID_Grupo = Itens.ID_Grupo
+"""
+
+SEM_CATEGORIA = "Sem categoria"
+
+# Resultados da mineração já calculados, ligados às matrizes de onde vieram
+MAXIMO_RESULTADOS = 32
+_resultados = OrderedDict()
+_lock_resultados = threading.Lock()
+
+
+def _como_datetime(valor):
+    if isinstance(valor, datetime):
+        return valor
+    return datetime.combine(valor, datetime.min.time())
+
+
+# Lê os itens vendidos do período em lotes e monta a matriz binária venda × produto.
+# Devolve {"matriz": csr (vendas × produtos), "produtos": array de nomes,
+# "categorias": array com a categoria de cada produto}.
+def montar_matriz(data_inicio, data_fim, dados_conexao=banco_dados.DADOS_CONEXAO):
+    vendas, itens = [], []
+    params = (_como_datetime(data_inicio), _como_datetime(data_fim))
+    for lote in banco_dados.executar_em_lotes(CONSULTA_ITENS_VENDIDOS, params, TAMANHO_LOTE, dados_conexao):
+        vendas.append(lote["ID_Venda"].to_numpy(dtype=np.int64))
+        itens.append(lote["ID_Item"].to_numpy(dtype=np.int64))
+    vendas = np.concatenate(vendas) if vendas else np.empty(0, dtype=np.int64)
+    itens = np.concatenate(itens) if itens else np.empty(0, dtype=np.int64)
+
+    cadastro = banco_dados.executar_consulta(CONSULTA_CADASTRO, None, dados_conexao)
+    cadastro = cadastro.drop_duplicates("ID_Item").set_index("ID_Item")
+
+    # Produtos identificados pelo nome, como no Top 10 Produtos (e iguais entre lojas)
+    codigos_item, ids_item = pd.factorize(itens, sort=True)
+    nomes = cadastro["Produto"].reindex(ids_item)
+    nomes = nomes.where(nomes.notna(), pd.Series([f"Item {i}" for i in ids_item], index=nomes.index))
+    codigos_produto, produtos = pd.factorize(nomes.to_numpy(), sort=True)
+    categorias = (
+        pd.Series(cadastro["Categoria"].reindex(ids_item).fillna(SEM_CATEGORIA).to_numpy())
+        .groupby(codigos_produto).first()
+        .reindex(range(len(produtos)), fill_value=SEM_CATEGORIA)
+        .to_numpy()
+    )
+
+    codigos_venda, ids_venda = pd.factorize(vendas)
+    matriz = _binaria(codigos_venda, codigos_produto[codigos_item], (len(ids_venda), len(produtos)))
+    return {"matriz": matriz, "produtos": np.asarray(produtos, dtype=object), "categorias": categorias}
+
+
+# Matriz CSR com 1 em cada (linha, coluna) informada, sem repetições
+def _binaria(linhas, colunas, formato):
+    matriz = sparse.csr_matrix(
+        (np.ones(len(linhas), dtype=np.int32), (linhas, colunas)), shape=formato
+    )
+    matriz.sum_duplicates()
+    matriz.data[:] = 1
+    return matriz
+
+
+# Matriz do período em uma loja, pelo cache_kpis
+def obter_matriz(data_inicio, data_fim, dados_conexao=banco_dados.DADOS_CONEXAO):
+    return cache_kpis.obter(
+        ("cesta_compras", _como_datetime(data_inicio), _como_datetime(data_fim)), ["Vendas_Itens"],
+        lambda: montar_matriz(data_inicio, data_fim, dados_conexao),
+        data_inicio, data_fim, dados_conexao,
+    )
+
+
+# Junta as matrizes de várias lojas: as vendas são empilhadas e os produtos
+# alinhados pelo nome
+def juntar_matrizes(matrizes):
+    if len(matrizes) == 1:
+        return matrizes[0]
+    produtos = pd.Index(np.concatenate([m["produtos"] for m in matrizes])).unique().sort_values()
+    categorias = pd.Series(
+        np.concatenate([m["categorias"] for m in matrizes]),
+        index=np.concatenate([m["produtos"] for m in matrizes]),
+    )
+    categorias = categorias[~categorias.index.duplicated()].reindex(produtos).to_numpy()
+
+    blocos = []
+    for m in matrizes:
+        coo = m["matriz"].tocoo()
+        colunas = produtos.get_indexer(m["produtos"])[coo.col]
+        blocos.append(sparse.csr_matrix((coo.data, (coo.row, colunas)), shape=(coo.shape[0], len(produtos))))
+    return {"matriz": sparse.vstack(blocos, format="csr"), "produtos": np.asarray(produtos, dtype=object),
+            "categorias": categorias}
+
+
+# Recorte da matriz para a análise: por produto (opcionalmente só de uma
+# categoria) ou por categoria (cada venda vira o conjunto de categorias compradas)
+def recortar(cestas, nivel="produto", categoria=None):
+    matriz, produtos, categorias = cestas["matriz"], cestas["produtos"], cestas["categorias"]
+    if nivel == "categoria":
+        codigos, nomes = pd.factorize(categorias, sort=True)
+        indicadora = _binaria(np.arange(len(produtos)), codigos, (len(produtos), len(nomes)))
+        por_categoria = (matriz @ indicadora).tocsr()
+        por_categoria.data[:] = 1
+        return por_categoria, np.asarray(nomes, dtype=object)
+    if categoria is not None:
+        colunas = np.flatnonzero(categorias == categoria)
+        return matriz[:, colunas].tocsr(), produtos[colunas]
+    return matriz, produtos
+
+
+# Conjuntos frequentes (Apriori): {tupla de colunas: quantidade de vendas}.
+# Os pares vêm de XᵀX entre os itens frequentes; cada nível seguinte junta
+# conjuntos com o mesmo prefixo e conta os candidatos nas vendas do prefixo.
+def conjuntos_frequentes(matriz, suporte_minimo=SUPORTE_MINIMO, tamanho_maximo=TAMANHO_MAXIMO):
+    total_vendas = matriz.shape[0]
+    minimo = max(int(np.ceil(suporte_minimo * total_vendas)), 1)
+
+    contagem_itens = np.asarray(matriz.sum(axis=0)).ravel()
+    frequentes = np.flatnonzero(contagem_itens >= minimo)
+    conjuntos = {(int(item),): int(contagem_itens[item]) for item in frequentes}
+    if tamanho_maximo < 2 or len(frequentes) < 2:
+        return conjuntos
+
+    # Pares: contagens de coocorrência de todos os itens frequentes em um só produto
+    recorte = matriz[:, frequentes].tocsc()
+    coocorrencias = sparse.triu(recorte.T @ recorte, k=1).tocoo()
+    manter = coocorrencias.data >= minimo
+    nivel = {
+        (int(frequentes[a]), int(frequentes[b])): int(quantidade)
+        for a, b, quantidade in zip(coocorrencias.row[manter], coocorrencias.col[manter], coocorrencias.data[manter])
+    }
+    conjuntos.update(nivel)
+
+    colunas = matriz.tocsc()
+    linhas = matriz.tocsr()
+    tamanho = 2
+    while nivel and tamanho < tamanho_maximo:
+        candidatos = {}
+        por_prefixo = {}
+        for conjunto in nivel:
+            por_prefixo.setdefault(conjunto[:-1], []).append(conjunto[-1])
+        for prefixo, ultimos in por_prefixo.items():
+            ultimos.sort()
+            for i, x in enumerate(ultimos):
+                extensoes = [
+                    y for y in ultimos[i + 1:]
+                    # Poda do Apriori: todo subconjunto do candidato precisa ser frequente
+                    if all(sub in nivel for sub in combinations(prefixo + (x, y), tamanho) if sub[-1] == y)
+                ]
+                if extensoes:
+                    candidatos[prefixo + (x,)] = extensoes
+
+        proximo = {}
+        for base, extensoes in candidatos.items():
+            vendas = _vendas_com(colunas, base)
+            if len(vendas) < minimo:
+                continue
+            contagens = np.asarray(linhas[vendas][:, extensoes].sum(axis=0)).ravel()
+            for item, quantidade in zip(extensoes, contagens):
+                if quantidade >= minimo:
+                    proximo[base + (item,)] = int(quantidade)
+        conjuntos.update(proximo)
+        nivel = proximo
+        tamanho += 1
+    return conjuntos
+
+
+# Vendas (linhas) que contêm todos os itens do conjunto
+def _vendas_com(colunas, conjunto):
+    vendas = None
+    for item in conjunto:
+        linhas_item = colunas.indices[colunas.indptr[item]:colunas.indptr[item + 1]]
+        vendas = linhas_item if vendas is None else np.intersect1d(vendas, linhas_item, assume_unique=True)
+    return np.sort(vendas)
+
+
+# Regras "antecedente → consequente" (um item no consequente) dos conjuntos com 2+ itens
+def gerar_regras(conjuntos, total_vendas, nomes, confianca_minima=CONFIANCA_MINIMA):
+    registros = []
+    for conjunto, quantidade in conjuntos.items():
+        if len(conjunto) < 2:
+            continue
+        suporte = quantidade / total_vendas
+        for consequente in conjunto:
+            antecedente = tuple(item for item in conjunto if item != consequente)
+            confianca = quantidade / conjuntos[antecedente]
+            if confianca < confianca_minima:
+                continue
+            registros.append({
+                "Antecedente": " + ".join(nomes[item] for item in antecedente),
+                "Consequente": nomes[consequente],
+                "Itens": len(conjunto),
+                "Vendas": quantidade,
+                "Suporte": suporte,
+                "Confiança": confianca,
+                "Lift": confianca / (conjuntos[(consequente,)] / total_vendas),
+            })
+    regras = pd.DataFrame(registros, columns=["Antecedente", "Consequente", "Itens", "Vendas", "Suporte",
+                                              "Confiança", "Lift"])
+    return regras.sort_values(["Lift", "Confiança"], ascending=False, ignore_index=True)
+
+
+# Conjuntos com 2+ itens e o lift do conjunto (suporte observado / esperado se
+# os itens fossem comprados de forma independente)
+def tabela_conjuntos(conjuntos, total_vendas, nomes):
+    registros = []
+    for conjunto, quantidade in conjuntos.items():
+        if len(conjunto) < 2:
+            continue
+        esperado = np.prod([conjuntos[(item,)] / total_vendas for item in conjunto])
+        registros.append({
+            "Conjunto": " + ".join(nomes[item] for item in conjunto),
+            "Itens": len(conjunto),
+            "Vendas": quantidade,
+            "Suporte": quantidade / total_vendas,
+            "Lift": (quantidade / total_vendas) / esperado,
+        })
+    tabela = pd.DataFrame(registros, columns=["Conjunto", "Itens", "Vendas", "Suporte", "Lift"])
+    return tabela.sort_values(["Vendas", "Lift"], ascending=False, ignore_index=True)
+
+
+# Análise completa a partir das matrizes já montadas (uma por loja). O resultado
+# fica guardado enquanto as mesmas matrizes estiverem no cache.
+def analisar(matrizes, nivel="produto", categoria=None, suporte_minimo=SUPORTE_MINIMO,
+             confianca_minima=CONFIANCA_MINIMA, tamanho_maximo=TAMANHO_MAXIMO):
+    chave = (tuple(id(m) for m in matrizes), nivel, categoria, suporte_minimo, confianca_minima, tamanho_maximo)
+    with _lock_resultados:
+        guardado = _resultados.get(chave)
+        # As matrizes ficam referenciadas na entrada, então os ids não são reaproveitados
+        if guardado is not None and all(a is b for a, b in zip(guardado["matrizes"], matrizes)):
+            _resultados.move_to_end(chave)
+            return guardado["resultado"]
+
+    inicio = time.perf_counter()
+    matriz, nomes = recortar(juntar_matrizes(matrizes), nivel, categoria)
+    # Vendas sem nenhum item do recorte não entram no total (ex.: filtro por categoria)
+    matriz = matriz[np.diff(matriz.indptr) > 0]
+    total_vendas = matriz.shape[0]
+    conjuntos = conjuntos_frequentes(matriz, suporte_minimo, tamanho_maximo) if total_vendas else {}
+    resultado = {
+        "vendas": total_vendas,
+        "itens": matriz.shape[1],
+        "conjuntos": tabela_conjuntos(conjuntos, total_vendas, nomes),
+        "regras": gerar_regras(conjuntos, total_vendas, nomes, confianca_minima),
+        "segundos": time.perf_counter() - inicio,
+    }
+
+    with _lock_resultados:
+        _resultados[chave] = {"matrizes": list(matrizes), "resultado": resultado}
+        while len(_resultados) > MAXIMO_RESULTADOS:
+            _resultados.popitem(last=False)
+    return resultado
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Produtos comprados juntos (pares, conjuntos e regras)")
+    parser.add_argument("--conexao", default=banco_dados.DADOS_CONEXAO, help="string de conexão ODBC")
+    parser.add_argument("--inicio", type=date.fromisoformat, required=True, help="data inicial (AAAA-MM-DD)")
+    parser.add_argument("--fim", type=date.fromisoformat, required=True, help="data final (AAAA-MM-DD)")
+    parser.add_argument("--nivel", choices=["produto", "categoria"], default="produto")
+    parser.add_argument("--categoria", default=None, help="só produtos desta categoria")
+    parser.add_argument("--suporte", type=float, default=SUPORTE_MINIMO, help="suporte mínimo (fração das vendas)")
+    parser.add_argument("--confianca", type=float, default=CONFIANCA_MINIMA, help="confiança mínima das regras")
+    parser.add_argument("--tamanho-maximo", type=int, default=TAMANHO_MAXIMO, help="itens por conjunto")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    cestas = montar_matriz(args.inicio, args.fim, args.conexao)
+    print(f"Matriz {cestas['matriz'].shape[0]} vendas × {cestas['matriz'].shape[1]} produtos, "
+          f"{cestas['matriz'].nnz} itens, em {time.perf_counter() - inicio:.1f}s")
+    resultado = analisar([cestas], args.nivel, args.categoria, args.suporte, args.confianca, args.tamanho_maximo)
+    print(f"Mineração em {resultado['segundos']:.1f}s: {len(resultado['conjuntos'])} conjuntos, "
+          f"{len(resultado['regras'])} regras")
+    with pd.option_context("display.width", 200, "display.max_colwidth", 60):
+        print(resultado["conjuntos"].head(20).to_string(index=False))
+        print()
+        print(resultado["regras"].head(20).to_string(index=False))
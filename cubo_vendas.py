@@ -0,0 +1,315 @@
+# Cubo de vendas em memória para filtros cruzados (dia × hora × vendedor ×
+# categoria × meio de pagamento), sem voltar ao banco a cada clique.
+#
+# O cubo é montado uma vez por período (três consultas) e guardado no cache das
+# KPIs. Dia, hora e vendedor têm um valor por venda: ficam como códigos inteiros
+# e as vendas são pré-agregadas em células dia × hora × vendedor (quantidade e
+# valor), agregadas com np.bincount. Categoria e meio podem ter vários valores
+# na mesma venda (itens de grupos diferentes, pagamento dividido), por isso
+# ficam em matrizes esparsas venda × membro com o valor de cada um; assim a
+# contagem de vendas continua sendo de vendas distintas. Só os filtros de
+# categoria e meio precisam percorrer as vendas; os demais trabalham nas células.
+#
+# Os filtros selecionam vendas: filtrar a categoria "Padaria" deixa só as vendas
+# com algum item da Padaria. Cada dimensão é agregada com os filtros das outras
+# (o gráfico de uma dimensão não é filtrado por ela mesma).
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import banco_dados
+import cache_kpis
+
+DIMENSOES = ["Dia", "Hora", "Vendedor", "Categoria", "Meio"]
+DIMENSOES_VENDA = ["Dia", "Hora", "Vendedor"]          # um valor por venda
+DIMENSOES_MULTIPLAS = ["Categoria", "Meio"]            # vários valores por venda
+
+CONSULTA_VENDAS = """
+SELECT
+    ID_Venda,
+    CAST(Data_cx AS DATE) AS Dia,
+    DATEPART(HOUR, Hora) AS Hora,
+    Vendedor,
+    Valor_itens AS Valor
+FROM Vendas
+WHERE Exclusao IS NULL
+  AND Cancelamento IS NULL
+  AND Data_cx BETWEEN ? AND ?
+"""
+
+CONSULTA_CATEGORIAS = """
+SELECT
+    Vendas_Itens.ID_Venda,
+    ItensGrupos.Descricao AS Membro,
+    SUM(Vendas_Itens.Valor_liquido) AS Valor
+FROM Vendas_Itens
+LEFT JOIN ItensGrupos ON ItensGrupos.ID_Grupo = Vendas_Itens.ID_Grupo
+WHERE Vendas_Itens.Exclusao IS NULL
+  AND Vendas_Itens.Cancelamento IS NULL
+  AND Vendas_Itens.Data_cx BETWEEN ? AND ?
+GROUP BY Vendas_Itens.ID_Venda, ItensGrupos.Descricao
+"""
+
+CONSULTA_MEIOS = """
+SELECT
+    Vendas_Receber.ID_Venda,
+    Vendas_Receber.Meio AS Membro,
+    SUM(Vendas_Receber.Valor) AS Valor
+FROM Vendas_Receber
+JOIN Vendas ON Vendas.ID_Venda = Vendas_Receber.ID_Venda
+WHERE Vendas_Receber.Exclusao IS NULL
+  AND Vendas.Exclusao IS NULL
+  AND Vendas.Cancelamento IS NULL
+  AND Vendas.Data_cx BETWEEN ? AND ?
+GROUP BY Vendas_Receber.ID_Venda, Vendas_Receber.Meio
+"""
+
+SEM_MEMBRO = {"Categoria": "Sem categoria", "Meio": "Não informado"}
+
+# Cubos de várias lojas já juntados, ligados aos cubos de onde vieram
+MAXIMO_JUNTOS = 8
+_juntos = OrderedDict()
+_lock_juntos = threading.Lock()
+
+
+def _como_datetime(valor):
+    return pd.Timestamp(valor).to_pydatetime()
+
+
+def rotulo_hora(hora):
+    return f"{int(hora):02d}:00"
+
+
+# Matriz venda × membro (valores somados) a partir das linhas ID_Venda, Membro, Valor
+def _matriz_membros(linhas, indice_vendas, dimensao):
+    posicoes = indice_vendas.get_indexer(linhas["ID_Venda"])
+    linhas = linhas[posicoes >= 0]
+    posicoes = posicoes[posicoes >= 0]
+    codigos, membros = pd.factorize(linhas["Membro"].fillna(SEM_MEMBRO[dimensao]), sort=True)
+    matriz = sparse.csr_matrix(
+        (pd.to_numeric(linhas["Valor"], errors="coerce").fillna(0).to_numpy(dtype=np.float64), (posicoes, codigos)),
+        shape=(len(indice_vendas), len(membros)),
+    )
+    matriz.sum_duplicates()
+    return matriz, np.asarray(membros, dtype=object)
+
+
+# Lê as vendas do período e monta o cubo de uma loja
+def montar_cubo(data_inicio, data_fim, dados_conexao=banco_dados.DADOS_CONEXAO):
+    params = (_como_datetime(data_inicio), _como_datetime(data_fim))
+    vendas = banco_dados.executar_consulta(CONSULTA_VENDAS, params, dados_conexao)
+    vendas = vendas.drop_duplicates("ID_Venda")
+    indice_vendas = pd.Index(vendas["ID_Venda"].to_numpy())
+
+    dias = pd.to_datetime(vendas["Dia"]).dt.normalize()
+    codigo_dia, membros_dia = pd.factorize(dias, sort=True)
+    codigo_hora, membros_hora = pd.factorize(vendas["Hora"].fillna(0).astype(int), sort=True)
+    codigo_vendedor, membros_vendedor = pd.factorize(vendas["Vendedor"].fillna("Não informado"), sort=True)
+
+    cubo = {
+        "valor": pd.to_numeric(vendas["Valor"], errors="coerce").fillna(0).to_numpy(dtype=np.float64),
+        "codigos": {
+            "Dia": codigo_dia.astype(np.intp),
+            "Hora": codigo_hora.astype(np.intp),
+            "Vendedor": codigo_vendedor.astype(np.intp),
+        },
+        "membros": {
+            "Dia": np.asarray([dia.strftime("%d/%m/%Y") for dia in membros_dia], dtype=object),
+            "Hora": np.asarray([rotulo_hora(hora) for hora in membros_hora], dtype=object),
+            "Vendedor": np.asarray(membros_vendedor, dtype=object),
+        },
+        "matrizes": {},
+    }
+    for dimensao, consulta_sql in (("Categoria", CONSULTA_CATEGORIAS), ("Meio", CONSULTA_MEIOS)):
+        linhas = banco_dados.executar_consulta(consulta_sql, params, dados_conexao)
+        cubo["matrizes"][dimensao], cubo["membros"][dimensao] = _matriz_membros(linhas, indice_vendas, dimensao)
+    return _preparar(cubo)
+
+
+# Estruturas auxiliares para filtrar e agregar rápido: células dia × hora ×
+# vendedor, colunas CSC para os filtros de categoria e meio, matrizes transpostas
+# (membro × venda) para as somas e as agregações sem filtro já prontas
+def _preparar(cubo):
+    cubo["vendas"] = len(cubo["valor"])
+    chave = np.zeros(cubo["vendas"], dtype=np.int64)
+    for dimensao in DIMENSOES_VENDA:
+        chave = chave * len(cubo["membros"][dimensao]) + cubo["codigos"][dimensao]
+    celula, chaves = pd.factorize(chave)
+    cubo["celula"] = celula.astype(np.intp)
+    cubo["celulas"] = {}
+    for dimensao in reversed(DIMENSOES_VENDA):
+        chaves, codigos = np.divmod(chaves, len(cubo["membros"][dimensao]))
+        cubo["celulas"][dimensao] = codigos.astype(np.intp)
+    cubo["quantidade_celula"] = np.bincount(cubo["celula"]).astype(np.float64)
+    cubo["valor_celula"] = np.bincount(cubo["celula"], weights=cubo["valor"])
+
+    # Vendas por célula (matriz célula × venda) para levar categoria e meio às células
+    por_celula = sparse.csr_matrix(
+        (np.ones(cubo["vendas"]), (cubo["celula"], np.arange(cubo["vendas"]))),
+        shape=(len(cubo["quantidade_celula"]), cubo["vendas"]),
+    )
+    cubo["colunas"] = {}
+    cubo["transpostas"] = {}
+    cubo["transpostas_celula"] = {}
+    for dimensao, matriz in cubo["matrizes"].items():
+        presenca = matriz.copy()
+        presenca.data = (presenca.data != 0).astype(np.float64)
+        presenca.eliminate_zeros()
+        cubo["colunas"][dimensao] = presenca.tocsc()
+        cubo["transpostas"][dimensao] = (presenca.T.tocsr(), matriz.T.tocsr())
+        cubo["transpostas_celula"][dimensao] = ((por_celula @ presenca).T.tocsr(), (por_celula @ matriz).T.tocsr())
+    cubo["sem_filtro"] = agregar(cubo)
+    return cubo
+
+
+# Cubo do período em uma loja, pelo cache_kpis
+def obter_cubo(data_inicio, data_fim, dados_conexao=banco_dados.DADOS_CONEXAO):
+    return cache_kpis.obter(
+        ("cubo_vendas", _como_datetime(data_inicio), _como_datetime(data_fim)),
+        ["Vendas", "Vendas_Itens", "Vendas_Receber"],
+        lambda: montar_cubo(data_inicio, data_fim, dados_conexao),
+        data_inicio, data_fim, dados_conexao,
+    )
+
+
+# Junta os cubos de várias lojas: vendas empilhadas e membros alinhados pelo nome.
+# O resultado fica guardado enquanto os mesmos cubos estiverem no cache.
+def juntar_cubos(cubos):
+    if len(cubos) == 1:
+        return cubos[0]
+    chave = tuple(id(cubo) for cubo in cubos)
+    with _lock_juntos:
+        guardado = _juntos.get(chave)
+        # Os cubos ficam referenciados na entrada, então os ids não são reaproveitados
+        if guardado is not None and all(a is b for a, b in zip(guardado["cubos"], cubos)):
+            _juntos.move_to_end(chave)
+            return guardado["junto"]
+
+    junto = _juntar(cubos)
+    with _lock_juntos:
+        _juntos[chave] = {"cubos": list(cubos), "junto": junto}
+        while len(_juntos) > MAXIMO_JUNTOS:
+            _juntos.popitem(last=False)
+    return junto
+
+
+def _juntar(cubos):
+    junto = {"valor": np.concatenate([cubo["valor"] for cubo in cubos]), "codigos": {}, "membros": {}, "matrizes": {}}
+    for dimensao in DIMENSOES:
+        membros = pd.Index(np.concatenate([cubo["membros"][dimensao] for cubo in cubos])).unique()
+        if dimensao == "Dia":
+            membros = membros[np.argsort(pd.to_datetime(membros, format="%d/%m/%Y"))]
+        else:
+            membros = membros.sort_values()
+        junto["membros"][dimensao] = np.asarray(membros, dtype=object)
+        mapas = [membros.get_indexer(cubo["membros"][dimensao]) for cubo in cubos]
+        if dimensao in DIMENSOES_VENDA:
+            junto["codigos"][dimensao] = np.concatenate(
+                [mapa[cubo["codigos"][dimensao]] for mapa, cubo in zip(mapas, cubos)]
+            ).astype(np.intp)
+        else:
+            blocos = []
+            for mapa, cubo in zip(mapas, cubos):
+                coo = cubo["matrizes"][dimensao].tocoo()
+                blocos.append(sparse.csr_matrix((coo.data, (coo.row, mapa[coo.col])),
+                                                shape=(coo.shape[0], len(membros))))
+            junto["matrizes"][dimensao] = sparse.vstack(blocos, format="csr")
+    return _preparar(junto)
+
+
+# Filtro de uma dimensão (membros selecionados, por rótulo): máscara das células
+# para dia, hora e vendedor; máscara das vendas para categoria e meio
+def _mascara(cubo, dimensao, selecionados):
+    posicoes = pd.Index(cubo["membros"][dimensao]).get_indexer(list(selecionados))
+    posicoes = posicoes[posicoes >= 0]
+    if dimensao in DIMENSOES_VENDA:
+        escolhidos = np.zeros(len(cubo["membros"][dimensao]), dtype=bool)
+        escolhidos[posicoes] = True
+        return escolhidos[cubo["celulas"][dimensao]]
+    colunas = cubo["colunas"][dimensao]
+    mascara = np.zeros(cubo["vendas"], dtype=bool)
+    for posicao in posicoes:
+        mascara[colunas.indices[colunas.indptr[posicao]:colunas.indptr[posicao + 1]]] = True
+    return mascara
+
+
+def _tabela(dimensao, membros, quantidade, valor):
+    quantidade = np.rint(quantidade).astype(np.int64)
+    manter = np.flatnonzero(quantidade > 0)
+    if dimensao not in ("Dia", "Hora"):
+        manter = manter[np.argsort(-valor[manter], kind="stable")]
+    return pd.DataFrame({dimensao: membros[manter], "Vendas": quantidade[manter], "Valor": valor[manter]})
+
+
+def _e(mascaras):
+    combinada = None
+    for mascara in mascaras:
+        if mascara is not None:
+            combinada = mascara if combinada is None else combinada & mascara
+    return combinada
+
+
+# Aplica os filtros ({dimensão: rótulos selecionados}) e devolve um DataFrame por
+# dimensão (filtrado pelas outras dimensões) e os totais com todos os filtros
+def agregar(cubo, filtros=None):
+    inicio = time.perf_counter()
+    filtros = {dimensao: membros for dimensao, membros in (filtros or {}).items() if membros}
+    if not filtros and "sem_filtro" in cubo:
+        return dict(cubo["sem_filtro"], milissegundos=(time.perf_counter() - inicio) * 1000)
+
+    mascaras = {dimensao: _mascara(cubo, dimensao, membros) for dimensao, membros in filtros.items()}
+    mascaras_celula = {d: m for d, m in mascaras.items() if d in DIMENSOES_VENDA}
+    mascaras_venda = {d: m for d, m in mascaras.items() if d in DIMENSOES_MULTIPLAS}
+
+    # Quantidade e valor por célula só das vendas que passam nos filtros de categoria e meio
+    filtro_multiplas = _e(mascaras_venda.values())
+    if filtro_multiplas is None:
+        quantidade_celula, valor_celula = cubo["quantidade_celula"], cubo["valor_celula"]
+    else:
+        pesos = filtro_multiplas.astype(np.float64)
+        quantidade_celula = np.bincount(cubo["celula"], weights=pesos, minlength=len(cubo["quantidade_celula"]))
+        valor_celula = np.bincount(cubo["celula"], weights=cubo["valor"] * pesos,
+                                   minlength=len(cubo["quantidade_celula"]))
+
+    resultado = {}
+    for dimensao in DIMENSOES_VENDA:
+        membros = cubo["membros"][dimensao]
+        celulas = _e(m for d, m in mascaras_celula.items() if d != dimensao)
+        pesos = quantidade_celula if celulas is None else quantidade_celula * celulas
+        valores = valor_celula if celulas is None else valor_celula * celulas
+        resultado[dimensao] = _tabela(
+            dimensao, membros,
+            np.bincount(cubo["celulas"][dimensao], weights=pesos, minlength=len(membros)),
+            np.bincount(cubo["celulas"][dimensao], weights=valores, minlength=len(membros)),
+        )
+
+    filtro_celulas = _e(mascaras_celula.values())
+    for dimensao in DIMENSOES_MULTIPLAS:
+        outras = _e(m for d, m in mascaras_venda.items() if d != dimensao)
+        if outras is None:
+            # Só filtros de dia, hora e vendedor: a soma sai das células
+            pesos = np.ones(len(cubo["quantidade_celula"])) if filtro_celulas is None \
+                else filtro_celulas.astype(np.float64)
+            presenca, valores = cubo["transpostas_celula"][dimensao]
+        else:
+            # Filtro na outra dimensão múltipla: a máscara das vendas entra como
+            # peso (0 ou 1 por venda) no produto matriz × vetor
+            mascara = outras if filtro_celulas is None else outras & filtro_celulas[cubo["celula"]]
+            pesos = mascara.astype(np.float64)
+            presenca, valores = cubo["transpostas"][dimensao]
+        resultado[dimensao] = _tabela(dimensao, cubo["membros"][dimensao], presenca @ pesos, valores @ pesos)
+
+    vendas = quantidade_celula if filtro_celulas is None else quantidade_celula[filtro_celulas]
+    valor = valor_celula if filtro_celulas is None else valor_celula[filtro_celulas]
+    vendas, valor = int(round(vendas.sum())), float(valor.sum())
+    resultado["totais"] = {
+        "Vendas": vendas,
+        "Valor": valor,
+        "Ticket médio": valor / vendas if vendas else 0.0,
+    }
+    resultado["milissegundos"] = (time.perf_counter() - inicio) * 1000
+    return resultado
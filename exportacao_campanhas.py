@@ -0,0 +1,228 @@
+# Exportação das listas de clientes das campanhas de marketing.
+#
+# Os segmentos (alto valor e inativos) são agregados no próprio banco com os
+# mesmos filtros da base de features e recebem os dados de contato da venda mais
+# recente de cada cliente. O resultado é lido em lotes e gravado aos poucos em CSV
+# ou Parquet, em uma thread separada: a memória usada fica limitada ao tamanho do
+# lote e a sessão do dashboard continua respondendo enquanto o arquivo é gerado.
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+import banco_dados
+
+# Pasta onde os arquivos exportados são gravados
+PASTA_EXPORTACOES = os.environ.get(
+    "KPIS_PASTA_EXPORTACOES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "exportacoes"),
+)
+
+# Colunas de contato lidas da tabela Vendas (separadas por vírgula)
+COLUNAS_CONTATO = [
+    coluna.strip()
+    for coluna in os.environ.get("KPIS_COLUNAS_CONTATO", "Telefone,Email").split(",")
+    if coluna.strip()
+]
+
+# Linhas por lote lido do banco e gravado no arquivo
+TAMANHO_LOTE = int(os.environ.get("KPIS_EXPORTACAO_TAMANHO_LOTE", "50000"))
+
+# Tempo (segundos) que um trabalho terminado continua consultável depois de
+# concluído; trabalhos baixados saem na hora. Os arquivos ficam na pasta.
+RETENCAO_TRABALHOS = float(os.environ.get("KPIS_EXPORTACAO_RETENCAO_S", "3600"))
+
+# Condição de cada segmento sobre as agregações por cliente (o limite vem da página)
+SEGMENTOS = {
+    "alto_valor": "SUM(Valor_Liquido) >= ?",
+    "inativos": "COUNT(*) <= ?",
+}
+
+_lock = threading.Lock()
+_trabalhos = {}   # id -> estado do trabalho de exportação
+
+
+def montar_consulta(segmento):
+    contato = "".join(f", v.{coluna}" for coluna in COLUNAS_CONTATO)
+    return f"""
+    WITH Clientes AS (
+        SELECT
+            ID_Cliente,
+            COUNT(*) AS FREQUENCIA_COMPRA,
+            SUM(Valor_Liquido) AS VALOR_GASTO,
+            MAX(Data_cx) AS ULTIMA_COMPRA,
+            MAX(ID_Venda) AS ULTIMA_VENDA
+        FROM Vendas
+        WHERE ID_Cliente IS NOT NULL
+          AND Nome IS NOT NULL AND Nome <> ''
+          AND Data_cx IS NOT NULL
+          AND Valor_Liquido IS NOT NULL
+        GROUP BY ID_Cliente
+        HAVING {SEGMENTOS[segmento]}
+    )
+    SELECT
+        c.ID_Cliente,
+        v.Nome{contato},
+        c.FREQUENCIA_COMPRA,
+        c.VALOR_GASTO,
+        c.ULTIMA_COMPRA
+    FROM Clientes c
+    JOIN Vendas v ON v.ID_Venda = c.ULTIMA_VENDA
+    """
+
+
+# Lote sem linhas com as colunas e os tipos da consulta, para um segmento vazio
+# ainda gerar um arquivo com o cabeçalho (CSV) ou o esquema (Parquet)
+def _lote_vazio():
+    colunas = {"ID_Cliente": "int64", "Nome": "string"}
+    colunas.update({coluna: "string" for coluna in COLUNAS_CONTATO})
+    colunas.update({"FREQUENCIA_COMPRA": "int64", "VALOR_GASTO": "float64", "ULTIMA_COMPRA": "datetime64[ns]"})
+    return pd.DataFrame({coluna: pd.Series(dtype=tipo) for coluna, tipo in colunas.items()})
+
+
+# Lotes com linhas e tipos fixos nas colunas inteiras (o esquema do Parquet sai do
+# primeiro lote); sem nenhum, um lote vazio com o esquema
+def _lotes_com_esquema(lotes):
+    algum = False
+    for lote in lotes:
+        if lote.empty:
+            continue
+        algum = True
+        yield lote.astype({"ID_Cliente": "int64", "FREQUENCIA_COMPRA": "int64"})
+    if not algum:
+        yield _lote_vazio()
+
+
+def _gravar_csv(lotes, caminho, ao_gravar):
+    with open(caminho, "w", encoding="utf-8-sig", newline="") as arquivo:
+        for numero, lote in enumerate(lotes):
+            lote.to_csv(arquivo, header=numero == 0, index=False, sep=";", decimal=",")
+            ao_gravar(len(lote))
+
+
+def _gravar_parquet(lotes, caminho, ao_gravar):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    escritor = None
+    try:
+        for lote in lotes:
+            tabela = pa.Table.from_pandas(lote, preserve_index=False)
+            if escritor is None:
+                escritor = pq.ParquetWriter(caminho, tabela.schema)
+            else:
+                tabela = tabela.cast(escritor.schema)
+            escritor.write_table(tabela)
+            ao_gravar(len(lote))
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+def _executar(trabalho):
+    def ao_gravar(linhas):
+        trabalho["linhas"] += linhas
+        if trabalho["cancelar"]:
+            raise InterruptedError("Exportação cancelada.")
+
+    try:
+        os.makedirs(PASTA_EXPORTACOES, exist_ok=True)
+        lotes = banco_dados.executar_em_lotes(
+            montar_consulta(trabalho["segmento"]), (trabalho["limite"],), TAMANHO_LOTE, trabalho["dados_conexao"]
+        )
+        gravar = _gravar_parquet if trabalho["formato"] == "parquet" else _gravar_csv
+        temporario = trabalho["arquivo"] + ".parcial"
+        gravar(_lotes_com_esquema(lotes), temporario, ao_gravar)
+        os.replace(temporario, trabalho["arquivo"])
+        trabalho["status"] = "concluido"
+    except Exception as e:
+        trabalho["status"] = "cancelado" if trabalho["cancelar"] else "erro"
+        trabalho["erro"] = str(e)
+        try:
+            os.remove(trabalho["arquivo"] + ".parcial")
+        except OSError:
+            pass
+    finally:
+        trabalho["fim"] = time.time()
+
+
+# COUNT(*) é inteiro: o limite de compras vai como int (a leitura Arrow manda os
+# parâmetros como texto, e '1.0' não converte para INT no SQL Server). Truncar
+# não muda o segmento: contagem <= 1.5 é o mesmo que contagem <= 1.
+def _limite(segmento, limite):
+    return int(limite) if segmento == "inativos" else float(limite)
+
+
+# Inicia a exportação de um segmento em segundo plano e devolve o id do trabalho.
+# total_estimado (quantidade de clientes do segmento na tela) é usado só no progresso.
+def iniciar_exportacao(segmento, limite, formato="csv", total_estimado=None,
+                       dados_conexao=banco_dados.DADOS_CONEXAO):
+    if segmento not in SEGMENTOS:
+        raise ValueError(f"Segmento desconhecido: {segmento}")
+    formato = "parquet" if formato.lower() == "parquet" else "csv"
+
+    id_trabalho = uuid.uuid4().hex[:12]
+    nome_arquivo = f"{segmento}_{datetime.now():%Y%m%d_%H%M%S}_{id_trabalho}.{formato}"
+    trabalho = {
+        "id": id_trabalho,
+        "segmento": segmento,
+        "limite": _limite(segmento, limite),
+        "formato": formato,
+        "arquivo": os.path.join(PASTA_EXPORTACOES, nome_arquivo),
+        "dados_conexao": dados_conexao,
+        "total_estimado": total_estimado,
+        "linhas": 0,
+        "status": "executando",
+        "erro": None,
+        "cancelar": False,
+        "inicio": time.time(),
+        "fim": None,
+    }
+    with _lock:
+        _descartar_antigos()
+        _trabalhos[id_trabalho] = trabalho
+
+    threading.Thread(target=_executar, args=(trabalho,), name=f"exportacao-{id_trabalho}", daemon=True).start()
+    return id_trabalho
+
+
+# Remove os trabalhos terminados há mais de RETENCAO_TRABALHOS segundos (com _lock)
+def _descartar_antigos():
+    limite = time.time() - RETENCAO_TRABALHOS
+    for id_trabalho in [id_trabalho for id_trabalho, trabalho in _trabalhos.items()
+                        if trabalho["fim"] is not None and trabalho["fim"] < limite]:
+        del _trabalhos[id_trabalho]
+
+
+def estado(id_trabalho):
+    with _lock:
+        _descartar_antigos()
+        trabalho = _trabalhos.get(id_trabalho)
+        return dict(trabalho) if trabalho else None
+
+
+def cancelar(id_trabalho):
+    with _lock:
+        trabalho = _trabalhos.get(id_trabalho)
+        if trabalho and trabalho["status"] == "executando":
+            trabalho["cancelar"] = True
+
+
+# Esquece um trabalho terminado (por exemplo, depois do download); o arquivo fica na pasta
+def descartar(id_trabalho):
+    with _lock:
+        trabalho = _trabalhos.get(id_trabalho)
+        if trabalho and trabalho["status"] != "executando":
+            del _trabalhos[id_trabalho]
+
+
+# Fração concluída (0 a 1) para a barra de progresso
+def progresso(trabalho):
+    if trabalho["status"] == "concluido":
+        return 1.0
+    if not trabalho["total_estimado"]:
+        return 0.0
+    return min(trabalho["linhas"] / trabalho["total_estimado"], 0.99)
@@ -0,0 +1,268 @@
+# Base de características (features) por cliente usada na segmentação RFM.
+#
+# Mantém uma linha por ID_Cliente com frequência, valor gasto, primeira e última
+# compra (recência) e o último ID_Venda processado, em duas partes somadas:
+#   - a consolidada, gravada em um arquivo Parquet local, com as vendas anteriores
+#     ao corte (data fora da janela de revisão e ID_Venda até o corte);
+#   - a recente, com as demais vendas (as dos últimos KPIS_JANELA_REVISAO_FEATURES
+#     dias e as de ID acima do corte), reagregada por inteiro a cada atualização.
+# Assim cancelamentos, exclusões, valores e nomes alterados depois da venda e IDs
+# confirmados fora de ordem entram na base enquanto a venda está na janela, sem
+# refazer o groupby sobre todo o histórico. A parte recente fica no cache das KPIs
+# e só é consultada de novo quando as marcas d'água da tabela Vendas mudam. O
+# corte avança uma vez por dia, levando para a parte consolidada as vendas que
+# saíram da janela. Alterações em vendas mais antigas que a janela só entram na
+# reconstrução completa.
+#
+# Reconstrução completa pela linha de comando:
+#     python features_clientes.py --reconstruir
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+import banco_dados
+import cache_kpis
+
+# Arquivo local com a base de features (pode ser alterado por variável de ambiente)
+ARQUIVO_FEATURES = os.environ.get(
+    "KPIS_ARQUIVO_FEATURES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados", "features_clientes.parquet"),
+)
+
+# Intervalo mínimo entre duas buscas de vendas novas (segundos)
+INTERVALO_ATUALIZACAO = float(os.environ.get("KPIS_INTERVALO_VERIFICACAO", "5"))
+
+# Dias recentes reagregados a cada atualização (vendas que ainda podem ser
+# canceladas ou corrigidas); o padrão é a mesma janela conferida pelo cache_kpis
+JANELA_REVISAO_DIAS = int(os.environ.get("KPIS_JANELA_REVISAO_FEATURES", "7"))
+
+# Reconstrução em lotes (agregacao_lotes.py): o banco só lê as vendas na ordem do
+# ID_Venda e a agregação é feita aqui com memória limitada, sem um GROUP BY sobre
+# todo o histórico no servidor do PDV. "1" liga.
+RECONSTRUIR_EM_LOTES = os.environ.get("KPIS_FEATURES_EM_LOTES", "0") == "1"
+
+# Colunas parciais guardadas na base (somáveis / combináveis entre atualizações)
+COLUNAS_PARCIAIS = ["Nome", "FREQUENCIA_COMPRA", "VALOR_GASTO", "PRIMEIRA_COMPRA", "ULTIMA_COMPRA", "ULTIMO_ID_VENDA"]
+
+# Agregação das vendas por cliente. Os mesmos filtros da segmentação original:
+# vendas com cliente, nome, data e valor líquido preenchidos.
+# {condicao} escolhe a parte da base (recente ou o trecho a consolidar).
+# O nome é o da venda de maior ID_Venda (o ID com zeros à esquerda na frente do
+# nome decide o MAX, sem depender da collation), como na agregação em lotes.
+CONSULTA_PARCIAIS = """
+SELECT
+    ID_Cliente,
+    SUBSTRING(MAX(RIGHT(REPLICATE('0', 20) + CAST(ID_Venda AS VARCHAR(20)), 20) + Nome), 21, 4000) AS Nome,
+    COUNT(*) AS FREQUENCIA_COMPRA,
+    SUM(Valor_Liquido) AS VALOR_GASTO,
+    MIN(Data_cx) AS PRIMEIRA_COMPRA,
+    MAX(Data_cx) AS ULTIMA_COMPRA,
+    MAX(ID_Venda) AS ULTIMO_ID_VENDA
+FROM Vendas
+WHERE {condicao}
+  AND ID_Cliente IS NOT NULL
+  AND Nome IS NOT NULL AND Nome <> ''
+  AND Data_cx IS NOT NULL
+  AND Valor_Liquido IS NOT NULL
+GROUP BY ID_Cliente
+"""
+
+# Vendas da parte recente para o corte (data, ID_Venda)
+CONDICAO_RECENTES = "(Data_cx >= ? OR ID_Venda > ?)"
+
+# Vendas da parte consolidada para o corte (data, ID_Venda)
+CONDICAO_CONSOLIDADAS = "Data_cx < ? AND ID_Venda <= ?"
+
+CONSULTA_MAIOR_ID = "SELECT MAX(ID_Venda) AS maior_id FROM Vendas"
+
+_lock = threading.Lock()
+_base = None                 # DataFrame indexado por ID_Cliente (consolidada + recente)
+_consolidada = None          # parciais das vendas anteriores ao corte (gravadas no Parquet)
+_recentes = None             # parciais da janela de revisão usadas na _base atual
+_corte = None                # (data, ID_Venda) que separa as duas partes
+_versao = 0
+_ultima_atualizacao = 0.0
+
+
+def _base_vazia():
+    base = pd.DataFrame(columns=COLUNAS_PARCIAIS)
+    base.index.name = "ID_Cliente"
+    return base
+
+
+# Como cada coluna parcial é combinada entre duas parciais do mesmo cliente
+AGREGACOES_PARCIAIS = {
+    "Nome": "last",                 # nome da venda mais recente (parciais em ordem de ULTIMO_ID_VENDA)
+    "FREQUENCIA_COMPRA": "sum",
+    "VALOR_GASTO": "sum",
+    "PRIMEIRA_COMPRA": "min",
+    "ULTIMA_COMPRA": "max",
+    "ULTIMO_ID_VENDA": "max",
+}
+
+
+# Reduz uma lista de parciais a uma linha por cliente. As parciais são ordenadas
+# pelo último ID_Venda, então o "last" do nome é o da venda mais recente em
+# qualquer ordem de partes (o mesmo nome da consulta e da agregação em lotes).
+def reduzir_parciais(partes):
+    parciais = pd.concat(partes).sort_values("ULTIMO_ID_VENDA", kind="stable")
+    return parciais.groupby(level="ID_Cliente").agg(AGREGACOES_PARCIAIS)
+
+
+# Combina duas bases parciais por cliente (somas, mínimos e máximos)
+def combinar_parciais(base, novas):
+    if base is None or base.empty:
+        return novas.copy()
+    if novas is None or novas.empty:
+        return base
+    return reduzir_parciais([base, novas])
+
+
+# Parte consolidada gravada e o corte dela (None, None sem arquivo ou em formato antigo)
+def _carregar_arquivo():
+    if not os.path.exists(ARQUIVO_FEATURES):
+        return None, None
+    try:
+        base = pd.read_parquet(ARQUIVO_FEATURES)
+    except Exception as e:
+        print(f"Erro ao ler a base de features ({ARQUIVO_FEATURES}): {e}")
+        return None, None
+    if "corte_data" not in base.attrs:
+        print(f"Base de features sem o corte da parte consolidada ({ARQUIVO_FEATURES}), reconstruindo")
+        return None, None
+    corte = (date.fromisoformat(base.attrs["corte_data"]), int(base.attrs["corte_id"]))
+    base.attrs = {}
+    return base, corte
+
+
+def _gravar_arquivo(base, corte):
+    try:
+        os.makedirs(os.path.dirname(ARQUIVO_FEATURES), exist_ok=True)
+        temporario = ARQUIVO_FEATURES + ".tmp"
+        arquivo = base.copy()
+        arquivo.attrs = {"corte_data": corte[0].isoformat(), "corte_id": int(corte[1])}
+        arquivo.to_parquet(temporario)
+        os.replace(temporario, ARQUIVO_FEATURES)
+    except Exception as e:
+        print(f"Erro ao gravar a base de features ({ARQUIVO_FEATURES}): {e}")
+
+
+# Busca no banco as vendas que atendem a condição, já agregadas por cliente
+def buscar_parciais(condicao, params, dados_conexao=banco_dados.DADOS_CONEXAO):
+    novas = banco_dados.executar_consulta(CONSULTA_PARCIAIS.format(condicao=condicao), tuple(params), dados_conexao)
+    novas["VALOR_GASTO"] = pd.to_numeric(novas["VALOR_GASTO"], errors="coerce").astype("float64")
+    novas["PRIMEIRA_COMPRA"] = pd.to_datetime(novas["PRIMEIRA_COMPRA"], errors="coerce")
+    novas["ULTIMA_COMPRA"] = pd.to_datetime(novas["ULTIMA_COMPRA"], errors="coerce")
+    return novas.set_index("ID_Cliente")[COLUNAS_PARCIAIS]
+
+
+def _maior_id(dados_conexao):
+    maior_id = banco_dados.executar_consulta(CONSULTA_MAIOR_ID, None, dados_conexao).iloc[0]["maior_id"]
+    return 0 if pd.isna(maior_id) else int(maior_id)
+
+
+# Parciais das vendas que passam para a parte consolidada quando o corte avança
+# de anterior para novo (todas as anteriores ao novo corte, na primeira vez)
+def _consolidar(anterior, novo, dados_conexao):
+    if anterior is None and RECONSTRUIR_EM_LOTES:
+        import agregacao_lotes
+        limite = pd.Timestamp(novo[0])
+        lotes = agregacao_lotes.lotes_banco(0, dados_conexao=dados_conexao)
+        return agregacao_lotes.agregar(
+            lote[(pd.to_datetime(lote["Data_cx"]) < limite) & (lote["ID_Venda"] <= novo[1])] for lote in lotes
+        )
+    condicao, params = CONDICAO_CONSOLIDADAS, [novo[0], novo[1]]
+    if anterior is not None:
+        condicao, params = f"{condicao} AND {CONDICAO_RECENTES}", params + [anterior[0], anterior[1]]
+    return buscar_parciais(condicao, params, dados_conexao)
+
+
+# Parte recente e maior ID_Venda do banco, guardados no cache das KPIs: a mesma
+# chave é reaproveitada até as marcas d'água da tabela Vendas mudarem
+def _buscar_recentes(corte, dados_conexao):
+    return cache_kpis.obter(
+        ("features_recentes",) + corte, ["Vendas"],
+        lambda: (buscar_parciais(CONDICAO_RECENTES, corte, dados_conexao), _maior_id(dados_conexao)),
+        dados_conexao=dados_conexao,
+    )
+
+
+# Atualiza a base: avança o corte quando a janela de revisão muda de dia e
+# reagrega a parte recente. Sem base local (ou com o banco "voltando no tempo",
+# por exemplo após restaurar um backup) a base é reconstruída do zero.
+def atualizar(forcar=False, reconstruir=False, dados_conexao=banco_dados.DADOS_CONEXAO):
+    global _base, _consolidada, _recentes, _corte, _versao, _ultima_atualizacao
+
+    with _lock:
+        if not forcar and not reconstruir and _base is not None \
+                and time.monotonic() - _ultima_atualizacao < INTERVALO_ATUALIZACAO:
+            return _base
+
+        if _consolidada is None and not reconstruir:
+            _consolidada, _corte = _carregar_arquivo()
+        if reconstruir or _consolidada is None:
+            _consolidada, _corte = _base_vazia(), None
+
+        corte_data = date.today() - timedelta(days=JANELA_REVISAO_DIAS)
+        recentes = None
+        if _corte is not None and _corte[0] >= corte_data:
+            recentes, maior_id = _buscar_recentes(_corte, dados_conexao)
+        else:
+            maior_id = _maior_id(dados_conexao)
+        if _corte is not None and maior_id < _corte[1]:
+            _consolidada, _corte, recentes = _base_vazia(), None, None
+
+        if recentes is None:
+            novo = (corte_data, maior_id)
+            _consolidada = combinar_parciais(_consolidada, _consolidar(_corte, novo, dados_conexao))
+            _corte = novo
+            _gravar_arquivo(_consolidada, _corte)
+            recentes, _ = _buscar_recentes(_corte, dados_conexao)
+        _ultima_atualizacao = time.monotonic()
+
+        # O cache devolve o mesmo objeto enquanto a tabela Vendas não muda
+        if recentes is not _recentes or _base is None:
+            _base = combinar_parciais(_consolidada, recentes)
+            _recentes = recentes
+            _versao += 1
+
+        return _base
+
+
+# Versão dos dados da base (muda sempre que a base é recalculada com vendas
+# novas ou alteradas); serve de chave para caches de resultados derivados da segmentação
+def versao():
+    return _versao
+
+
+# Base de features pronta para a segmentação, com as colunas derivadas
+# calculadas na data de referência (hoje, por padrão)
+def obter_features(data_referencia=None, dados_conexao=banco_dados.DADOS_CONEXAO):
+    base = atualizar(dados_conexao=dados_conexao).copy()
+    referencia = pd.Timestamp(data_referencia or date.today())
+
+    base["FREQUENCIA_COMPRA"] = base["FREQUENCIA_COMPRA"].astype("int64")
+    base["VALOR_GASTO"] = base["VALOR_GASTO"].astype("float64")
+    base["TICKET_MEDIO"] = base["VALOR_GASTO"] / base["FREQUENCIA_COMPRA"].where(base["FREQUENCIA_COMPRA"] > 0)
+    base["RECENCIA_DIAS"] = (referencia - pd.to_datetime(base["ULTIMA_COMPRA"])).dt.days
+    base["TEMPO_CLIENTE_DIAS"] = (referencia - pd.to_datetime(base["PRIMEIRA_COMPRA"])).dt.days
+    return base
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Atualiza a base de features por cliente")
+    parser.add_argument("--reconstruir", action="store_true", help="descarta a base local e refaz do zero")
+    parser.add_argument("--em-lotes", action="store_true",
+                        help="reconstrói lendo as vendas em lotes, com memória limitada (agregacao_lotes.py)")
+    args = parser.parse_args()
+    RECONSTRUIR_EM_LOTES = RECONSTRUIR_EM_LOTES or args.em_lotes
+
+    inicio = time.perf_counter()
+    base = atualizar(forcar=True, reconstruir=args.reconstruir)
+    print(f"{len(base)} clientes, corte da parte consolidada {_corte[0]:%d/%m/%Y} (ID_Venda {_corte[1]}), "
+          f"em {time.perf_counter() - inicio:.1f}s")
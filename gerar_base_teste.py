@@ -0,0 +1,288 @@
+# Gera uma base local de teste (stand-in) com o mesmo esquema usado pelo dashboard.
+#
+# Cria as tabelas Vendas, Vendas_Itens, Vendas_Receber, Itens e ItensGrupos em um
+# SQL Server local (LocalDB, SQL Server Express ou contêiner Docker) e preenche com
+# vendas sintéticas. É a base usada pelos benchmarks, pelo teste de carga e pela
+# recomendação de índices, sem tocar no banco de produção.
+#
+# Exemplo:
+#     python gerar_base_teste.py --vendas 500000 --recriar
+#     python gerar_base_teste.py --conexao "Driver={ODBC Driver 18 for SQL Server};Server=localhost;Database=kpis_teste;UID=sa;PWD=...;TrustServerCertificate=yes;"
+import os
+import re
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import banco_dados
+
+# Conexão da base de teste (pode ser alterada pela variável de ambiente KPIS_DADOS_CONEXAO_TESTE)
+CONEXAO_TESTE = os.environ.get(
+    "KPIS_DADOS_CONEXAO_TESTE",
+    (
+        "Driver={ODBC Driver 17 for SQL Server};"
+        "Server=(localdb)\\MSSQLLocalDB;"
+        "Database=kpis_teste;"
+        "Trusted_Connection=yes;"
+    ),
+)
+
+ESQUEMA = {
+    "ItensGrupos": """
+        CREATE TABLE ItensGrupos (
+            ID_Grupo INT NOT NULL PRIMARY KEY,
+            Descricao NVARCHAR(60) NOT NULL
+        )""",
+    "Itens": """
+        CREATE TABLE Itens (
+            ID_Item INT NOT NULL PRIMARY KEY,
+            Descricao NVARCHAR(100) NOT NULL,
+            ID_Grupo INT NOT NULL
+        )""",
+    "Vendas": """
+        CREATE TABLE Vendas (
+            ID_Venda INT NOT NULL PRIMARY KEY,
+            ID_Cliente INT NOT NULL,
+            Nome NVARCHAR(100) NULL,
+            Telefone NVARCHAR(20) NULL,
+            Email NVARCHAR(120) NULL,
+            Data_cx DATETIME NOT NULL,
+            Hora DATETIME NOT NULL,
+            Vendedor NVARCHAR(60) NOT NULL,
+            Valor_itens DECIMAL(12, 2) NOT NULL,
+            Valor_Liquido DECIMAL(12, 2) NOT NULL,
+            Exclusao DATETIME NULL,
+            Cancelamento DATETIME NULL
+        )""",
+    "Vendas_Itens": """
+        CREATE TABLE Vendas_Itens (
+            ID_Venda_Item INT NOT NULL PRIMARY KEY,
+            ID_Venda INT NOT NULL,
+            ID_Cliente INT NOT NULL,
+            ID_Item INT NOT NULL,
+            ID_Grupo INT NOT NULL,
+            Descricao NVARCHAR(100) NOT NULL,
+            QUANTIDADE DECIMAL(12, 3) NOT NULL,
+            Valor_liquido DECIMAL(12, 2) NOT NULL,
+            Data_cx DATETIME NOT NULL,
+            Exclusao DATETIME NULL,
+            Cancelamento DATETIME NULL
+        )""",
+    "Vendas_Receber": """
+        CREATE TABLE Vendas_Receber (
+            ID_Receber INT NOT NULL PRIMARY KEY,
+            ID_Venda INT NOT NULL,
+            Meio NVARCHAR(40) NULL,
+            Valor DECIMAL(12, 2) NOT NULL,
+            Data_Turno DATETIME NOT NULL,
+            Exclusao DATETIME NULL
+        )""",
+}
+
+MEIOS = ["Dinheiro", "Cartão de Crédito", "Cartão de Débito", "PIX", "Vale Refeição", "Crediário"]
+GRUPOS = ["Bebidas", "Mercearia", "Hortifruti", "Padaria", "Açougue", "Frios", "Limpeza",
+          "Higiene", "Bazar", "Congelados", "Pet", "Utilidades"]
+
+
+def _nome_banco(dados_conexao):
+    encontrado = re.search(r"(?:Database|Initial Catalog)\s*=\s*([^;]+)", dados_conexao, re.IGNORECASE)
+    return encontrado.group(1).strip() if encontrado else None
+
+
+def _nomes_clientes(quantidade, gerador):
+    try:
+        from faker import Faker
+        fake = Faker("pt_BR")
+        Faker.seed(int(gerador.integers(1 << 31)))
+        base = [fake.name() for _ in range(min(quantidade, 5000))]
+    except ImportError:
+        base = [f"Cliente {i}" for i in range(min(quantidade, 5000))]
+    # Nomes repetem na base real; o sufixo mantém o nome único por ID_Cliente
+    return [f"{base[i % len(base)]} {i // len(base)}" if i >= len(base) else base[i] for i in range(quantidade)]
+
+
+# Gera as tabelas em memória (DataFrames) de forma reproduzível pela semente
+def gerar_dados(vendas=200_000, clientes=20_000, produtos=500, vendedores=15, dias=730,
+                data_final=None, semente=42):
+    gerador = np.random.default_rng(semente)
+    data_final = pd.Timestamp(data_final or date.today())
+
+    grupos = pd.DataFrame({"ID_Grupo": np.arange(1, len(GRUPOS) + 1), "Descricao": GRUPOS})
+    itens = pd.DataFrame({
+        "ID_Item": np.arange(1, produtos + 1),
+        "Descricao": [f"Produto {i:04d}" for i in range(1, produtos + 1)],
+        "ID_Grupo": gerador.integers(1, len(GRUPOS) + 1, produtos),
+    })
+    preco_item = np.round(gerador.lognormal(2.5, 0.8, produtos), 2)
+    # Popularidade dos produtos e clientes segue uma cauda longa (Zipf)
+    peso_produto = 1.0 / np.arange(1, produtos + 1) ** 0.9
+    peso_produto /= peso_produto.sum()
+    peso_cliente = 1.0 / np.arange(1, clientes + 1) ** 0.7
+    peso_cliente /= peso_cliente.sum()
+
+    nomes = np.array(_nomes_clientes(clientes, gerador), dtype=object)
+    telefones = np.array([f"(11) 9{numero // 10000:04d}-{numero % 10000:04d}"
+                          for numero in gerador.integers(0, 10 ** 8, clientes)], dtype=object)
+    emails = np.array([f"cliente{i}@exemplo.com.br" for i in range(1, clientes + 1)], dtype=object)
+    nomes_vendedores = np.array([f"Vendedor {i:02d}" for i in range(1, vendedores + 1)], dtype=object)
+
+    id_venda = np.arange(1, vendas + 1)
+    id_cliente = gerador.choice(clientes, vendas, p=peso_cliente) + 1
+    deslocamento = np.sort(gerador.integers(0, dias, vendas))[::-1]
+    data_cx = (data_final.normalize() - pd.to_timedelta(deslocamento, unit="D")).values
+    minutos = np.clip(gerador.normal(14 * 60, 4 * 60, vendas), 5 * 60, 23 * 60 - 1).astype(int)
+    hora = (pd.Timestamp("1900-01-01") + pd.to_timedelta(minutos, unit="min")).values
+    cancelada = gerador.random(vendas) < 0.02
+    excluida = gerador.random(vendas) < 0.01
+
+    # Itens: de 1 a 6 por venda
+    itens_por_venda = gerador.integers(1, 7, vendas)
+    venda_do_item = np.repeat(np.arange(vendas), itens_por_venda)
+    total_itens = len(venda_do_item)
+    produto_do_item = gerador.choice(produtos, total_itens, p=peso_produto)
+    quantidade = gerador.integers(1, 5, total_itens).astype(float)
+    valor_item = np.round(quantidade * preco_item[produto_do_item], 2)
+    valor_venda = np.bincount(venda_do_item, weights=valor_item, minlength=vendas)
+    desconto = np.round(valor_venda * gerador.choice([0, 0, 0, 0.05, 0.1], vendas), 2)
+
+    momento = pd.Timestamp.now().floor("s").to_datetime64()
+    nulo = np.datetime64("NaT")
+
+    tabela_vendas = pd.DataFrame({
+        "ID_Venda": id_venda,
+        "ID_Cliente": id_cliente,
+        "Nome": nomes[id_cliente - 1],
+        "Telefone": telefones[id_cliente - 1],
+        "Email": emails[id_cliente - 1],
+        "Data_cx": data_cx,
+        "Hora": hora,
+        "Vendedor": nomes_vendedores[gerador.integers(0, vendedores, vendas)],
+        "Valor_itens": np.round(valor_venda, 2),
+        "Valor_Liquido": np.round(valor_venda - desconto, 2),
+        "Exclusao": np.where(excluida, momento, nulo),
+        "Cancelamento": np.where(cancelada, momento, nulo),
+    })
+
+    tabela_itens = pd.DataFrame({
+        "ID_Venda_Item": np.arange(1, total_itens + 1),
+        "ID_Venda": id_venda[venda_do_item],
+        "ID_Cliente": id_cliente[venda_do_item],
+        "ID_Item": produto_do_item + 1,
+        "ID_Grupo": itens["ID_Grupo"].values[produto_do_item],
+        "Descricao": itens["Descricao"].values[produto_do_item],
+        "QUANTIDADE": quantidade,
+        "Valor_liquido": valor_item,
+        "Data_cx": data_cx[venda_do_item],
+        "Exclusao": np.where(excluida[venda_do_item], momento, nulo),
+        "Cancelamento": np.where(cancelada[venda_do_item], momento, nulo),
+    })
+
+    # Recebimentos: um meio de pagamento por venda, 10% divididas em dois meios
+    dividida = gerador.random(vendas) < 0.10
+    venda_do_recebimento = np.concatenate([np.arange(vendas), np.flatnonzero(dividida)])
+    fracao = np.where(dividida, 0.6, 1.0)
+    valor_recebido = np.concatenate([
+        np.round((valor_venda - desconto) * fracao, 2),
+        np.round((valor_venda - desconto)[dividida] * 0.4, 2),
+    ])
+    tabela_receber = pd.DataFrame({
+        "ID_Receber": np.arange(1, len(venda_do_recebimento) + 1),
+        "ID_Venda": id_venda[venda_do_recebimento],
+        "Meio": np.array(MEIOS, dtype=object)[gerador.integers(0, len(MEIOS), len(venda_do_recebimento))],
+        "Valor": valor_recebido,
+        "Data_Turno": data_cx[venda_do_recebimento],
+        "Exclusao": np.where(excluida[venda_do_recebimento], momento, nulo),
+    })
+
+    return {
+        "ItensGrupos": grupos,
+        "Itens": itens,
+        "Vendas": tabela_vendas,
+        "Vendas_Itens": tabela_itens,
+        "Vendas_Receber": tabela_receber,
+    }
+
+
+def _conectar(dados_conexao, autocommit=False):
+    import pyodbc
+    return pyodbc.connect(dados_conexao, autocommit=autocommit)
+
+
+# Cria o banco de teste (se não existir) conectando no master do mesmo servidor
+def criar_banco(dados_conexao):
+    nome = _nome_banco(dados_conexao)
+    if not nome:
+        raise ValueError("A string de conexão de teste precisa informar Database=...")
+    conexao_master = re.sub(r"(Database|Initial Catalog)\s*=\s*[^;]+", "Database=master",
+                            dados_conexao, flags=re.IGNORECASE)
+    with _conectar(conexao_master, autocommit=True) as conexao:
+        conexao.execute(f"IF DB_ID(N'{nome}') IS NULL CREATE DATABASE [{nome}]")
+
+
+def criar_tabelas(dados_conexao, recriar=False):
+    with _conectar(dados_conexao) as conexao:
+        for tabela, ddl in ESQUEMA.items():
+            existe = conexao.execute("SELECT OBJECT_ID(?, 'U')", tabela).fetchval() is not None
+            if existe and not recriar:
+                raise RuntimeError(f"A tabela {tabela} já existe; use --recriar para apagá-la.")
+            if existe:
+                conexao.execute(f"DROP TABLE {tabela}")
+            conexao.execute(ddl)
+        conexao.commit()
+
+
+def _valores(valor):
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)) or valor is pd.NaT:
+        return None
+    if isinstance(valor, pd.Timestamp):
+        return valor.to_pydatetime()
+    if isinstance(valor, np.generic):
+        return valor.item()
+    return valor
+
+
+# Insere um DataFrame em lotes com fast_executemany (parâmetros em array no ODBC)
+def inserir(dados_conexao, tabela, dados, tamanho_lote=50_000):
+    colunas = list(dados.columns)
+    comando = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})"
+    with _conectar(dados_conexao) as conexao:
+        cursor = conexao.cursor()
+        cursor.fast_executemany = True
+        for inicio in range(0, len(dados), tamanho_lote):
+            lote = dados.iloc[inicio:inicio + tamanho_lote].astype(object)
+            linhas = [tuple(_valores(valor) for valor in linha) for linha in lote.itertuples(index=False)]
+            cursor.executemany(comando, linhas)
+        conexao.commit()
+
+
+def popular(dados_conexao=CONEXAO_TESTE, recriar=False, **parametros):
+    if dados_conexao == banco_dados.DADOS_CONEXAO:
+        raise ValueError("A base de teste não pode ser a mesma conexão do dashboard.")
+
+    criar_banco(dados_conexao)
+    criar_tabelas(dados_conexao, recriar=recriar)
+    tabelas = gerar_dados(**parametros)
+    for tabela, dados in tabelas.items():
+        inicio = time.perf_counter()
+        inserir(dados_conexao, tabela, dados)
+        print(f"{tabela}: {len(dados)} linhas em {time.perf_counter() - inicio:.1f}s")
+    return tabelas
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Gera a base local de teste do dashboard")
+    parser.add_argument("--conexao", default=CONEXAO_TESTE, help="string de conexão ODBC da base de teste")
+    parser.add_argument("--vendas", type=int, default=200_000)
+    parser.add_argument("--clientes", type=int, default=20_000)
+    parser.add_argument("--produtos", type=int, default=500)
+    parser.add_argument("--dias", type=int, default=730)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--recriar", action="store_true", help="apaga e recria as tabelas existentes")
+    args = parser.parse_args()
+
+    popular(args.conexao, recriar=args.recriar, vendas=args.vendas, clientes=args.clientes,
+            produtos=args.produtos, dias=args.dias, semente=args.semente)
@@ -0,0 +1,212 @@
+# Várias lojas, cada uma com o banco do seu PDV.
+#
+# As lojas vêm da variável de ambiente KPIS_LOJAS (JSON {"nome": "string de conexão"})
+# ou do arquivo lojas.json ao lado deste módulo. Sem configuração há uma única loja,
+# a conexão padrão de banco_dados, e o dashboard funciona como antes. Uma loja pode
+# informar também a réplica de leitura do seu banco (veja banco_dados.conexao_leitura).
+#
+# Cada consulta é executada em todas as lojas ao mesmo tempo (uma thread por loja),
+# passando pelo cache de cada conexão: o tempo de uma KPI é o da loja mais lenta,
+# não a soma das lojas. Com uma loja só a consulta não entra na fila das lojas:
+# roda na própria thread de quem chamou (ou em uma thread só dela, enquanto quem
+# chamou confere verificar). As montagens pesadas (cubo, cestas) têm uma fila
+# própria e não ocupam as threads das consultas das KPIs. Os resultados parciais voltam empilhados, com a coluna Loja,
+# para a página combinar (somas, contagens e novo ranking dos top-N).
+#
+# Enquanto espera as lojas, consultar() chama periodicamente a função verificar
+# recebida da página; se ela levantar uma exceção (um rerun mais novo, no Streamlit),
+# as consultas ainda em execução são canceladas no servidor antes de a exceção seguir.
+# As threads das lojas rodam em uma cópia do contexto (contextvars) de quem chamou.
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import banco_dados
+import cache_kpis
+
+ARQUIVO_LOJAS = os.environ.get(
+    "KPIS_ARQUIVO_LOJAS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "lojas.json"),
+)
+
+# Tempo máximo de uma loja (segundos, contado de quando a consulta dela começa,
+# sem a espera na fila); com várias lojas, a que passar disso fica de fora do
+# consolidado daquele rerun em vez de segurar a página inteira. Com uma loja só
+# não há limite: não haveria o que mostrar sem ela.
+TEMPO_MAXIMO_LOJA = float(os.environ.get("KPIS_TEMPO_MAXIMO_LOJA", "60"))
+
+# Tempo máximo para as montagens pesadas (matriz das cestas, cubo de vendas)
+TEMPO_MAXIMO_MONTAGEM = float(os.environ.get("KPIS_TEMPO_MAXIMO_MONTAGEM", "1800"))
+
+# Consultas simultâneas por loja com várias lojas, somando todas as sessões do dashboard
+CONSULTAS_POR_LOJA = int(os.environ.get("KPIS_CONSULTAS_POR_LOJA", "4"))
+
+# Montagens pesadas simultâneas por loja, somando todas as sessões
+MONTAGENS_POR_LOJA = int(os.environ.get("KPIS_MONTAGENS_POR_LOJA", "2"))
+
+# Intervalo entre as chamadas de verificar() enquanto as lojas respondem (segundos)
+INTERVALO_VERIFICACAO = float(os.environ.get("KPIS_INTERVALO_INTERRUPCAO", "0.1"))
+
+
+def carregar_lojas():
+    configuracao = os.environ.get("KPIS_LOJAS")
+    if configuracao:
+        lojas = json.loads(configuracao)
+    elif os.path.exists(ARQUIVO_LOJAS):
+        with open(ARQUIVO_LOJAS, encoding="utf-8") as arquivo:
+            lojas = json.load(arquivo)
+    else:
+        return {"Loja": banco_dados.DADOS_CONEXAO}
+    # Cada loja é a string de conexão do primário ou {"conexao": ..., "replica": ...}
+    for nome, loja in lojas.items():
+        if isinstance(loja, dict):
+            lojas[nome] = loja["conexao"]
+            banco_dados.registrar_replica(loja["conexao"], loja.get("replica"))
+    return lojas
+
+
+# Nome da loja -> string de conexão, na ordem da configuração
+LOJAS = carregar_lojas()
+
+_executor = ThreadPoolExecutor(
+    max_workers=max(len(LOJAS) * CONSULTAS_POR_LOJA, 1), thread_name_prefix="lojas"
+)
+_executor_montagens = ThreadPoolExecutor(
+    max_workers=max(len(LOJAS) * MONTAGENS_POR_LOJA, 1), thread_name_prefix="lojas-montagem"
+)
+
+
+def multiplas():
+    return len(LOJAS) > 1
+
+
+# Estado da réplica de leitura da loja (None quando ela não tem réplica)
+def estado_replica(nome):
+    return banco_dados.estado_replica(LOJAS[nome])
+
+
+def _executar_loja(cancelamento, funcao, dados_conexao, inicios, nome):
+    inicios[nome] = time.monotonic()
+    # A verificação das marcas d'água serve a todas as sessões e fica fora do cancelamento
+    cache_kpis.verificar_alteracoes(dados_conexao)
+    with banco_dados.cancelavel(cancelamento):
+        return funcao(dados_conexao)
+
+
+# Espera os futuros, chamando verificar() a cada intervalo. A loja que passa do
+# tempo máximo desde o seu início tem as consultas canceladas e sai da espera.
+def _aguardar(futuros, verificar, tempo_maximo, inicios, cancelamentos):
+    concluidos, pendentes, expirados = set(), set(futuros), set()
+    while pendentes:
+        prontos, pendentes = wait(pendentes, timeout=INTERVALO_VERIFICACAO)
+        concluidos |= prontos
+        if tempo_maximo is not None:
+            agora = time.monotonic()
+            vencidos = [futuro for futuro in pendentes if agora - inicios.get(futuros[futuro], agora) > tempo_maximo]
+            for futuro in vencidos:
+                # A consulta da loja para no servidor em vez de seguir sem ninguém esperando
+                cancelamentos[futuros[futuro]].cancelar()
+                pendentes.discard(futuro)
+                expirados.add(futuro)
+        if pendentes and verificar:
+            verificar()
+    return concluidos, expirados
+
+
+# Executa a função em uma thread só para ela (fora das filas) e devolve o futuro
+def _em_thread_propria(funcao, *args):
+    futuro = Future()
+
+    def rodar():
+        if not futuro.set_running_or_notify_cancel():
+            return
+        try:
+            futuro.set_result(funcao(*args))
+        except BaseException as erro:
+            futuro.set_exception(erro)
+
+    threading.Thread(target=rodar, name="lojas-consulta", daemon=True).start()
+    return futuro
+
+
+# Executa funcao(dados_conexao) em cada loja em paralelo e devolve a lista de
+# (loja, resultado) na ordem das lojas e o dicionário das lojas que falharam ou
+# não responderam a tempo; se nenhuma respondeu, o erro da primeira é levantado.
+# tempo_maximo substitui TEMPO_MAXIMO_LOJA (com uma loja só nunca há limite).
+# montagem=True usa a fila das montagens pesadas e TEMPO_MAXIMO_MONTAGEM.
+def executar(funcao, lojas=None, verificar=None, tempo_maximo=None, montagem=False):
+    nomes = list(lojas or LOJAS)
+    if len(nomes) == 1:
+        tempo_maximo = None
+    elif tempo_maximo is None:
+        tempo_maximo = TEMPO_MAXIMO_MONTAGEM if montagem else TEMPO_MAXIMO_LOJA
+    cancelamentos = {nome: banco_dados.Cancelamento() for nome in nomes}
+    inicios = {}
+
+    if montagem:
+        submeter = _executor_montagens.submit
+    elif len(nomes) == 1:
+        if verificar is None:
+            # Sem nada a conferir durante a espera: roda na thread de quem chamou
+            nome = nomes[0]
+            return [(nome, _executar_loja(cancelamentos[nome], funcao, LOJAS[nome], inicios, nome))], {}
+        submeter = _em_thread_propria
+    else:
+        submeter = _executor.submit
+    futuros = {
+        submeter(contextvars.copy_context().run, _executar_loja,
+                 cancelamentos[nome], funcao, LOJAS[nome], inicios, nome): nome
+        for nome in nomes
+    }
+    try:
+        concluidos, expirados = _aguardar(futuros, verificar, tempo_maximo, inicios, cancelamentos)
+    except BaseException:
+        # Interrompido (inclusive pelo RerunException do Streamlit): ninguém vai
+        # usar esses resultados, então o servidor para de calculá-los
+        for cancelamento in cancelamentos.values():
+            cancelamento.cancelar()
+        raise
+
+    partes = []
+    erros = {futuros[futuro]: TimeoutError("sem resposta no tempo máximo") for futuro in expirados}
+    for futuro in concluidos:
+        try:
+            partes.append((futuros[futuro], futuro.result()))
+        except Exception as e:
+            erros[futuros[futuro]] = e
+    if not partes:
+        raise next(iter(erros.values()))
+
+    ordem = {nome: posicao for posicao, nome in enumerate(nomes)}
+    partes.sort(key=lambda parte: ordem[parte[0]])
+    return partes, {nome: str(erro) for nome, erro in erros.items()}
+
+
+# Executa a consulta (pelo cache_kpis) em cada loja em paralelo e devolve os
+# resultados empilhados com a coluna Loja. As lojas que falharam ou não
+# responderam a tempo ficam em dados.attrs["lojas_com_erro"].
+def consultar(consulta_sql, tabelas, data_inicio=None, data_fim=None, params=None, lojas=None, verificar=None):
+    partes, erros = executar(
+        lambda dados_conexao: cache_kpis.consultar(consulta_sql, tabelas, data_inicio, data_fim, params, dados_conexao),
+        lojas, verificar,
+    )
+    dados = pd.concat([parte.assign(Loja=nome) for nome, parte in partes], ignore_index=True)
+    dados.attrs["lojas_com_erro"] = erros
+    return dados
+
+
+# Soma as colunas por chave entre as lojas e ordena pelo primeiro valor (maior primeiro).
+# Para top-N, cada loja precisa devolver o agrupamento completo, sem TOP.
+def somar(dados, chaves, colunas, limite=None):
+    if dados.empty:
+        return dados.drop(columns="Loja", errors="ignore")
+    combinados = dados.groupby(chaves, as_index=False, sort=False, dropna=False)[colunas].sum()
+    combinados = combinados.sort_values(colunas[0], ascending=False, kind="stable")
+    if limite is not None:
+        combinados = combinados.head(limite)
+    return combinados.reset_index(drop=True)
@@ -0,0 +1,218 @@
+# Medição do tempo de inicialização (cold start) das páginas do dashboard.
+#
+# Cada processo do Streamlit registra, apenas na primeira execução de cada página,
+# quanto tempo levou a importação de cada módulo pesado e a primeira renderização
+# de cada seção. O relatório é gravado em formato JSON Lines para acompanhar a
+# latência de inicialização após deploys e reinícios do servidor.
+#
+# Uso do relatório pela linha de comando:
+#     python perfil_inicializacao.py              # últimas 10 inicializações
+#     python perfil_inicializacao.py --ultimos 30 --pagina Análise_de_Vendas
+import builtins
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Instante em que o processo começou a carregar o dashboard
+INICIO_PROCESSO = time.perf_counter()
+
+# Arquivo onde os relatórios são acumulados (pode ser alterado por variável de ambiente)
+ARQUIVO_LOG = os.environ.get(
+    "KPIS_LOG_INICIALIZACAO",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "inicializacao.jsonl"),
+)
+
+_lock = threading.Lock()
+# Medição de cada primeira execução em andamento, por (página, thread): duas
+# sessões abertas ao mesmo tempo após um reinício não misturam as marcações
+_etapas = {}               # (pagina, thread) -> lista de etapas medidas
+_ultima_marca = {}         # (pagina, thread) -> instante da última marcação
+_paginas_finalizadas = set()
+
+# Um único __import__ medido, instalado enquanto algum bloco medir_importacoes
+# está aberto (em qualquer sessão) e que só mede na thread dona do bloco
+_medicao = threading.local()
+_import_original = None
+_blocos_abertos = 0
+
+
+def _chave(pagina):
+    return pagina, threading.get_ident()
+
+
+def _registrar(pagina, tipo, nome, segundos):
+    with _lock:
+        _etapas.setdefault(_chave(pagina), []).append(
+            {"tipo": tipo, "nome": nome, "segundos": round(segundos, 4)}
+        )
+
+
+def _ja_finalizada(pagina):
+    return pagina in _paginas_finalizadas
+
+
+# Começo de uma execução da página: descarta o que uma primeira execução anterior
+# nesta thread deixou sem finalizar (interrompida por st.stop() ou por um rerun)
+def iniciar(pagina):
+    if _ja_finalizada(pagina):
+        return
+    with _lock:
+        _etapas.pop(_chave(pagina), None)
+        _ultima_marca.pop(_chave(pagina), None)
+
+
+def _import_medido(name, globals=None, locals=None, fromlist=(), level=0):
+    pagina = getattr(_medicao, "pagina", None)
+    if pagina is None or _medicao.profundidade > 0:
+        return _import_original(name, globals, locals, fromlist, level)
+
+    carregado = name in sys.modules
+    _medicao.profundidade = 1
+    inicio = time.perf_counter()
+    try:
+        return _import_original(name, globals, locals, fromlist, level)
+    finally:
+        _medicao.profundidade = 0
+        if not carregado:
+            _registrar(pagina, "importacao", name, time.perf_counter() - inicio)
+
+
+# Mede o tempo de cada import feito dentro do bloco, módulo por módulo.
+# Só os imports de primeiro nível do bloco são cronometrados (as dependências
+# internas entram no tempo do módulo que as importou). Nas execuções seguintes
+# da página o bloco não faz nada além de executar os imports.
+@contextmanager
+def medir_importacoes(pagina):
+    global _import_original, _blocos_abertos
+    if _ja_finalizada(pagina):
+        yield
+        return
+
+    with _lock:
+        if _blocos_abertos == 0 and builtins.__import__ is not _import_medido:
+            _import_original = builtins.__import__
+            builtins.__import__ = _import_medido
+        _blocos_abertos += 1
+    _medicao.pagina, _medicao.profundidade = pagina, 0
+    inicio_bloco = time.perf_counter()
+    try:
+        yield
+    finally:
+        _medicao.pagina = None
+        with _lock:
+            _blocos_abertos -= 1
+            # Se outro código trocou o __import__ depois, o medido fica no lugar
+            # (sem blocos abertos ele só repassa a chamada)
+            if _blocos_abertos == 0 and builtins.__import__ is _import_medido:
+                builtins.__import__ = _import_original
+            # O tempo gasto importando não entra na renderização da seção corrente
+            agora = time.perf_counter()
+            chave = _chave(pagina)
+            _ultima_marca[chave] = _ultima_marca.get(chave, inicio_bloco) + (agora - inicio_bloco)
+
+
+# Marca o fim de uma seção da página; o tempo desde a marcação anterior é
+# atribuído à seção informada
+def marcar(pagina, secao):
+    if _ja_finalizada(pagina):
+        return
+    agora = time.perf_counter()
+    with _lock:
+        anterior = _ultima_marca.get(_chave(pagina), agora)
+        _ultima_marca[_chave(pagina)] = agora
+    _registrar(pagina, "renderizacao", secao, agora - anterior)
+
+
+# Encerra a medição da primeira renderização da página e grava o relatório.
+# Vale a primeira execução que chegar ao fim; as das outras sessões são descartadas.
+def finalizar(pagina):
+    with _lock:
+        if pagina in _paginas_finalizadas:
+            return
+        _paginas_finalizadas.add(pagina)
+        etapas = _etapas.pop(_chave(pagina), [])
+        for chave in [chave for chave in list(_etapas) + list(_ultima_marca) if chave[0] == pagina]:
+            _etapas.pop(chave, None)
+            _ultima_marca.pop(chave, None)
+
+    relatorio = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "pagina": pagina,
+        "pid": os.getpid(),
+        "segundos_desde_inicio_processo": round(time.perf_counter() - INICIO_PROCESSO, 4),
+        "total_importacao": round(sum(e["segundos"] for e in etapas if e["tipo"] == "importacao"), 4),
+        "total_renderizacao": round(sum(e["segundos"] for e in etapas if e["tipo"] == "renderizacao"), 4),
+        "etapas": etapas,
+    }
+
+    try:
+        os.makedirs(os.path.dirname(ARQUIVO_LOG), exist_ok=True)
+        with open(ARQUIVO_LOG, "a", encoding="utf-8") as arquivo:
+            arquivo.write(json.dumps(relatorio, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Erro ao gravar o relatório de inicialização: {e}")
+
+    print(
+        f"[inicialização] {pagina}: importação {relatorio['total_importacao']:.2f}s, "
+        f"primeira renderização {relatorio['total_renderizacao']:.2f}s"
+    )
+    return relatorio
+
+
+# Lê os relatórios gravados, do mais antigo para o mais recente
+def carregar_relatorios(pagina=None):
+    if not os.path.exists(ARQUIVO_LOG):
+        return []
+    relatorios = []
+    with open(ARQUIVO_LOG, encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                relatorio = json.loads(linha)
+            except ValueError:
+                continue
+            if pagina is None or relatorio.get("pagina") == pagina:
+                relatorios.append(relatorio)
+    return relatorios
+
+
+def imprimir_relatorio(relatorios):
+    if not relatorios:
+        print("Nenhuma inicialização registrada.")
+        return
+
+    for relatorio in relatorios:
+        print(
+            f"{relatorio['data']}  {relatorio['pagina']}  (pid {relatorio['pid']})  "
+            f"importação {relatorio['total_importacao']:.2f}s  "
+            f"renderização {relatorio['total_renderizacao']:.2f}s"
+        )
+        for etapa in sorted(relatorio["etapas"], key=lambda e: e["segundos"], reverse=True):
+            print(f"    {etapa['tipo']:<13} {etapa['nome']:<40} {etapa['segundos']:>8.3f}s")
+
+    # Média por etapa para comparar com deploys anteriores
+    medias = {}
+    for relatorio in relatorios:
+        for etapa in relatorio["etapas"]:
+            medias.setdefault((etapa["tipo"], etapa["nome"]), []).append(etapa["segundos"])
+
+    print("\nMédia por etapa:")
+    for (tipo, nome), valores in sorted(medias.items(), key=lambda item: -sum(item[1]) / len(item[1])):
+        print(f"    {tipo:<13} {nome:<40} {sum(valores) / len(valores):>8.3f}s  ({len(valores)} amostras)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Relatório de tempo de inicialização do dashboard")
+    parser.add_argument("--ultimos", type=int, default=10, help="quantidade de inicializações exibidas")
+    parser.add_argument("--pagina", default=None, help="filtra por página")
+    args = parser.parse_args()
+
+    imprimir_relatorio(carregar_relatorios(args.pagina)[-args.ultimos:])
@@ -0,0 +1,588 @@
+# Recomenda índices para as consultas do dashboard a partir da carga de trabalho real.
+#
+# A carga vem do log de consultas gravado por banco_dados (KPIS_LOG_CONSULTAS). Cada
+# bloco SELECT é analisado para descobrir, por tabela, as colunas filtradas por
+# igualdade ou intervalo, os filtros fixos "IS NULL" (Exclusao/Cancelamento), os
+# agrupamentos e as colunas lidas. Daí saem índices de cobertura (INCLUDE) e
+# filtrados (WHERE) para Vendas, Vendas_Itens e Vendas_Receber.
+#
+# Com --comparar os índices são criados na base local de teste e cada consulta da
+# carga é medida antes e depois (tempo, custo estimado e operadores do plano).
+#
+# Exemplo:
+#     python gerar_base_teste.py --vendas 500000 --recriar
+#     KPIS_LOG_CONSULTAS=logs/consultas.jsonl python teste_carga.py --sessoes 2 --reruns 5
+#     python recomendar_indices.py --log logs/consultas.jsonl --comparar
+import json
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+
+import banco_dados
+import cache_kpis
+from gerar_base_teste import CONEXAO_TESTE, ESQUEMA
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+ARQUIVO_LOG = banco_dados.ARQUIVO_LOG_CONSULTAS or os.path.join(PASTA, "logs", "consultas.jsonl")
+PASTA_PLANOS = os.path.join(PASTA, "logs", "planos")
+
+# Tabelas para as quais são recomendados índices
+TABELAS = list(cache_kpis.TABELAS_MONITORADAS)
+
+# Prefixo dos índices criados pela ferramenta (usado também para removê-los)
+PREFIXO_INDICE = "IX_KPIS"
+
+NAMESPACE_PLANO = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+
+_PALAVRAS_CLAUSULA = re.compile(
+    r"\b(SELECT|FROM|JOIN|WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|ON|PARTITION\s+BY)\b", re.IGNORECASE
+)
+_REFERENCIA = re.compile(r"(?<![\w.@])(?:(\w+)\.)?(\w+)\b(?!\s*\()")
+
+
+# Remove comentários e literais de texto, deixando a consulta com "?" no lugar dos valores
+def normalizar(consulta_sql):
+    sem_comentarios = re.sub(r"--[^\n]*", " ", consulta_sql)
+    sem_literais = re.sub(r"N?'(?:[^']|'')*'", "?", sem_comentarios)
+    return re.sub(r"\s+", " ", sem_literais).strip().rstrip(";").strip()
+
+
+# Lê o log de consultas e agrupa as execuções pela forma normalizada da consulta
+def carregar_carga(caminho=ARQUIVO_LOG):
+    consultas = {}
+    with open(caminho, encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            if not linha.strip():
+                continue
+            registro = json.loads(linha)
+            forma = normalizar(registro["sql"])
+            consulta = consultas.setdefault(forma.lower(), {
+                "forma": forma,
+                "sql": registro["sql"],
+                "params": registro.get("params") or [],
+                "execucoes": 0,
+                "duracao_total_s": 0.0,
+            })
+            consulta["execucoes"] += 1
+            consulta["duracao_total_s"] += registro.get("duracao_s") or 0.0
+    return sorted(consultas.values(), key=lambda c: c["duracao_total_s"], reverse=True)
+
+
+# Colunas e chave do índice clusterizado de cada tabela, lidas do banco ou,
+# sem conexão, do esquema da base de teste
+def ler_esquema(dados_conexao=None):
+    esquema = {}
+    if dados_conexao is None:
+        for tabela in TABELAS:
+            ddl = ESQUEMA[tabela]
+            colunas = re.findall(r"^\s*(\w+)\s+(?:INT|NVARCHAR|DATETIME|DECIMAL)", ddl, re.MULTILINE)
+            chave = re.findall(r"^\s*(\w+)\s+\w+.*PRIMARY KEY", ddl, re.MULTILINE)
+            esquema[tabela] = {"colunas": colunas, "clusterizado": chave}
+        return esquema
+
+    import pyodbc
+    marcadores = ", ".join("?" for _ in TABELAS)
+    with pyodbc.connect(dados_conexao) as conexao:
+        colunas = conexao.execute(f"""
+            SELECT TABLE_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_NAME IN ({marcadores}) ORDER BY TABLE_NAME, ORDINAL_POSITION
+        """, *TABELAS).fetchall()
+        chaves = conexao.execute(f"""
+            SELECT t.name, c.name
+            FROM sys.indexes i
+            JOIN sys.tables t ON t.object_id = i.object_id
+            JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+            JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+            WHERE i.type = 1 AND t.name IN ({marcadores})
+            ORDER BY t.name, ic.key_ordinal
+        """, *TABELAS).fetchall()
+    for tabela in TABELAS:
+        esquema[tabela] = {
+            "colunas": [coluna for nome, coluna in colunas if nome.lower() == tabela.lower()],
+            "clusterizado": [coluna for nome, coluna in chaves if nome.lower() == tabela.lower()],
+        }
+    return esquema
+
+
+def _fechamento(texto, abertura):
+    profundidade = 0
+    for posicao in range(abertura, len(texto)):
+        if texto[posicao] == "(":
+            profundidade += 1
+        elif texto[posicao] == ")":
+            profundidade -= 1
+            if profundidade == 0:
+                return posicao
+    return len(texto) - 1
+
+
+# Separa a consulta em blocos SELECT independentes: CTEs e subconsultas viram
+# blocos próprios e cada parte de um UNION é um bloco
+def separar_blocos(forma):
+    blocos = []
+    texto = forma
+    while True:
+        encontrado = re.search(r"\(\s*SELECT\b", texto, re.IGNORECASE)
+        if not encontrado:
+            break
+        fim = _fechamento(texto, encontrado.start())
+        blocos.extend(separar_blocos(texto[encontrado.start() + 1:fim]))
+        texto = texto[:encontrado.start()] + " (subconsulta) " + texto[fim + 1:]
+    blocos.extend(parte for parte in re.split(r"\bUNION(?:\s+ALL)?\b", texto, flags=re.IGNORECASE)
+                  if re.search(r"\bSELECT\b", parte, re.IGNORECASE))
+    return blocos
+
+
+def _tabelas_do_bloco(bloco, esquema):
+    nomes = {tabela.lower(): tabela for tabela in esquema}
+    apelidos = {}
+    for tabela, apelido in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", bloco, re.IGNORECASE):
+        if tabela.lower() not in nomes:
+            continue
+        apelidos[tabela.lower()] = nomes[tabela.lower()]
+        if apelido and not _PALAVRAS_CLAUSULA.fullmatch(apelido) and apelido.upper() not in (
+                "LEFT", "RIGHT", "INNER", "OUTER", "CROSS", "FULL", "WITH"):
+            apelidos[apelido.lower()] = nomes[tabela.lower()]
+    return apelidos
+
+
+# Classifica o uso de uma coluna dentro do WHERE pelo operador que vem depois dela
+def _uso_no_filtro(segmento, inicio, fim):
+    antes, depois = segmento[:inicio], segmento[fim:]
+    envolvida = re.search(r"\w+\s*\(\s*(?:\w+\s*,\s*)?$", antes)
+    if envolvida:
+        fechamento = re.match(r"\s*(?:AS\s+\w+(?:\s*\([\d\s,]*\))?\s*)?\)", depois, re.IGNORECASE)
+        if fechamento:
+            depois = depois[fechamento.end():]
+    nulo = re.match(r"\s*IS\s+(NOT\s+)?NULL\b", depois, re.IGNORECASE)
+    if nulo:
+        return "IS NOT NULL" if nulo.group(1) else "IS NULL", False
+    if re.match(r"\s*(=|IN\s*\()", depois, re.IGNORECASE):
+        return "igualdade", bool(envolvida)
+    if re.match(r"\s*(BETWEEN\b|>=|<=|>|<(?!>))", depois, re.IGNORECASE):
+        return "intervalo", bool(envolvida)
+    return "outro", bool(envolvida)
+
+
+# Uso das colunas de cada tabela em um bloco SELECT
+def analisar_bloco(bloco, esquema):
+    apelidos = _tabelas_do_bloco(bloco, esquema)
+    if not apelidos:
+        return {}
+    tabelas_bloco = set(apelidos.values())
+    colunas = {
+        tabela: {coluna.lower(): coluna for coluna in esquema[tabela]["colunas"]}
+        for tabela in tabelas_bloco
+    }
+    usos = {
+        tabela: {"igualdade": [], "intervalo": [], "nulos": {}, "agrupamento": [], "saida": [], "nao_sargable": []}
+        for tabela in tabelas_bloco
+    }
+
+    marcas = list(_PALAVRAS_CLAUSULA.finditer(bloco))
+    for indice, marca in enumerate(marcas):
+        clausula = re.sub(r"\s+", " ", marca.group(1).upper())
+        if clausula in ("FROM", "JOIN"):
+            continue
+        segmento = bloco[marca.end():marcas[indice + 1].start() if indice + 1 < len(marcas) else len(bloco)]
+        for referencia in _REFERENCIA.finditer(segmento):
+            prefixo, nome = referencia.group(1), referencia.group(2).lower()
+            if prefixo:
+                candidatas = [apelidos[prefixo.lower()]] if prefixo.lower() in apelidos else []
+            else:
+                candidatas = sorted(tabelas_bloco)
+            for tabela in candidatas:
+                coluna = colunas[tabela].get(nome)
+                if coluna is None:
+                    continue
+                uso = usos[tabela]
+                if clausula == "WHERE":
+                    tipo, envolvida = _uso_no_filtro(segmento, referencia.start(), referencia.end())
+                    if envolvida:
+                        uso["nao_sargable"].append(coluna)
+                    if tipo in ("IS NULL", "IS NOT NULL"):
+                        uso["nulos"][coluna] = tipo
+                    elif tipo in ("igualdade", "intervalo"):
+                        uso[tipo].append(coluna)
+                    else:
+                        uso["saida"].append(coluna)
+                elif clausula == "GROUP BY":
+                    uso["agrupamento"].append(coluna)
+                else:
+                    uso["saida"].append(coluna)
+    return usos
+
+
+def _sem_repetir(colunas, excluir=()):
+    vistas = {coluna.lower() for coluna in excluir}
+    resultado = []
+    for coluna in colunas:
+        if coluna.lower() not in vistas:
+            vistas.add(coluna.lower())
+            resultado.append(coluna)
+    return resultado
+
+
+# Índice sugerido para o uso de uma tabela em um bloco (ou None se o índice
+# clusterizado já atende ou não há por onde buscar)
+def sugerir_indice(tabela, uso, esquema):
+    coluna_data = cache_kpis.TABELAS_MONITORADAS[tabela]["coluna_data"].lower()
+    clusterizado = esquema[tabela]["clusterizado"]
+
+    # Busca pela primeira coluna do índice clusterizado (ID_Venda > ?): ele já atende
+    if clusterizado and clusterizado[0].lower() in {c.lower() for c in uso["igualdade"] + uso["intervalo"]}:
+        return None
+
+    # Chave: colunas de igualdade, depois a coluna de data do período. Intervalos
+    # em outras colunas (valor_liquido > 0) ficam como predicado residual.
+    chave = sorted(_sem_repetir(uso["igualdade"]), key=str.lower)
+    chave += [coluna for coluna in _sem_repetir(uso["intervalo"]) if coluna.lower() == coluna_data]
+    if not chave:
+        # Sem filtro de busca: o índice ordenado pelo agrupamento evita a ordenação/hash
+        chave = _sem_repetir(uso["agrupamento"])
+    chave = _sem_repetir(chave)
+    if not chave or [c.lower() for c in chave] == [c.lower() for c in clusterizado[:len(chave)]]:
+        return None
+
+    # As colunas do filtro também entram no INCLUDE: sem elas o SQL Server pode
+    # fazer key lookup mesmo em índices filtrados por "IS NULL"
+    incluidas = _sem_repetir(
+        uso["agrupamento"] + uso["intervalo"] + uso["igualdade"] + uso["saida"] + list(uso["nulos"]),
+        excluir=chave + clusterizado,
+    )
+    ordem = {coluna.lower(): posicao for posicao, coluna in enumerate(esquema[tabela]["colunas"])}
+    filtro = tuple(sorted(uso["nulos"].items(), key=lambda item: ordem.get(item[0].lower(), 0)))
+    return {
+        "tabela": tabela,
+        "chave": tuple(chave),
+        "incluidas": sorted(incluidas, key=lambda coluna: ordem.get(coluna.lower(), 0)),
+        "filtro": filtro,
+    }
+
+
+# Junta as sugestões de mesma tabela e chave cujo filtro contém o de outra: o índice
+# menos restrito atende as duas consultas. Menos índices para o PDV manter a cada
+# venda, em troca de índices maiores.
+def consolidar(recomendacoes):
+    restantes = sorted(recomendacoes.values(), key=lambda r: len(r["filtro"]))
+    resultado = []
+    for recomendacao in restantes:
+        destino = next((
+            existente for existente in resultado
+            if existente["tabela"] == recomendacao["tabela"]
+            and [c.lower() for c in existente["chave"]] == [c.lower() for c in recomendacao["chave"]]
+            and set(existente["filtro"]) <= set(recomendacao["filtro"])
+        ), None)
+        if destino is None:
+            resultado.append(recomendacao)
+            continue
+        filtro = [coluna for coluna, _ in recomendacao["filtro"]]
+        destino["incluidas"] = _sem_repetir(destino["incluidas"] + recomendacao["incluidas"] + filtro,
+                                            excluir=destino["chave"])
+        destino["execucoes"] += recomendacao["execucoes"]
+        destino["consultas"] |= recomendacao["consultas"]
+    return {(r["tabela"], tuple(c.lower() for c in r["chave"]), r["filtro"]): r for r in resultado}
+
+
+# Analisa a carga e junta as sugestões de mesma tabela, chave e filtro
+def recomendar(consultas, esquema, juntar_filtros=False):
+    recomendacoes = {}
+    avisos = []
+    for numero, consulta in enumerate(consultas, 1):
+        consulta["numero"] = numero
+        for bloco in separar_blocos(consulta["forma"]):
+            for tabela, uso in analisar_bloco(bloco, esquema).items():
+                coluna_data = cache_kpis.TABELAS_MONITORADAS[tabela]["coluna_data"].lower()
+                for coluna in _sem_repetir(uso["nao_sargable"]):
+                    if coluna.lower() == coluna_data or coluna in uso["igualdade"]:
+                        avisos.append(f"Consulta {numero}: {tabela}.{coluna} está dentro de uma função no WHERE "
+                                      f"e impede a busca pelo índice; compare a coluna diretamente.")
+                sugestao = sugerir_indice(tabela, uso, esquema)
+                if sugestao is None:
+                    continue
+                chave = (tabela, tuple(c.lower() for c in sugestao["chave"]), sugestao["filtro"])
+                atual = recomendacoes.setdefault(chave, dict(sugestao, incluidas=[], consultas=set(), execucoes=0))
+                atual["incluidas"] = _sem_repetir(atual["incluidas"] + sugestao["incluidas"])
+                if numero not in atual["consultas"]:
+                    atual["consultas"].add(numero)
+                    atual["execucoes"] += consulta["execucoes"]
+
+    if juntar_filtros:
+        recomendacoes = consolidar(recomendacoes)
+
+    ordem = {
+        tabela: {coluna.lower(): posicao for posicao, coluna in enumerate(esquema[tabela]["colunas"])}
+        for tabela in esquema
+    }
+    nomes = set()
+    resultado = sorted(recomendacoes.values(), key=lambda r: (r["tabela"], -r["execucoes"]))
+    for recomendacao in resultado:
+        recomendacao["incluidas"].sort(key=lambda coluna: ordem[recomendacao["tabela"]].get(coluna.lower(), 0))
+        nome = f"{PREFIXO_INDICE}_{recomendacao['tabela']}_{'_'.join(recomendacao['chave'])}"
+        if recomendacao["filtro"]:
+            nome += "_F"
+        base, sufixo = nome, 2
+        while nome.lower() in nomes:
+            nome, sufixo = f"{base}_{sufixo}", sufixo + 1
+        nomes.add(nome.lower())
+        recomendacao["nome"] = nome
+        recomendacao["ddl"] = gerar_ddl(recomendacao)
+    return resultado, _sem_repetir(avisos)
+
+
+def gerar_ddl(recomendacao):
+    linhas = [
+        f"CREATE NONCLUSTERED INDEX {recomendacao['nome']}",
+        f"    ON {recomendacao['tabela']} ({', '.join(recomendacao['chave'])})",
+    ]
+    if recomendacao["incluidas"]:
+        linhas.append(f"    INCLUDE ({', '.join(recomendacao['incluidas'])})")
+    if recomendacao["filtro"]:
+        linhas.append("    WHERE " + " AND ".join(f"{coluna} {tipo}" for coluna, tipo in recomendacao["filtro"]))
+    return "\n".join(linhas) + ";"
+
+
+def _normalizar_filtro(texto):
+    if not texto:
+        return frozenset()
+    texto = re.sub(r"[\[\]()]", "", texto).lower()
+    return frozenset(re.sub(r"\s+", " ", parte).strip() for parte in re.split(r"\band\b", texto))
+
+
+# Índices não clusterizados que já existem nas tabelas
+def ler_indices_existentes(dados_conexao):
+    import pyodbc
+    marcadores = ", ".join("?" for _ in TABELAS)
+    with pyodbc.connect(dados_conexao) as conexao:
+        linhas = conexao.execute(f"""
+            SELECT t.name, i.name, i.filter_definition, c.name, ic.key_ordinal, ic.is_included_column
+            FROM sys.indexes i
+            JOIN sys.tables t ON t.object_id = i.object_id
+            JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+            JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+            WHERE i.type = 2 AND t.name IN ({marcadores})
+            ORDER BY t.name, i.name, ic.key_ordinal
+        """, *TABELAS).fetchall()
+    indices = {}
+    for tabela, nome, filtro, coluna, ordem_chave, incluida in linhas:
+        indice = indices.setdefault((tabela, nome), {
+            "tabela": tabela, "nome": nome, "filtro": _normalizar_filtro(filtro), "chave": [], "incluidas": [],
+        })
+        if incluida:
+            indice["incluidas"].append(coluna)
+        elif ordem_chave:
+            indice["chave"].append(coluna)
+    return list(indices.values())
+
+
+# Nome do índice existente que já atende a recomendação (mesma chave inicial,
+# colunas cobertas e filtro igual ou ausente), ou None
+def indice_equivalente(recomendacao, existentes, esquema):
+    chave = [coluna.lower() for coluna in recomendacao["chave"]]
+    filtro = _normalizar_filtro(" AND ".join(f"{c} {t}" for c, t in recomendacao["filtro"]))
+    for indice in existentes:
+        if indice["tabela"].lower() != recomendacao["tabela"].lower():
+            continue
+        colunas = {c.lower() for c in indice["chave"] + indice["incluidas"] + esquema[recomendacao["tabela"]]["clusterizado"]}
+        if ([c.lower() for c in indice["chave"][:len(chave)]] == chave
+                and {c.lower() for c in recomendacao["incluidas"]} <= colunas
+                and indice["filtro"] in (filtro, frozenset())):
+            return indice["nome"]
+    return None
+
+
+# Sugestões das DMVs de índices ausentes do próprio SQL Server (requer VIEW SERVER STATE)
+def ler_indices_ausentes(dados_conexao):
+    import pyodbc
+    with pyodbc.connect(dados_conexao) as conexao:
+        return conexao.execute("""
+            SELECT TOP 20
+                OBJECT_NAME(d.object_id, d.database_id) AS tabela,
+                d.equality_columns, d.inequality_columns, d.included_columns,
+                s.user_seeks, s.avg_user_impact,
+                s.user_seeks * s.avg_total_user_cost * s.avg_user_impact / 100.0 AS ganho_estimado
+            FROM sys.dm_db_missing_index_details d
+            JOIN sys.dm_db_missing_index_groups g ON g.index_handle = d.index_handle
+            JOIN sys.dm_db_missing_index_group_stats s ON s.group_handle = g.index_group_handle
+            WHERE d.database_id = DB_ID()
+            ORDER BY ganho_estimado DESC
+        """).fetchall()
+
+
+# Os parâmetros são incorporados como literais para que o plano estimado
+# (SHOWPLAN_XML) e a execução usem exatamente o mesmo texto
+def _incorporar_parametros(consulta_sql, params):
+    partes = consulta_sql.split("?")
+    if not params or len(partes) != len(params) + 1:
+        return consulta_sql
+    texto = partes[0]
+    for valor, parte in zip(params, partes[1:]):
+        literal = "NULL" if valor is None else "N'" + str(valor).replace("'", "''") + "'"
+        texto += literal + parte
+    return texto
+
+
+def resumir_plano(plano_xml):
+    raiz = ET.fromstring(plano_xml)
+    custo = sum(float(instrucao.get("StatementSubTreeCost", 0))
+                for instrucao in raiz.iter(f"{NAMESPACE_PLANO}StmtSimple"))
+    acessos = []
+    for operador in raiz.iter(f"{NAMESPACE_PLANO}RelOp"):
+        fisico = operador.get("PhysicalOp", "")
+        if not any(tipo in fisico for tipo in ("Scan", "Seek", "Lookup")):
+            continue
+        objeto = operador.find(f"./*/{NAMESPACE_PLANO}Object")
+        if objeto is None:
+            continue
+        tabela = (objeto.get("Table") or "").strip("[]")
+        indice = (objeto.get("Index") or "").strip("[]")
+        if tabela.lower() in (t.lower() for t in TABELAS):
+            acessos.append(f"{fisico}({tabela}.{indice})" if indice else f"{fisico}({tabela})")
+    return custo, acessos
+
+
+# Mede cada consulta da carga: plano estimado, custo e melhor tempo de execução
+def medir_carga(dados_conexao, consultas, repeticoes=3, rotulo="antes"):
+    import pyodbc
+    os.makedirs(PASTA_PLANOS, exist_ok=True)
+    medicoes = {}
+    with pyodbc.connect(dados_conexao, autocommit=True) as conexao:
+        cursor = conexao.cursor()
+        for consulta in consultas:
+            consulta_sql = _incorporar_parametros(consulta["sql"], consulta["params"])
+            try:
+                cursor.execute("SET SHOWPLAN_XML ON")
+                plano_xml = cursor.execute(consulta_sql).fetchone()[0]
+            finally:
+                cursor.execute("SET SHOWPLAN_XML OFF")
+            with open(os.path.join(PASTA_PLANOS, f"{rotulo}_{consulta['numero']:02d}.sqlplan"), "w",
+                      encoding="utf-8") as arquivo:
+                arquivo.write(plano_xml)
+            custo, acessos = resumir_plano(plano_xml)
+
+            # Uma execução de aquecimento e depois o melhor de N
+            cursor.execute(consulta_sql).fetchall()
+            tempos = []
+            for _ in range(repeticoes):
+                inicio = time.perf_counter()
+                cursor.execute(consulta_sql).fetchall()
+                tempos.append(time.perf_counter() - inicio)
+            medicoes[consulta["numero"]] = {"tempo_s": min(tempos), "custo": custo, "acessos": acessos}
+    return medicoes
+
+
+def criar_indices(dados_conexao, recomendacoes):
+    import pyodbc
+    with pyodbc.connect(dados_conexao, autocommit=True) as conexao:
+        for recomendacao in recomendacoes:
+            inicio = time.perf_counter()
+            conexao.execute(recomendacao["ddl"])
+            print(f"Criado {recomendacao['nome']} em {time.perf_counter() - inicio:.1f}s")
+
+
+def remover_indices(dados_conexao, recomendacoes):
+    import pyodbc
+    with pyodbc.connect(dados_conexao, autocommit=True) as conexao:
+        for recomendacao in recomendacoes:
+            conexao.execute(f"DROP INDEX IF EXISTS {recomendacao['nome']} ON {recomendacao['tabela']}")
+
+
+# Cria os índices recomendados na base de teste e compara a carga antes e depois
+def comparar(dados_conexao, consultas, recomendacoes, repeticoes=3, manter=False):
+    if dados_conexao == banco_dados.DADOS_CONEXAO:
+        raise ValueError("A comparação cria e apaga índices: use a base de teste, não a conexão do dashboard.")
+    remover_indices(dados_conexao, recomendacoes)
+    antes = medir_carga(dados_conexao, consultas, repeticoes, "antes")
+    criar_indices(dados_conexao, recomendacoes)
+    try:
+        depois = medir_carga(dados_conexao, consultas, repeticoes, "depois")
+    finally:
+        if not manter:
+            remover_indices(dados_conexao, recomendacoes)
+    return antes, depois
+
+
+def imprimir_relatorio(consultas, recomendacoes, avisos, equivalentes=None, ausentes=None):
+    equivalentes = equivalentes or {}
+    total = sum(consulta["execucoes"] for consulta in consultas)
+    print(f"Carga de trabalho: {len(consultas)} consultas distintas, {total} execuções\n")
+    for consulta in consultas:
+        print(f"  [{consulta['numero']:>2}] {consulta['execucoes']:>5}x  {consulta['duracao_total_s']:>8.2f}s  "
+              f"{consulta['forma'][:90]}")
+
+    if avisos:
+        print("\nAvisos:")
+        for aviso in avisos:
+            print(f"  - {aviso}")
+
+    print("\nÍndices recomendados:")
+    for recomendacao in recomendacoes:
+        consultas_atendidas = ", ".join(str(numero) for numero in sorted(recomendacao["consultas"]))
+        existente = equivalentes.get(recomendacao["nome"])
+        situacao = f" (já atendido por {existente})" if existente else ""
+        print(f"\n-- consultas {consultas_atendidas}; {recomendacao['execucoes']} execuções{situacao}")
+        print(recomendacao["ddl"])
+
+    if ausentes:
+        print("\nÍndices ausentes apontados pelo SQL Server (DMVs):")
+        for tabela, igualdade, desigualdade, incluidas, buscas, impacto, ganho in ausentes:
+            print(f"  {tabela}: igualdade={igualdade} desigualdade={desigualdade} include={incluidas} "
+                  f"buscas={buscas} impacto={impacto:.0f}% ganho={ganho:,.0f}")
+
+
+def imprimir_comparacao(consultas, antes, depois):
+    print(f"\n{'consulta':>8} {'tempo antes':>12} {'depois':>9} {'custo antes':>12} {'depois':>9}  acessos")
+    for consulta in consultas:
+        numero = consulta["numero"]
+        a, d = antes[numero], depois[numero]
+        print(f"{numero:>8} {a['tempo_s']:>11.3f}s {d['tempo_s']:>8.3f}s {a['custo']:>12.2f} {d['custo']:>9.2f}  "
+              f"{', '.join(a['acessos'])} -> {', '.join(d['acessos'])}")
+    print(f"\nTempo total: {sum(m['tempo_s'] for m in antes.values()):.3f}s -> "
+          f"{sum(m['tempo_s'] for m in depois.values()):.3f}s. Planos gravados em {PASTA_PLANOS}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Recomenda índices a partir do log de consultas do dashboard")
+    parser.add_argument("--log", default=ARQUIVO_LOG, help="log de consultas (KPIS_LOG_CONSULTAS)")
+    parser.add_argument("--conexao", default=CONEXAO_TESTE, help="string de conexão ODBC (padrão: base de teste)")
+    parser.add_argument("--sem-conexao", action="store_true",
+                        help="analisa apenas o log, com o esquema da base de teste")
+    parser.add_argument("--consolidar", action="store_true",
+                        help="junta índices de mesma chave quando o filtro de um contém o do outro")
+    parser.add_argument("--dmv", action="store_true", help="mostra também as DMVs de índices ausentes")
+    parser.add_argument("--comparar", action="store_true",
+                        help="cria os índices na base de teste e mede a carga antes e depois")
+    parser.add_argument("--manter", action="store_true", help="mantém os índices criados pela comparação")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--saida", default=None, help="grava o script com os CREATE INDEX neste arquivo")
+    args = parser.parse_args()
+
+    dados_conexao = None if args.sem_conexao else args.conexao
+    consultas = carregar_carga(args.log)
+    esquema = ler_esquema(dados_conexao)
+    recomendacoes, avisos = recomendar(consultas, esquema, args.consolidar)
+
+    equivalentes = {}
+    ausentes = None
+    if dados_conexao:
+        existentes = [indice for indice in ler_indices_existentes(dados_conexao)
+                      if not indice["nome"].startswith(PREFIXO_INDICE)]
+        for recomendacao in recomendacoes:
+            equivalentes[recomendacao["nome"]] = indice_equivalente(recomendacao, existentes, esquema)
+        if args.dmv:
+            try:
+                ausentes = ler_indices_ausentes(dados_conexao)
+            except Exception as e:
+                print(f"Não foi possível ler as DMVs de índices ausentes: {e}")
+    imprimir_relatorio(consultas, recomendacoes, avisos, equivalentes, ausentes)
+
+    novas = [recomendacao for recomendacao in recomendacoes if not equivalentes.get(recomendacao["nome"])]
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write("\n\n".join(recomendacao["ddl"] for recomendacao in novas) + "\n")
+    if args.comparar and dados_conexao and novas:
+        antes, depois = comparar(dados_conexao, consultas, novas, args.repeticoes, args.manter)
+        imprimir_comparacao(consultas, antes, depois)
@@ -0,0 +1,114 @@
+# Testa o roteamento das leituras para a réplica com duas bases locais.
+#
+# Cria (ou reaproveita) duas bases de teste com as mesmas vendas, uma no papel de
+# primário e outra no de réplica, grava vendas novas só no primário para simular o
+# atraso da replicação e acompanha a decisão de banco_dados: réplica em uso, atraso
+# medido pela marca d'água, volta ao primário quando o atraso passa do limite,
+# retorno à réplica depois que ela alcança o primário e fallback quando a réplica
+# não responde. As leituras usam o isolamento SNAPSHOT, liberado no primário.
+#
+# Exemplo:
+#     python testar_replica.py --vendas 20000 --recriar
+#     python testar_replica.py --replica "Driver=...;Database=kpis_teste_replica;..." --atraso-maximo 5
+import re
+import time
+
+import banco_dados
+from gerar_base_teste import CONEXAO_TESTE, gerar_dados, inserir, popular
+
+# Banco que respondeu e nível de isolamento da sessão (5 = SNAPSHOT)
+CONSULTA_ORIGEM = """
+SELECT DB_NAME() AS banco,
+       (SELECT transaction_isolation_level FROM sys.dm_exec_sessions WHERE session_id = @@SPID) AS isolamento
+"""
+
+
+def _nome_banco(dados_conexao):
+    return re.search(r"(?:Database|Initial Catalog)\s*=\s*([^;]+)", dados_conexao, re.IGNORECASE).group(1).strip()
+
+
+def _com_banco(dados_conexao, nome):
+    return re.sub(r"(Database|Initial Catalog)\s*=\s*[^;]+", f"Database={nome}", dados_conexao, flags=re.IGNORECASE)
+
+
+def _executar(dados_conexao, comando, autocommit=False):
+    import pyodbc
+    with pyodbc.connect(dados_conexao, autocommit=autocommit) as conexao:
+        conexao.execute(comando)
+        if not autocommit:
+            conexao.commit()
+
+
+def permitir_snapshot(dados_conexao):
+    _executar(dados_conexao, "DECLARE @sql NVARCHAR(200) = N'ALTER DATABASE ' + QUOTENAME(DB_NAME()) "
+                             "+ N' SET ALLOW_SNAPSHOT_ISOLATION ON'; EXEC (@sql)", autocommit=True)
+
+
+def mostrar(etapa, primario, esperado):
+    origem = banco_dados.executar_consulta(CONSULTA_ORIGEM, None, primario).iloc[0]
+    estado = banco_dados.estado_replica(primario)
+    atraso = "-" if estado.atraso_s is None else f"{estado.atraso_s:.1f}s"
+    resultado = "ok" if origem["banco"] == esperado else f"FALHOU (esperado {esperado})"
+    print(f"{etapa:<32} banco={origem['banco']:<22} isolamento={origem['isolamento']} "
+          f"atraso={atraso:<7} pendentes={estado.vendas_pendentes} {resultado}"
+          + (f"\n{'':<33}erro: {estado.erro[:100]}" if estado.erro else ""))
+    return origem["banco"] == esperado
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Testa a réplica de leitura com duas bases locais")
+    parser.add_argument("--primario", default=CONEXAO_TESTE, help="string de conexão da base no papel de primário")
+    parser.add_argument("--replica", default=None,
+                        help="string de conexão da réplica (padrão: a do primário com Database=<banco>_replica)")
+    parser.add_argument("--vendas", type=int, default=20_000)
+    parser.add_argument("--pendentes", type=int, default=500, help="vendas gravadas só no primário")
+    parser.add_argument("--atraso-maximo", type=float, default=3.0)
+    parser.add_argument("--intervalo", type=float, default=1.0, help="intervalo entre as verificações do atraso")
+    parser.add_argument("--recriar", action="store_true", help="recria as duas bases com as mesmas vendas")
+    args = parser.parse_args()
+
+    nome_primario = _nome_banco(args.primario)
+    replica = args.replica or _com_banco(args.primario, f"{nome_primario}_replica")
+    nome_replica = _nome_banco(replica)
+
+    if args.recriar:
+        for dados_conexao in (args.primario, replica):
+            popular(dados_conexao, recriar=True, vendas=args.vendas, clientes=max(args.vendas // 10, 100))
+    permitir_snapshot(args.primario)
+
+    banco_dados.ISOLAMENTO_SNAPSHOT = True
+    banco_dados.ATRASO_MAXIMO_REPLICA = args.atraso_maximo
+    banco_dados.INTERVALO_VERIFICACAO_REPLICA = args.intervalo
+    banco_dados.registrar_replica(args.primario, replica)
+
+    maior_id = int(banco_dados.executar_consulta(banco_dados.CONSULTA_MARCA_REPLICA, None, args.primario)
+                   .iloc[0]["max_id"])
+    novas = gerar_dados(vendas=args.pendentes, clientes=100, semente=7)["Vendas"]
+    novas["ID_Venda"] += maior_id
+
+    resultados = []
+    try:
+        resultados.append(mostrar("réplica em dia", args.primario, nome_replica))
+
+        inserir(args.primario, "Vendas", novas)
+        time.sleep(args.intervalo)
+        resultados.append(mostrar("vendas novas só no primário", args.primario, nome_replica))
+
+        limite = time.monotonic() + args.atraso_maximo + 3 * args.intervalo
+        while banco_dados.estado_replica(args.primario).em_uso and time.monotonic() < limite:
+            time.sleep(args.intervalo / 2)
+        resultados.append(mostrar("atraso acima do limite", args.primario, nome_primario))
+
+        inserir(replica, "Vendas", novas)
+        time.sleep(args.intervalo)
+        resultados.append(mostrar("réplica alcançou o primário", args.primario, nome_replica))
+
+        banco_dados.registrar_replica(args.primario, _com_banco(replica, "kpis_banco_inexistente"))
+        resultados.append(mostrar("réplica sem resposta", args.primario, nome_primario))
+    finally:
+        for dados_conexao in (args.primario, replica):
+            _executar(dados_conexao, f"DELETE FROM Vendas WHERE ID_Venda > {maior_id}")
+
+    print("Roteamento conforme o esperado." if all(resultados) else "Há etapas com roteamento inesperado.")
@@ -0,0 +1,305 @@
+# Teste de carga com sessões simultâneas nas duas páginas do dashboard.
+#
+# Cada sessão simulada roda a página inteira no próprio processo (como o servidor
+# do Streamlit faria), alterando o período no slider da Análise de Vendas e o
+# número de clusters e o filtro de clusters da Segmentação. No fim mostra os
+# percentis de latência por rerun, a quantidade de consultas ao banco por rerun,
+# as conexões abertas no servidor e a memória (RSS) do processo.
+#
+# Deve rodar contra a base local de teste (gerar_base_teste.py):
+#     python teste_carga.py --sessoes 20 --reruns 10
+#     python teste_carga.py --sessoes 50 --pagina analise --json resultado.json
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import timedelta
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+PAGINAS = {
+    "analise": os.path.join(PASTA, "Análise_de_Vendas.py"),
+    "segmentacao": os.path.join(PASTA, "Pages", "Segmentação_e_Marketing.py"),
+}
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    posicao = (len(ordenados) - 1) * p / 100
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicao - inferior)
+
+
+# Rerun que fez a consulta. É definido na thread do ScriptRunner e chega às
+# threads das lojas (lojas.executar roda cada loja em uma cópia do contexto).
+_rerun_atual = contextvars.ContextVar("rerun_atual", default=None)
+
+
+# Contagem das consultas por rerun, inclusive as feitas nas threads das lojas
+class ContadorConsultas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_rerun = {}
+
+    def instrumentar(self, modulo, nomes):
+        for nome in nomes:
+            original = getattr(modulo, nome)
+
+            def contado(*args, _original=original, **kwargs):
+                rerun = _rerun_atual.get()
+                if rerun is not None:
+                    with self._lock:
+                        self._por_rerun[rerun] = self._por_rerun.get(rerun, 0) + 1
+                return _original(*args, **kwargs)
+
+            setattr(modulo, nome, contado)
+
+    def retirar(self, rerun):
+        with self._lock:
+            return self._por_rerun.pop(rerun, 0)
+
+
+# Amostra periodicamente a memória do processo e as conexões abertas no servidor
+class Monitor(threading.Thread):
+    def __init__(self, dados_conexao, intervalo=0.5):
+        super().__init__(daemon=True)
+        self.dados_conexao = dados_conexao
+        self.intervalo = intervalo
+        self.rss = []
+        self.conexoes = []
+        self._parar = threading.Event()
+
+    def _conexoes_abertas(self):
+        import pyodbc
+        try:
+            with pyodbc.connect(self.dados_conexao, autocommit=True) as conexao:
+                # Sessões deste processo no servidor, descontando a do próprio monitor
+                return conexao.execute(
+                    "SELECT COUNT(*) FROM sys.dm_exec_sessions WHERE host_process_id = ?", os.getpid()
+                ).fetchval() - 1
+        except Exception:
+            return None
+
+    def run(self):
+        import psutil
+        processo = psutil.Process()
+        while not self._parar.is_set():
+            self.rss.append(processo.memory_info().rss)
+            conexoes = self._conexoes_abertas()
+            if conexoes is not None:
+                self.conexoes.append(conexoes)
+            self._parar.wait(self.intervalo)
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+def criar_classe_sessao():
+    from streamlit.runtime.pages_manager import PagesManager
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    # O ScriptRunner de cada rerun marca a própria thread com ele mesmo em _rerun_atual
+    class ScriptRunnerContado(LocalScriptRunner):
+        def _run_script_thread(self):
+            _rerun_atual.set(self)
+            super()._run_script_thread()
+
+    # O AppTest cria e apaga um Runtime global a cada execução, o que quebra
+    # sessões simultâneas; aqui o Runtime é criado uma vez (em preparar_runtime)
+    # e cada sessão só executa o script e guarda as métricas do rerun
+    class SessaoSimulada(AppTest):
+        contador = None
+
+        def _run(self, widget_state=None, timeout=None):
+            script_runner = ScriptRunnerContado(
+                self._script_path,
+                self.session_state,
+                PagesManager(self._script_path, setup_watcher=False),
+                args=self.args,
+                kwargs=self.kwargs,
+            )
+            inicio = time.perf_counter()
+            self._tree = script_runner.run(
+                widget_state, self.query_params, timeout or self.default_timeout, self._page_hash
+            )
+            script_runner.join()
+            self.ultima_latencia = time.perf_counter() - inicio
+            self.ultimas_consultas = self.contador.retirar(script_runner)
+            self._tree._runner = self
+            return self
+
+    return SessaoSimulada
+
+
+def preparar_runtime():
+    from unittest.mock import MagicMock
+
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+
+
+# Alterações de widgets feitas por uma sessão em cada rerun
+def interagir_analise(sessao, sorteio):
+    slider = sessao.slider[0]
+    # Na primeira execução o slider mostra o período completo da base
+    if not hasattr(sessao, "periodo_completo"):
+        sessao.periodo_completo = tuple(slider.value)
+    menor, maior = sessao.periodo_completo
+    dias = (maior - menor).days
+    inicio = menor + timedelta(days=sorteio.randint(0, max(dias - 1, 0)))
+    fim = inicio + timedelta(days=sorteio.randint(0, max((maior - inicio).days, 0)))
+    slider.set_value((inicio, fim))
+
+
+def interagir_segmentacao(sessao, sorteio):
+    acao = sorteio.choice(["clusters", "filtro"])
+    if acao == "clusters" or not sessao.multiselect:
+        sessao.slider[0].set_value(sorteio.randint(2, 10))
+    else:
+        filtro = sessao.multiselect[0]
+        opcoes = list(filtro.options)
+        filtro.set_value(sorteio.sample(opcoes, sorteio.randint(1, len(opcoes))))
+
+
+INTERACOES = {"analise": interagir_analise, "segmentacao": interagir_segmentacao}
+
+
+def executar_sessao(classe_sessao, pagina, reruns, semente, resultados, timeout):
+    sorteio = random.Random(semente)
+    sessao = classe_sessao(PAGINAS[pagina], default_timeout=timeout)
+    registros = []
+    try:
+        sessao.run()
+        registros.append((sessao.ultima_latencia, sessao.ultimas_consultas, "inicial", len(sessao.exception)))
+        for _ in range(reruns):
+            INTERACOES[pagina](sessao, sorteio)
+            sessao.run()
+            registros.append((sessao.ultima_latencia, sessao.ultimas_consultas, "rerun", len(sessao.exception)))
+    except Exception as e:
+        registros.append((None, 0, f"falha: {e}", 1))
+    resultados.append((pagina, registros))
+
+
+def resumir(resultados, monitor, duracao):
+    resumo = {"duracao_s": round(duracao, 2), "paginas": {}}
+    for pagina in sorted({pagina for pagina, _ in resultados}):
+        registros = [r for p, regs in resultados if p == pagina for r in regs]
+        latencias = [r[0] for r in registros if r[0] is not None and r[2] == "rerun"]
+        iniciais = [r[0] for r in registros if r[0] is not None and r[2] == "inicial"]
+        consultas = [r[1] for r in registros if r[2] == "rerun"]
+        resumo["paginas"][pagina] = {
+            "reruns": len(latencias),
+            "erros": sum(r[3] for r in registros),
+            "primeira_execucao_p50_s": round(percentil(iniciais, 50), 3),
+            "latencia_p50_s": round(percentil(latencias, 50), 3),
+            "latencia_p95_s": round(percentil(latencias, 95), 3),
+            "latencia_p99_s": round(percentil(latencias, 99), 3),
+            "consultas_por_rerun_media": round(sum(consultas) / len(consultas), 2) if consultas else 0,
+            "consultas_por_rerun_p95": round(percentil(consultas, 95), 1),
+        }
+    resumo["conexoes_abertas_max"] = max(monitor.conexoes) if monitor.conexoes else None
+    resumo["rss_inicial_mb"] = round(monitor.rss[0] / 2 ** 20, 1) if monitor.rss else None
+    resumo["rss_max_mb"] = round(max(monitor.rss) / 2 ** 20, 1) if monitor.rss else None
+    # Execuções economizadas pela coalescência de consultas idênticas entre sessões
+    import cache_kpis
+    metricas = cache_kpis.metricas()
+    resumo["cache"] = {
+        "execucoes": metricas["execucoes"],
+        "coalescidas": metricas["coalescidas"],
+        "acertos_cache": metricas["acertos_cache"],
+        "espera_coalescidas_s": round(metricas["espera_s"], 2),
+    }
+    return resumo
+
+
+def imprimir_resumo(resumo, sessoes):
+    print(f"\n{sessoes} sessões simultâneas, duração {resumo['duracao_s']}s")
+    for pagina, dados in resumo["paginas"].items():
+        print(f"\n[{pagina}] {dados['reruns']} reruns, {dados['erros']} erros")
+        print(f"    primeira execução p50: {dados['primeira_execucao_p50_s']:.3f}s")
+        print(f"    latência por rerun   p50: {dados['latencia_p50_s']:.3f}s  "
+              f"p95: {dados['latencia_p95_s']:.3f}s  p99: {dados['latencia_p99_s']:.3f}s")
+        print(f"    consultas por rerun  média: {dados['consultas_por_rerun_media']}  "
+              f"p95: {dados['consultas_por_rerun_p95']}")
+    print(f"\nConexões abertas no servidor (máx.): {resumo['conexoes_abertas_max']}")
+    print(f"Memória do processo (RSS): inicial {resumo['rss_inicial_mb']} MB, máx. {resumo['rss_max_mb']} MB")
+    cache = resumo["cache"]
+    print(f"Cache das KPIs: {cache['execucoes']} execuções, {cache['acertos_cache']} acertos, "
+          f"{cache['coalescidas']} pedidos atendidos por consulta já em andamento "
+          f"(execuções economizadas; espera total {cache['espera_coalescidas_s']}s)")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Teste de carga do dashboard com sessões simultâneas")
+    parser.add_argument("--conexao", default=None, help="string de conexão ODBC (padrão: base local de teste)")
+    parser.add_argument("--sessoes", type=int, default=10, help="sessões simultâneas")
+    parser.add_argument("--reruns", type=int, default=10, help="interações (reruns) por sessão")
+    parser.add_argument("--pagina", choices=["analise", "segmentacao", "ambas"], default="ambas")
+    parser.add_argument("--timeout", type=float, default=120, help="tempo máximo de um rerun (s)")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--json", default=None, help="grava o resumo neste arquivo")
+    args = parser.parse_args()
+
+    # A conexão precisa estar no ambiente antes de as páginas importarem banco_dados
+    sys.path.insert(0, PASTA)
+    if args.conexao:
+        os.environ["KPIS_DADOS_CONEXAO"] = args.conexao
+    else:
+        from gerar_base_teste import CONEXAO_TESTE
+        os.environ["KPIS_DADOS_CONEXAO"] = CONEXAO_TESTE
+
+    import banco_dados
+    from streamlit.testing.v1.util import patch_config_options
+
+    contador = ContadorConsultas()
+    contador.instrumentar(banco_dados, ["executar_consulta", "executar_em_lotes"])
+    classe_sessao = criar_classe_sessao()
+    classe_sessao.contador = contador
+    preparar_runtime()
+
+    paginas = ["analise", "segmentacao"] if args.pagina == "ambas" else [args.pagina]
+    monitor = Monitor(banco_dados.DADOS_CONEXAO)
+    monitor.start()
+
+    resultados = []
+    threads = [
+        threading.Thread(
+            target=executar_sessao,
+            args=(classe_sessao, paginas[i % len(paginas)], args.reruns, args.semente + i, resultados, args.timeout),
+        )
+        for i in range(args.sessoes)
+    ]
+    inicio = time.perf_counter()
+    with patch_config_options({"global.appTest": True}):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    duracao = time.perf_counter() - inicio
+    monitor.parar()
+
+    resumo = resumir(resultados, monitor, duracao)
+    imprimir_resumo(resumo, args.sessoes)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as arquivo:
+            json.dump(resumo, arquivo, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import pandas as pd
+
+import agregacao_lotes
+from features_clientes import reduzir_parciais
+
+
+def _vendas():
+    return pd.DataFrame({
+        "ID_Venda": [1, 2, 3, 4, 5, 6, 7],
+        "ID_Cliente": [10, 20, 10, None, 20, 10, 30],
+        "Nome": ["ana", "Bruno", "Ana Maria", "sem cliente", "bruno", "ANA", "Carla"],
+        "Valor_Liquido": [10.0, 5.0, 2.5, 99.0, 1.0, 0.5, 7.0],
+        "Data_cx": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-05", "2024-01-06",
+                                   "2024-01-03", "2024-02-01", "2024-01-04"]),
+    })
+
+
+def test_agregar_vendas():
+    parciais = agregacao_lotes.agregar_vendas(_vendas()).sort_index()
+    # A venda sem cliente não entra; o nome é o da venda de maior ID
+    assert parciais.index.tolist() == [10, 20, 30]
+    assert parciais["Nome"].tolist() == ["ANA", "bruno", "Carla"]
+    assert parciais["FREQUENCIA_COMPRA"].tolist() == [3, 2, 1]
+    assert parciais["VALOR_GASTO"].tolist() == [13.0, 6.0, 7.0]
+    assert parciais["PRIMEIRA_COMPRA"].tolist() == list(pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-04"]))
+    assert parciais["ULTIMA_COMPRA"].tolist() == list(pd.to_datetime(["2024-02-01", "2024-01-03", "2024-01-04"]))
+    assert parciais["ULTIMO_ID_VENDA"].tolist() == [6, 5, 7]
+
+
+def test_agregar_em_lotes_igual_ao_groupby():
+    vendas = _vendas()
+    for tamanho in (1, 2, 3, len(vendas)):
+        lotes = [vendas.iloc[i:i + tamanho] for i in range(0, len(vendas), tamanho)]
+        assert agregacao_lotes.verificar(agregacao_lotes.agregar(lotes), vendas) == []
+
+
+def test_reduzir_parciais_em_qualquer_ordem():
+    vendas = _vendas()
+    partes = [agregacao_lotes.agregar_vendas(vendas.iloc[i:i + 2]) for i in range(0, len(vendas), 2)]
+    assert agregacao_lotes.verificar(reduzir_parciais(partes[::-1]), vendas) == []
+
+
+def test_verificar_aponta_diferencas():
+    vendas = _vendas()
+    resultado = agregacao_lotes.agregar([vendas])
+    resultado.loc[10, "Nome"] = "ana"
+    resultado.loc[20, "VALOR_GASTO"] += 0.01
+    assert agregacao_lotes.verificar(resultado, vendas) == [
+        "Nome: 1 clientes diferentes", "VALOR_GASTO: 1 clientes diferentes",
+    ]
+    assert agregacao_lotes.verificar(resultado.drop(index=30), vendas) == [
+        "clientes diferentes: 3 esperados, 2 em lotes",
+    ]
+
+
+def test_agregar_sem_vendas():
+    resultado = agregacao_lotes.agregar([])
+    assert resultado.empty and resultado.index.name == "ID_Cliente"
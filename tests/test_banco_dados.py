@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+
+import pytest
+
+import banco_dados
+
+
+def test_leitura_arrow_desligada_so_com_falhas_seguidas(monkeypatch):
+    arrow_odbc = pytest.importorskip("arrow_odbc")
+    monkeypatch.setattr(banco_dados, "LEITURA_ARROW", True)
+    monkeypatch.setattr(banco_dados, "_conexoes_sem_arrow", set())
+    monkeypatch.setattr(banco_dados, "_falhas_arrow", {})
+    erros = []
+
+    def ler_arrow(consulta_sql, params, dados_conexao):
+        if erros:
+            raise erros.pop(0)
+        return "arrow"
+
+    monkeypatch.setattr(banco_dados, "ler_arrow", ler_arrow)
+    monkeypatch.setattr(banco_dados, "ler_pandas", lambda consulta_sql, params, dados_conexao: "pandas")
+
+    # arrow_odbc.Error é montado a partir de um erro do driver; __new__ cria um sem ele
+    def erro_driver():
+        return arrow_odbc.Error.__new__(arrow_odbc.Error)
+
+    def ler(conexao, vezes):
+        return [banco_dados._executar_consulta("SELECT 1", None, conexao) for _ in range(vezes)]
+
+    # Erros passageiros do driver: só aquela consulta vai pelo pd.read_sql
+    erros[:] = [erro_driver() for _ in range(banco_dados.FALHAS_ARROW - 1)]
+    assert ler("a", banco_dados.FALHAS_ARROW) == ["pandas"] * (banco_dados.FALHAS_ARROW - 1) + ["arrow"]
+    assert banco_dados._conexoes_sem_arrow == set()
+
+    # Falhas seguidas do driver desligam a leitura Arrow na conexão
+    erros[:] = [erro_driver() for _ in range(banco_dados.FALHAS_ARROW)]
+    assert ler("a", banco_dados.FALHAS_ARROW + 1) == ["pandas"] * (banco_dados.FALHAS_ARROW + 1)
+    assert banco_dados._conexoes_sem_arrow == {"a"}
+
+    # Um erro de conversão do pyarrow desliga na hora
+    erros[:] = [TypeError("tipo não suportado")]
+    assert ler("b", 2) == ["pandas", "pandas"]
+    assert banco_dados._conexoes_sem_arrow == {"a", "b"}
+
+
+# Marcas d'água e relógio controlados pelo teste; um valor Exception simula a conexão fora do ar
+@pytest.fixture
+def replica(monkeypatch):
+    marcas = {"primario": 100, "replica": 100}
+    relogio = [1000.0]
+
+    def maior_id(dados_conexao):
+        if isinstance(marcas[dados_conexao], Exception):
+            raise marcas[dados_conexao]
+        return marcas[dados_conexao]
+
+    monkeypatch.setattr(banco_dados, "_maior_id", maior_id)
+    monkeypatch.setattr(banco_dados, "time", SimpleNamespace(monotonic=lambda: relogio[0]))
+    monkeypatch.setattr(banco_dados, "INTERVALO_VERIFICACAO_REPLICA", 10.0)
+    monkeypatch.setattr(banco_dados, "ATRASO_MAXIMO_REPLICA", 60.0)
+    estado = banco_dados.EstadoReplica("replica")
+
+    def verificar(primario, replica, segundos=0.0):
+        marcas.update(primario=primario, replica=replica)
+        relogio[0] += segundos
+        banco_dados._verificar_replica("primario", estado)
+        return estado
+
+    return verificar
+
+
+def test_replica_em_dia_e_alcancando_o_primario(replica):
+    estado = replica(100, 100)
+    assert (estado.em_uso, estado.atraso_s, estado.vendas_pendentes, estado.erro) == (True, 0.0, 0, None)
+
+    # A réplica ficou para trás: o atraso conta desde a primeira vez que o primário foi visto à frente
+    estado = replica(110, 100, 20)
+    assert (estado.em_uso, estado.atraso_s, estado.vendas_pendentes) == (True, 0.0, 10)
+    estado = replica(120, 105, 30)
+    assert (estado.em_uso, estado.atraso_s, estado.vendas_pendentes) == (True, 30.0, 15)
+
+    # Alcançou a marca vista primeiro: o atraso passa a contar da observação seguinte
+    estado = replica(125, 110, 20)
+    assert (estado.em_uso, estado.atraso_s, estado.vendas_pendentes) == (True, 20.0, 15)
+
+    estado = replica(125, 125, 20)
+    assert (estado.em_uso, estado.atraso_s, estado.vendas_pendentes) == (True, 0.0, 0)
+
+
+def test_replica_atrasada_alem_do_maximo_sai_de_uso(replica):
+    replica(100, 100)
+    replica(110, 100, 20)
+    estado = replica(115, 100, 61)
+    assert (estado.em_uso, estado.atraso_s, estado.vendas_pendentes) == (False, 61.0, 15)
+
+    # Dentro do intervalo nada é consultado de novo, mesmo com a réplica em dia
+    estado = replica(115, 115, 5)
+    assert estado.em_uso is False
+
+    estado = replica(115, 115, 10)
+    assert (estado.em_uso, estado.atraso_s, estado.vendas_pendentes) == (True, 0.0, 0)
+
+
+def test_falha_na_replica_ou_no_primario(replica):
+    replica(110, 100)
+    estado = replica(110, ConnectionError("réplica fora do ar"), 20)
+    assert estado.em_uso is False and "réplica fora do ar" in estado.erro
+
+    # Sem o primário o atraso é desconhecido e a réplica que respondeu volta a atender
+    estado = replica(ConnectionError("primário fora do ar"), 110, 20)
+    assert (estado.em_uso, estado.erro) == (True, None)
+
+    estado = replica(110, 110, 20)
+    assert (estado.em_uso, estado.atraso_s, estado.vendas_pendentes, estado.erro) == (True, 0.0, 0, None)
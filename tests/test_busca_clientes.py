@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from busca_clientes import IndiceNomes, normalizar
+
+
+def _indice(nomes, valores):
+    clientes = pd.DataFrame({"Nome": nomes, "VALOR_GASTO": valores},
+                            index=pd.Index(range(101, 101 + len(nomes)), name="ID_Cliente"))
+    return IndiceNomes(clientes)
+
+
+INDICE = _indice(
+    ["Maria da Silva", "MARIO SOUZA", "Ana Maria", "José  Mariano", "Joana D'Arc", "Márcia Dantas", "Pedro"],
+    [10.0, 50.0, 30.0, 20.0, 5.0, 40.0, 1.0],
+)
+
+
+def _ids(texto, limite=20):
+    return INDICE.buscar(texto, limite)["ID_Cliente"].tolist()
+
+
+def test_comeco_antes_de_qualquer_parte():
+    # Começo do nome primeiro (por valor gasto), depois os que contêm o texto
+    assert _ids("mari") == [102, 101, 103, 104]
+    assert _ids("mari", limite=3) == [102, 101, 103]
+
+
+def test_sem_acentos_e_maiusculas():
+    assert _ids("JOSE MAR") == [104]
+    assert _ids("marcia") == [106]
+    assert _ids("ma") == [102, 106, 101]
+
+
+def test_texto_entre_palavras():
+    assert _ids("da s") == [101]
+    assert _ids("a da") == [106, 101]
+    assert _ids("d'a") == [105]
+
+
+def test_id_do_cliente():
+    assert _ids("107") == [107]
+    assert _ids("") == []
+
+
+def test_igual_a_procurar_em_todos_os_nomes():
+    gerador = np.random.default_rng(0)
+    partes = ["ana", "maria", "joão", "silva", "souza", "de", "da", "lima", "ângela"]
+    nomes = [" ".join(gerador.choice(partes, gerador.integers(1, 4))) for _ in range(500)]
+    indice = _indice(nomes, gerador.random(500))
+    normalizados = normalizar(nomes)
+    for texto in ["ana", "a s", "ria d", "da", "joao", "o si", "lima", "angela de", "zz"]:
+        busca = normalizar([texto]).iloc[0]
+        esperado = set(np.flatnonzero(normalizados.str.startswith(busca)))
+        if len(busca) >= 3:
+            esperado |= set(np.flatnonzero(normalizados.str.contains(busca, regex=False)))
+        assert set(indice.buscar(texto, limite=1000)["ID_Cliente"] - 101) == esperado, texto
@@ -0,0 +1,169 @@
+import threading
+import time
+from datetime import date
+
+import pytest
+
+import banco_dados
+import cache_kpis
+
+CONEXAO = "teste"
+
+
+@pytest.fixture(autouse=True)
+def cache_vazio(monkeypatch):
+    monkeypatch.setattr(cache_kpis, "verificar_alteracoes", lambda dados_conexao: [])
+    monkeypatch.setattr(cache_kpis, "COALESCER", True)
+    cache_kpis.limpar()
+    cache_kpis.zerar_metricas()
+    yield
+    cache_kpis.limpar()
+
+
+# Chama obter() em várias threads ao mesmo tempo; devolve o valor (ou a exceção) de cada uma
+def _em_paralelo(quantidade, calcular, chave=("kpi",)):
+    barreira = threading.Barrier(quantidade)
+    resultados = [None] * quantidade
+
+    def pedir(posicao):
+        barreira.wait()
+        try:
+            resultados[posicao] = cache_kpis.obter(chave, ["Vendas"], calcular, dados_conexao=CONEXAO)
+        except Exception as e:
+            resultados[posicao] = e
+
+    threads = [threading.Thread(target=pedir, args=(posicao,)) for posicao in range(quantidade)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resultados
+
+
+def test_pedidos_simultaneos_calculam_uma_vez():
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        time.sleep(0.3)
+        return {"total": 42}
+
+    resultados = _em_paralelo(6, calcular)
+    assert len(chamadas) == 1
+    assert all(resultado is resultados[0] for resultado in resultados)
+    metricas = cache_kpis.metricas()
+    assert (metricas["execucoes"], metricas["coalescidas"], metricas["em_andamento"]) == (1, 5, 0)
+
+    # O valor fica no cache para os pedidos seguintes
+    assert cache_kpis.obter(("kpi",), ["Vendas"], calcular, dados_conexao=CONEXAO) is resultados[0]
+    assert len(chamadas) == 1
+
+
+def test_falha_do_calculo_compartilhado():
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        time.sleep(0.3)
+        if len(chamadas) == 1:
+            raise RuntimeError("falhou")
+        return "valor"
+
+    resultados = _em_paralelo(5, calcular)
+    # Quem calculou recebe o erro; quem esperava calcula de novo (uma vez só)
+    assert len(chamadas) == 2
+    assert sum(isinstance(resultado, RuntimeError) for resultado in resultados) == 1
+    assert resultados.count("valor") == 4
+
+
+def test_invalidacao_durante_o_calculo():
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        cache_kpis.invalidar("Vendas", dados_conexao=CONEXAO)
+        return len(chamadas)
+
+    assert cache_kpis.obter(("kpi",), ["Vendas"], calcular, dados_conexao=CONEXAO) == 1
+    # O valor calculado antes da invalidação não foi guardado
+    assert cache_kpis.obter(("kpi",), ["Vendas"], calcular, dados_conexao=CONEXAO) == 2
+
+
+def test_espera_interrompida_pelo_cancelamento():
+    iniciado, liberar = threading.Event(), threading.Event()
+
+    def calcular():
+        iniciado.set()
+        liberar.wait(5)
+        return "valor"
+
+    lider = threading.Thread(target=cache_kpis.obter, args=(("kpi",), ["Vendas"], calcular),
+                             kwargs={"dados_conexao": CONEXAO})
+    lider.start()
+    iniciado.wait(5)
+    cancelamento = banco_dados.Cancelamento()
+    cancelamento.cancelar()
+    try:
+        with banco_dados.cancelavel(cancelamento), pytest.raises(banco_dados.ConsultaCancelada):
+            cache_kpis.obter(("kpi",), ["Vendas"], calcular, dados_conexao=CONEXAO)
+    finally:
+        liberar.set()
+        lider.join()
+    assert cache_kpis.obter(("kpi",), ["Vendas"], calcular, dados_conexao=CONEXAO) == "valor"
+
+
+@pytest.mark.parametrize("tabela, inicio, fim, conexao, guardado", [
+    ("Vendas", date(2024, 6, 1), date(2024, 6, 1), CONEXAO, True),           # outro período
+    ("Vendas_Receber", None, None, CONEXAO, True),                           # outra tabela
+    ("Vendas", None, None, "outra loja", True),                              # outra conexão
+    ("Vendas", date(2024, 1, 31), date(2024, 6, 1), CONEXAO, False),         # sobrepõe o período
+    ("Vendas_Itens", None, None, CONEXAO, False),                            # tabela inteira
+])
+def test_invalidacao_so_descarta_o_que_atinge(tabela, inicio, fim, conexao, guardado):
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        if len(chamadas) == 1:
+            cache_kpis.invalidar(tabela, inicio, fim, conexao)
+        return len(chamadas)
+
+    def pedir():
+        return cache_kpis.obter(("cubo",), ["Vendas", "Vendas_Itens"], calcular,
+                                date(2024, 1, 1), date(2024, 1, 31), CONEXAO)
+
+    assert pedir() == 1
+    assert pedir() == (1 if guardado else 2)
+    assert cache_kpis._invalidacoes == []
+
+
+@pytest.mark.parametrize("tabela, compartilhado", [("Vendas_Receber", True), ("Vendas", False)])
+def test_pedido_apos_invalidacao_durante_o_calculo(tabela, compartilhado):
+    iniciado, liberar = threading.Event(), threading.Event()
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        iniciado.set()
+        liberar.wait(5)
+        return len(chamadas)
+
+    def pedir(resultados):
+        resultados.append(cache_kpis.obter(("kpi",), ["Vendas"], calcular, date(2024, 1, 1), date(2024, 1, 31),
+                                           dados_conexao=CONEXAO))
+
+    resultados = []
+    primeiro = threading.Thread(target=pedir, args=(resultados,))
+    primeiro.start()
+    iniciado.wait(5)
+    # Uma invalidação de uma tabela que o valor não lê não impede o segundo
+    # pedido de esperar pelo cálculo em andamento
+    cache_kpis.invalidar(tabela, None, None, CONEXAO)
+    segundo = threading.Thread(target=pedir, args=(resultados,))
+    segundo.start()
+    time.sleep(0.2)
+    liberar.set()
+    primeiro.join()
+    segundo.join()
+    assert len(chamadas) == (1 if compartilhado else 2)
+    assert cache_kpis.metricas()["coalescidas"] == (1 if compartilhado else 0)
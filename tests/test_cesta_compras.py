@@ -0,0 +1,75 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+import cesta_compras
+
+
+def _cestas(vendas, produtos, categorias):
+    linhas = [i for i, venda in enumerate(vendas) for _ in venda]
+    colunas = [produtos.index(produto) for venda in vendas for produto in venda]
+    return {
+        "matriz": cesta_compras._binaria(np.array(linhas), np.array(colunas), (len(vendas), len(produtos))),
+        "produtos": np.array(produtos, dtype=object),
+        "categorias": np.array(categorias, dtype=object),
+    }
+
+
+LOJA = _cestas(
+    [["pão", "leite", "café"], ["pão", "leite"], ["pão", "café"], ["leite"], ["pão", "leite", "café"]],
+    ["café", "leite", "pão"], ["Bebidas", "Laticínios", "Padaria"],
+)
+
+
+def test_conjuntos_e_regras():
+    resultado = cesta_compras.analisar([LOJA], suporte_minimo=0.4, confianca_minima=0.8)
+    assert resultado["vendas"] == 5
+    conjuntos = resultado["conjuntos"].set_index("Conjunto")
+    assert conjuntos["Vendas"].to_dict() == {
+        "café + pão": 3, "leite + pão": 3, "café + leite": 2, "café + leite + pão": 2,
+    }
+    # café, leite e pão estão em 3, 4 e 4 das 5 vendas
+    assert conjuntos.loc["café + pão", "Lift"] == pytest.approx((3 / 5) / (3 / 5 * 4 / 5))
+
+    regras = resultado["regras"].set_index(["Antecedente", "Consequente"])
+    assert sorted(regras.index) == [("café", "pão"), ("café + leite", "pão")]
+    assert regras.loc[("café", "pão"), "Confiança"] == pytest.approx(1.0)
+    assert regras.loc[("café", "pão"), "Suporte"] == pytest.approx(0.6)
+    assert regras.loc[("café", "pão"), "Lift"] == pytest.approx(1 / (4 / 5))
+
+
+def test_conjuntos_frequentes_igual_a_contagem_direta():
+    gerador = np.random.default_rng(0)
+    densa = gerador.random((300, 8)) < 0.35
+    matriz = sparse.csr_matrix(densa.astype(np.int32))
+    conjuntos = cesta_compras.conjuntos_frequentes(matriz, suporte_minimo=0.05, tamanho_maximo=4)
+
+    esperado = {}
+    for tamanho in range(1, 5):
+        for conjunto in combinations(range(8), tamanho):
+            quantidade = int(densa[:, list(conjunto)].all(axis=1).sum())
+            if quantidade >= 15:
+                esperado[conjunto] = quantidade
+    assert conjuntos == esperado
+
+
+def test_lojas_e_categorias():
+    outra = _cestas([["leite", "suco"], ["café", "suco"]], ["café", "leite", "suco"],
+                    ["Bebidas", "Laticínios", "Bebidas"])
+    juntas = cesta_compras.juntar_matrizes([LOJA, outra])
+    assert juntas["produtos"].tolist() == ["café", "leite", "pão", "suco"]
+    assert juntas["categorias"].tolist() == ["Bebidas", "Laticínios", "Padaria", "Bebidas"]
+
+    # Por categoria, café e suco na mesma venda contam uma vez para Bebidas
+    resultado = cesta_compras.analisar([LOJA, outra], nivel="categoria", suporte_minimo=0.01)
+    assert resultado["vendas"] == 7 and resultado["itens"] == 3
+    conjuntos = resultado["conjuntos"].set_index("Conjunto")["Vendas"].to_dict()
+    assert conjuntos["Bebidas + Laticínios"] == 3
+    assert conjuntos["Bebidas + Padaria"] == 3
+
+    # Só uma categoria: as vendas sem nenhum produto dela saem do total
+    resultado = cesta_compras.analisar([LOJA, outra], categoria="Bebidas", suporte_minimo=0.01)
+    assert resultado["vendas"] == 5
+    assert resultado["conjuntos"]["Conjunto"].tolist() == ["café + suco"]
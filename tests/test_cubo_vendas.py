@@ -0,0 +1,118 @@
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import banco_dados
+import cubo_vendas
+
+
+def _dados(semente, vendas=60):
+    gerador = np.random.default_rng(semente)
+    ids = np.arange(1, vendas + 1) + semente * 1000
+    cabecalhos = pd.DataFrame({
+        "ID_Venda": ids,
+        "Dia": pd.to_datetime("2024-03-01") + pd.to_timedelta(gerador.integers(0, 4, vendas), unit="D"),
+        "Hora": gerador.integers(8, 12, vendas),
+        "Vendedor": gerador.choice(["Ana", "Bia", None], vendas),
+        "Valor": gerador.integers(1, 100, vendas).astype(float),
+    })
+    # Várias categorias e meios na mesma venda (e categoria nula)
+    categorias = pd.DataFrame({
+        "ID_Venda": gerador.choice(ids, vendas * 2),
+        "Membro": gerador.choice(["Padaria", "Bebidas", "Limpeza", None], vendas * 2),
+        "Valor": gerador.integers(1, 50, vendas * 2).astype(float),
+    }).groupby(["ID_Venda", "Membro"], dropna=False, as_index=False)["Valor"].sum()
+    meios = pd.DataFrame({
+        "ID_Venda": np.concatenate([ids, gerador.choice(ids, vendas // 3)]),
+        "Membro": gerador.choice(["Dinheiro", "Pix", "Cartão"], vendas + vendas // 3),
+        "Valor": gerador.integers(1, 50, vendas + vendas // 3).astype(float),
+    }).groupby(["ID_Venda", "Membro"], as_index=False)["Valor"].sum()
+    return {cubo_vendas.CONSULTA_VENDAS: cabecalhos, cubo_vendas.CONSULTA_CATEGORIAS: categorias,
+            cubo_vendas.CONSULTA_MEIOS: meios}
+
+
+def _montar(monkeypatch, dados):
+    monkeypatch.setattr(banco_dados, "executar_consulta",
+                        lambda consulta_sql, params=None, dados_conexao=None: dados[consulta_sql].copy())
+    return cubo_vendas.montar_cubo("2024-03-01", "2024-03-31")
+
+
+# Mesma agregação direto nas linhas, venda a venda
+def _esperado(dados, filtros):
+    vendas = dados[cubo_vendas.CONSULTA_VENDAS].assign(
+        Dia=lambda v: v["Dia"].dt.strftime("%d/%m/%Y"),
+        Hora=lambda v: v["Hora"].map(cubo_vendas.rotulo_hora),
+        Vendedor=lambda v: v["Vendedor"].fillna("Não informado"),
+    ).set_index("ID_Venda")
+    multiplas = {
+        "Categoria": dados[cubo_vendas.CONSULTA_CATEGORIAS].fillna({"Membro": "Sem categoria"}),
+        "Meio": dados[cubo_vendas.CONSULTA_MEIOS],
+    }
+
+    def passa(dimensao):
+        selecionados = filtros[dimensao]
+        if dimensao in cubo_vendas.DIMENSOES_VENDA:
+            return vendas[dimensao].isin(selecionados)
+        return vendas.index.isin(multiplas[dimensao].loc[lambda m: m["Membro"].isin(selecionados), "ID_Venda"])
+
+    def filtradas(exceto=None):
+        mascara = np.ones(len(vendas), dtype=bool)
+        for dimensao in filtros:
+            if dimensao != exceto:
+                mascara &= np.asarray(passa(dimensao))
+        return vendas[mascara]
+
+    resultado = {}
+    for dimensao in cubo_vendas.DIMENSOES:
+        escolhidas = filtradas(dimensao)
+        if dimensao in cubo_vendas.DIMENSOES_VENDA:
+            tabela = escolhidas.groupby(dimensao).agg(Vendas=("Valor", "size"), Valor=("Valor", "sum"))
+        else:
+            linhas = multiplas[dimensao][multiplas[dimensao]["ID_Venda"].isin(escolhidas.index)]
+            tabela = linhas.groupby("Membro").agg(Vendas=("ID_Venda", "nunique"), Valor=("Valor", "sum"))
+        resultado[dimensao] = tabela
+    escolhidas = filtradas()
+    resultado["totais"] = (len(escolhidas), escolhidas["Valor"].sum())
+    return resultado
+
+
+def _conferir(cubo, dados, filtros):
+    obtido = cubo_vendas.agregar(cubo, filtros)
+    esperado = _esperado(dados, filtros)
+    for dimensao in cubo_vendas.DIMENSOES:
+        tabela = obtido[dimensao].set_index(dimensao).sort_index()
+        referencia = esperado[dimensao].sort_index()
+        assert tabela.index.tolist() == referencia.index.tolist(), (dimensao, filtros)
+        assert tabela["Vendas"].tolist() == referencia["Vendas"].tolist(), (dimensao, filtros)
+        assert tabela["Valor"].to_numpy() == pytest.approx(referencia["Valor"].to_numpy()), (dimensao, filtros)
+    assert obtido["totais"]["Vendas"] == esperado["totais"][0]
+    assert obtido["totais"]["Valor"] == pytest.approx(esperado["totais"][1])
+
+
+FILTROS = {
+    "Dia": [[], ["02/03/2024"], ["01/03/2024", "04/03/2024"]],
+    "Hora": [[], ["09:00", "10:00"]],
+    "Vendedor": [[], ["Não informado"]],
+    "Categoria": [[], ["Bebidas"], ["Padaria", "Sem categoria"]],
+    "Meio": [[], ["Pix"]],
+}
+
+
+def test_filtros_cruzados_igual_as_vendas(monkeypatch):
+    dados = _dados(1)
+    cubo = _montar(monkeypatch, dados)
+    for escolha in product(*FILTROS.values()):
+        filtros = {dimensao: membros for dimensao, membros in zip(FILTROS, escolha) if membros}
+        _conferir(cubo, dados, filtros)
+
+
+def test_juntar_cubos_de_lojas(monkeypatch):
+    partes = [_dados(1), _dados(2, vendas=40)]
+    cubos = [_montar(monkeypatch, dados) for dados in partes]
+    dados = {consulta: pd.concat([parte[consulta] for parte in partes], ignore_index=True) for consulta in partes[0]}
+    junto = cubo_vendas.juntar_cubos(cubos)
+    assert junto is cubo_vendas.juntar_cubos(cubos)
+    for filtros in ({}, {"Categoria": ["Limpeza"], "Hora": ["11:00"]}, {"Meio": ["Dinheiro"], "Vendedor": ["Bia"]}):
+        _conferir(junto, dados, filtros)
@@ -0,0 +1,62 @@
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import banco_dados
+import exportacao_campanhas
+
+
+@pytest.fixture
+def pasta(tmp_path, monkeypatch):
+    monkeypatch.setattr(exportacao_campanhas, "PASTA_EXPORTACOES", str(tmp_path))
+    return tmp_path
+
+
+def _exportar(monkeypatch, lotes, segmento, limite, formato):
+    chamadas = []
+
+    def executar_em_lotes(consulta_sql, params, tamanho_lote, dados_conexao):
+        chamadas.append((consulta_sql, params))
+        yield from lotes
+
+    monkeypatch.setattr(banco_dados, "executar_em_lotes", executar_em_lotes)
+    id_trabalho = exportacao_campanhas.iniciar_exportacao(segmento, limite, formato)
+    while (trabalho := exportacao_campanhas.estado(id_trabalho))["status"] == "executando":
+        time.sleep(0.01)
+    return trabalho, chamadas
+
+
+def _lote(ids, frequencias):
+    return pd.DataFrame({
+        "ID_Cliente": ids, "Nome": "Ana", "Telefone": "1", "Email": "a@b",
+        "FREQUENCIA_COMPRA": frequencias, "VALOR_GASTO": 1.0,
+        "ULTIMA_COMPRA": pd.Timestamp("2024-01-01"),
+    })
+
+
+def test_inativos_com_limite_inteiro(pasta, monkeypatch):
+    trabalho, chamadas = _exportar(monkeypatch, [], "inativos", 1.5, "csv")
+    assert trabalho["status"] == "concluido"
+    consulta_sql, params = chamadas[0]
+    # Enviado como texto pela leitura Arrow, o limite precisa converter para INT
+    assert params == (1,) and banco_dados._parametro_texto(params[0]) == "1"
+    assert "ID_Cliente IS NOT NULL" in consulta_sql
+    assert list(pd.read_csv(trabalho["arquivo"], sep=";").columns)[0] == "ID_Cliente"
+
+
+def test_parquet_com_tipos_fixos(pasta, monkeypatch):
+    # Um lote com ID_Cliente float (como quando a coluna tem nulos) não muda o esquema
+    lotes = [_lote([1, 2], [1, 2]), _lote([3.0, 4.0], [1.0, 3.0]), _lote([], [])]
+    trabalho, _ = _exportar(monkeypatch, lotes, "alto_valor", 100, "parquet")
+    assert trabalho["status"] == "concluido" and trabalho["linhas"] == 4
+    tabela = pq.read_table(trabalho["arquivo"])
+    assert str(tabela.schema.field("ID_Cliente").type) == "int64"
+    assert tabela.column("ID_Cliente").to_pylist() == [1, 2, 3, 4]
+
+
+def test_segmento_vazio_em_parquet(pasta, monkeypatch):
+    trabalho, _ = _exportar(monkeypatch, [], "alto_valor", 100, "parquet")
+    tabela = pq.read_table(trabalho["arquivo"])
+    assert tabela.num_rows == 0 and str(tabela.schema.field("ID_Cliente").type) == "int64"
@@ -0,0 +1,174 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import banco_dados
+import cache_kpis
+import features_clientes as fc
+
+CONEXAO = "teste_features"
+
+
+# Hoje controlado pelo teste (o corte acompanha date.today())
+class Hoje(date):
+    valor = date(2024, 3, 20)
+
+    @classmethod
+    def today(cls):
+        return cls.valor
+
+
+# Tabela Vendas em memória e as consultas do módulo sobre ela
+class Banco:
+    def __init__(self, vendas):
+        self.vendas = vendas
+        self.consultas = 0
+        parciais = fc.CONSULTA_PARCIAIS.format
+        recentes = lambda v, p: (v["Data_cx"] >= pd.Timestamp(p[0])) | (v["ID_Venda"] > p[1])
+        consolidadas = lambda v, p: (v["Data_cx"] < pd.Timestamp(p[0])) & (v["ID_Venda"] <= p[1])
+        self.condicoes = {
+            parciais(condicao=fc.CONDICAO_RECENTES): recentes,
+            parciais(condicao=fc.CONDICAO_CONSOLIDADAS): consolidadas,
+            parciais(condicao=f"{fc.CONDICAO_CONSOLIDADAS} AND {fc.CONDICAO_RECENTES}"):
+                lambda v, p: consolidadas(v, p[:2]) & recentes(v, p[2:]),
+        }
+
+    def executar_consulta(self, consulta_sql, params=None, dados_conexao=None):
+        self.consultas += 1
+        if consulta_sql == fc.CONSULTA_MAIOR_ID:
+            return pd.DataFrame({"maior_id": [self.vendas["ID_Venda"].max()]})
+        vendas = _validas(self.vendas)
+        vendas = vendas[self.condicoes[consulta_sql](vendas, params)]
+        return _groupby_completo(vendas).reset_index()
+
+    # Uma alteração na tabela chega ao cache pela marca d'água
+    def alterar(self, vendas):
+        self.vendas = vendas
+        cache_kpis.invalidar("Vendas", dados_conexao=CONEXAO)
+
+
+def _validas(vendas):
+    return vendas[vendas["ID_Cliente"].notna() & vendas["Nome"].fillna("").ne("")
+                  & vendas["Data_cx"].notna() & vendas["Valor_Liquido"].notna()]
+
+
+# O GROUP BY da base inteira, sem partes nem corte
+def _groupby_completo(vendas):
+    vendas = _validas(vendas).sort_values("ID_Venda")
+    base = vendas.groupby("ID_Cliente").agg(
+        Nome=("Nome", "last"),
+        FREQUENCIA_COMPRA=("ID_Venda", "size"),
+        VALOR_GASTO=("Valor_Liquido", "sum"),
+        PRIMEIRA_COMPRA=("Data_cx", "min"),
+        ULTIMA_COMPRA=("Data_cx", "max"),
+        ULTIMO_ID_VENDA=("ID_Venda", "max"),
+    )
+    base.index = base.index.astype("int64")
+    return base
+
+
+def _venda(id_venda, id_cliente, nome, valor, dia):
+    return {"ID_Venda": id_venda, "ID_Cliente": id_cliente, "Nome": nome, "Valor_Liquido": valor,
+            "Data_cx": pd.Timestamp(dia)}
+
+
+def _vendas(*linhas):
+    return pd.DataFrame([_venda(*linha) for linha in linhas])
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    vendas = _vendas(
+        (1, 10, "Ana", 10.0, "2024-01-05"),
+        (2, 20, "Bruno", 20.0, "2024-02-10"),
+        (3, 10, "Ana Maria", 5.0, "2024-03-01"),
+        (4, None, "Sem cliente", 99.0, "2024-03-10"),
+        (6, 30, "Carla", 7.0, "2024-03-15"),
+        (7, 20, "Bruno S", 3.0, "2024-03-19"),
+        (8, 10, "", 1.0, "2024-03-19"),
+    )
+    banco = Banco(vendas)
+    monkeypatch.setattr(banco_dados, "executar_consulta", banco.executar_consulta)
+    monkeypatch.setattr(cache_kpis, "verificar_alteracoes", lambda dados_conexao: [])
+    monkeypatch.setattr(fc, "date", Hoje)
+    monkeypatch.setattr(Hoje, "valor", date(2024, 3, 20))
+    monkeypatch.setattr(fc, "ARQUIVO_FEATURES", str(tmp_path / "features.parquet"))
+    monkeypatch.setattr(fc, "RECONSTRUIR_EM_LOTES", False)
+    _reiniciar(monkeypatch)
+    cache_kpis.limpar()
+    yield banco
+    cache_kpis.limpar()
+
+
+# Estado do módulo como em um processo novo (a base gravada continua no arquivo)
+def _reiniciar(monkeypatch):
+    for nome in ("_base", "_consolidada", "_recentes", "_corte"):
+        monkeypatch.setattr(fc, nome, None)
+
+
+def _conferir(banco):
+    base = fc.atualizar(forcar=True, dados_conexao=CONEXAO).sort_index()
+    esperado = _groupby_completo(banco.vendas)
+    pd.testing.assert_frame_equal(base[fc.COLUNAS_PARCIAIS], esperado, check_dtype=False, check_index_type=False)
+    # As duas partes não se sobrepõem: as vendas consolidadas estão todas antes do corte
+    corte_data, corte_id = fc._corte
+    assert (fc._consolidada["ULTIMO_ID_VENDA"] <= corte_id).all()
+    assert (fc._consolidada["ULTIMA_COMPRA"] < pd.Timestamp(corte_data)).all()
+    return base
+
+
+def test_base_igual_ao_groupby_completo(banco, monkeypatch):
+    _conferir(banco)
+    assert fc._corte == (date(2024, 3, 13), 8)
+
+    # Sem alteração na tabela, a atualização não consulta o banco
+    consultas, versao = banco.consultas, fc.versao()
+    _conferir(banco)
+    assert banco.consultas == consultas and fc.versao() == versao
+
+    # Cancelamento e correção de valor e nome dentro da janela
+    vendas = banco.vendas[banco.vendas["ID_Venda"] != 6].copy()
+    vendas.loc[vendas["ID_Venda"] == 7, ["Valor_Liquido", "Nome"]] = [30.0, "Bruno Souza"]
+    banco.alterar(vendas)
+    _conferir(banco)
+    assert fc.versao() == versao + 1
+
+    # Venda nova com data antiga (ID acima do corte) e venda confirmada fora de
+    # ordem (ID abaixo do maior já lido) com data na janela
+    banco.alterar(pd.concat([banco.vendas, _vendas((9, 40, "Davi", 4.0, "2024-01-20"),
+                                                   (5, 30, "Carla B", 2.0, "2024-03-18"))], ignore_index=True))
+    _conferir(banco)
+
+    # Processo novo: a parte consolidada vem do arquivo, com o mesmo corte
+    _reiniciar(monkeypatch)
+    _conferir(banco)
+    assert fc._corte == (date(2024, 3, 13), 8)
+
+
+def test_virada_do_dia_avanca_o_corte(banco):
+    _conferir(banco)
+    # Vendas que saem da janela na virada, inclusive uma de ID abaixo do corte
+    # anterior (já na parte recente pela data) e uma de ID acima dele
+    banco.alterar(pd.concat([banco.vendas, _vendas((5, 20, "Bruno", 1.5, "2024-03-14"),
+                                                   (9, 30, "Carla", 2.5, "2024-03-16"),
+                                                   (10, 40, "Davi", 4.0, "2024-03-21"))], ignore_index=True))
+    _conferir(banco)
+
+    Hoje.valor = date(2024, 3, 24)
+    _conferir(banco)
+    assert fc._corte == (date(2024, 3, 17), 10)
+    consolidados = fc._consolidada["FREQUENCIA_COMPRA"].sum()
+    assert consolidados == 6   # IDs 1, 2, 3, 5, 6, 9 (a 4 não tem cliente)
+
+    Hoje.valor = date(2024, 4, 30)
+    _conferir(banco)
+    assert fc._consolidada["FREQUENCIA_COMPRA"].sum() == 8
+
+
+def test_banco_restaurado_reconstroi_a_base(banco):
+    _conferir(banco)
+    # Backup restaurado: o maior ID_Venda volta para antes do corte
+    banco.alterar(banco.vendas[banco.vendas["ID_Venda"] <= 3])
+    _conferir(banco)
+    assert fc._corte == (date(2024, 3, 13), 3)
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import cache_kpis
+import lojas
+
+
+def test_somar_refaz_o_ranking_entre_lojas():
+    dados = pd.DataFrame({
+        "Produto": ["A", "B", "C", "A", "C", "B"],
+        "Quantidade": [5, 9, 1, 6, 7, 1],
+        "Valor": [50.0, 90.0, 10.0, 60.0, 70.0, 10.0],
+        "Loja": ["L1", "L1", "L1", "L2", "L2", "L2"],
+    })
+    combinados = lojas.somar(dados, "Produto", ["Quantidade", "Valor"], limite=2)
+    # A não é o primeiro em nenhuma loja, mas é o primeiro somando as duas
+    assert combinados["Produto"].tolist() == ["A", "B"]
+    assert combinados["Quantidade"].tolist() == [11, 10]
+    assert combinados["Valor"].tolist() == [110.0, 100.0]
+    assert "Loja" not in combinados.columns
+
+
+def test_somar_mantem_chave_nula():
+    dados = pd.DataFrame({
+        "Vendedor": ["Ana", None, "Ana", None],
+        "Valor": [1.0, 2.0, 3.0, 4.0],
+        "Loja": ["L1", "L1", "L2", "L2"],
+    })
+    combinados = lojas.somar(dados, ["Vendedor"], ["Valor"])
+    assert combinados["Valor"].tolist() == [6.0, 4.0]
+    assert pd.isna(combinados["Vendedor"].iloc[0])
+
+
+def test_somar_vazio():
+    dados = pd.DataFrame(columns=["Produto", "Valor", "Loja"])
+    assert list(lojas.somar(dados, "Produto", ["Valor"]).columns) == ["Produto", "Valor"]
+
+
+@pytest.fixture
+def sem_marcas(monkeypatch):
+    monkeypatch.setattr(cache_kpis, "verificar_alteracoes", lambda dados_conexao: [])
+
+
+def test_executar_uma_loja_sem_tempo_maximo(sem_marcas):
+    nome = next(iter(lojas.LOJAS))
+
+    def lenta(dados_conexao):
+        time.sleep(0.3)
+        return dados_conexao
+
+    partes, erros = lojas.executar(lenta, [nome], tempo_maximo=0.05)
+    assert partes == [(nome, lojas.LOJAS[nome])] and erros == {}
+
+
+def test_executar_loja_lenta_fica_de_fora(sem_marcas, monkeypatch):
+    monkeypatch.setitem(lojas.LOJAS, "Rápida", "rapida")
+    monkeypatch.setitem(lojas.LOJAS, "Lenta", "lenta")
+    canceladas = []
+
+    def funcao(dados_conexao):
+        if dados_conexao == "lenta":
+            cancelamento = lojas.banco_dados.cancelamento_atual()
+            while not cancelamento.cancelado:
+                time.sleep(0.01)
+            canceladas.append(dados_conexao)
+        return 1
+
+    partes, erros = lojas.executar(funcao, ["Rápida", "Lenta"], tempo_maximo=0.2)
+    assert partes == [("Rápida", 1)]
+    assert list(erros) == ["Lenta"]
+    # O cancelamento da loja expirada chega à thread dela
+    time.sleep(0.1)
+    assert canceladas == ["lenta"]
+
+
+def test_uma_loja_fora_da_fila_das_lojas(sem_marcas):
+    nome = next(iter(lojas.LOJAS))
+    liberar = threading.Event()
+    # Fila das lojas toda ocupada (por exemplo, por outras sessões)
+    ocupadas = [lojas._executor.submit(liberar.wait, 5) for _ in range(lojas._executor._max_workers)]
+    try:
+        # Sem verificar: na thread de quem chamou
+        partes, _ = lojas.executar(lambda dados_conexao: threading.current_thread(), [nome])
+        assert partes[0][1] is threading.current_thread()
+
+        # Com verificar: em uma thread própria, com o cancelamento do contexto
+        def lenta(dados_conexao):
+            time.sleep(0.3)
+            return threading.current_thread().name, lojas.banco_dados.cancelamento_atual() is not None
+
+        verificacoes = []
+        partes, _ = lojas.executar(lenta, [nome], verificar=lambda: verificacoes.append(1))
+        assert partes[0][1] == ("lojas-consulta", True)
+        assert verificacoes
+
+        # Montagens na fila própria
+        partes, _ = lojas.executar(lambda dados_conexao: threading.current_thread().name, [nome], montagem=True)
+        assert partes[0][1].startswith("lojas-montagem")
+    finally:
+        liberar.set()
+        for futuro in ocupadas:
+            futuro.result()
+
+
+def test_uma_loja_interrompida_cancela_a_consulta(sem_marcas):
+    nome = next(iter(lojas.LOJAS))
+    cancelamentos = []
+
+    def funcao(dados_conexao):
+        cancelamento = lojas.banco_dados.cancelamento_atual()
+        cancelamentos.append(cancelamento)
+        while not cancelamento.cancelado:
+            time.sleep(0.01)
+
+    inicio = time.monotonic()
+
+    def verificar():
+        if time.monotonic() - inicio > 0.2:
+            raise InterruptedError("rerun mais novo")
+
+    with pytest.raises(InterruptedError):
+        lojas.executar(funcao, [nome], verificar=verificar)
+    time.sleep(0.05)
+    assert cancelamentos[0].cancelado
@@ -0,0 +1,59 @@
+import builtins
+import threading
+
+import pytest
+
+import perfil_inicializacao as perfil
+
+
+@pytest.fixture(autouse=True)
+def arquivo_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(perfil, "ARQUIVO_LOG", str(tmp_path / "inicializacao.jsonl"))
+
+
+def _nomes(pagina):
+    return [etapa["nome"] for etapa in perfil.carregar_relatorios(pagina)[0]["etapas"]]
+
+
+def test_sessoes_simultaneas_restauram_o_import():
+    original = builtins.__import__
+    dentro, sair_primeira = threading.Barrier(2), threading.Event()
+
+    def sessao(modulo, finalizar):
+        perfil.iniciar("sessoes")
+        with perfil.medir_importacoes("sessoes"):
+            dentro.wait()
+            __import__(modulo)
+            # A primeira sessão a abrir o bloco sai por último
+            if finalizar:
+                sair_primeira.wait(5)
+        if not finalizar:
+            sair_primeira.set()
+        perfil.marcar("sessoes", "secao_" + modulo)
+        if finalizar:
+            perfil.finalizar("sessoes")
+
+    threads = [threading.Thread(target=sessao, args=("pyclbr", True)),
+               threading.Thread(target=sessao, args=("tabnanny", False))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert builtins.__import__ is original
+    assert _nomes("sessoes") == ["pyclbr", "secao_pyclbr"]
+    assert not [chave for chave in perfil._etapas if chave[0] == "sessoes"]
+
+
+def test_primeira_execucao_interrompida_nao_entra_no_relatorio():
+    perfil.iniciar("interrompida")
+    with perfil.medir_importacoes("interrompida"):
+        import pickletools  # noqa: F401
+    perfil.marcar("interrompida", "antes_do_stop")
+
+    perfil.iniciar("interrompida")
+    with perfil.medir_importacoes("interrompida"):
+        import pickletools  # noqa: F401,F811
+    perfil.marcar("interrompida", "fim")
+    perfil.finalizar("interrompida")
+    assert _nomes("interrompida") == ["fim"]